@@ -1,3 +1,31 @@
+"""
+Admin configuration for core
+"""
 from django.contrib import admin
+from django.utils import timezone
+from .models import BackgroundTask, PlatformStatistic
 
-# Register your models here.
+
+@admin.register(PlatformStatistic)
+class PlatformStatisticAdmin(admin.ModelAdmin):
+    list_display = ('key', 'value', 'updated_at')
+    readonly_fields = ('key', 'value', 'created_at', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+
+@admin.register(BackgroundTask)
+class BackgroundTaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'kwargs', 'attempts', 'last_error', 'created_at', 'updated_at')
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    def requeue(self, request, queryset):
+        queryset.update(status=BackgroundTask.Status.QUEUED, attempts=0, run_after=timezone.now())
+    requeue.short_description = "Requeue selected tasks"
@@ -0,0 +1,15 @@
+"""
+Recompute the denormalized platform statistics
+"""
+from django.core.management.base import BaseCommand
+from apps.core.stats import reconcile_platform_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute platform statistics from the source tables (run periodically)"
+
+    def handle(self, *args, **options):
+        stats = reconcile_platform_stats()
+        for key, value in stats.items():
+            self.stdout.write(f"{key}: {value}")
+        self.stdout.write(self.style.SUCCESS("Platform statistics reconciled"))
@@ -0,0 +1,35 @@
+"""
+Worker process for the database-backed background task queue
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.core.tasks import autodiscover, run_pending
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (start as many workers as needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help="Tasks claimed per poll")
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no tasks are due instead of polling")
+
+    def handle(self, *args, **options):
+        autodiscover()
+        total = 0
+        try:
+            while True:
+                close_old_connections()
+                ran = run_pending(options['batch_size'])
+                total += ran
+                if not ran:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Worker stopped after {total} tasks"))
@@ -2,7 +2,9 @@
 Common mixins for views and models
 """
 from django.db import models
+from django.http import Http404
 from django.utils import timezone
+from apps.core.pagination import InvalidCursor, paginate_keyset
 
 
 class TimestampMixin(models.Model):
@@ -24,4 +26,29 @@ class SEOMixin(models.Model):
                                    help_text="SEO keywords (comma separated)")
     
     class Meta:
-        abstract = True
\ No newline at end of file
+        abstract = True
+
+
+class KeysetPaginationMixin:
+    """Paginate a ListView by (created_at, id) cursor instead of page number"""
+    paginate_by = 24
+    cursor_kwarg = 'cursor'
+    keyset_ordering = '-created_at'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def get_page_url(self, cursor):
+        params = self.request.GET.copy()
+        params[self.cursor_kwarg] = cursor
+        return f"?{params.urlencode()}"
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = paginate_keyset(queryset, self.request.GET.get(self.cursor_kwarg), page_size,
+                                   ordering=self.get_keyset_ordering())
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        page.next_url = self.get_page_url(page.next_cursor) if page.has_next() else None
+        page.previous_url = self.get_page_url(page.previous_cursor) if page.has_previous() else None
+        return (None, page, page.object_list, page.has_other_pages())
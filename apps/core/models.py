@@ -1,3 +1,44 @@
+"""
+Core models shared across the platform
+"""
 from django.db import models
+from apps.core.mixins import TimestampMixin
 
-# Create your models here.
+
+class PlatformStatistic(TimestampMixin):
+    """Denormalized platform-wide counter maintained incrementally"""
+    key = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['key']
+
+    def __str__(self):
+        return f"{self.key}: {self.value}"
+
+
+class BackgroundTask(TimestampMixin):
+    """A unit of work queued in the database and run by the run_tasks worker"""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    name = models.CharField(max_length=100, help_text="Registered task name")
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED)
+    run_after = models.DateTimeField(help_text="When a queued task becomes due, or a running task's lease ends")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
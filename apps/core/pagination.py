@@ -0,0 +1,192 @@
+"""
+Keyset (cursor) pagination on (created_at, id)
+
+Pages are read by seeking past the last row of the previous page instead of
+skipping rows with OFFSET, so page 10,000 costs the same as page one as long
+as a (..., created_at, id) index backs the query. Listings sorted on another
+non-null column (e.g. price) paginate the same way on (column, id).
+
+EstimatedCountPaginator covers the other cost of paginating huge tables: the
+COUNT(*) behind page links, which it replaces with the planner's estimate.
+"""
+import base64
+import binascii
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded"""
+
+
+def encode_cursor(obj, reverse=False, field='created_at'):
+    """Encode the position of obj; reverse cursors point at the previous page"""
+    direction = 'p' if reverse else 'n'
+    raw = f"{direction}|{obj._meta.get_field(field).value_to_string(obj)}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, parse=parse_datetime):
+    """Decode a cursor into (reverse, value, pk); parse converts the value (created_at by default)"""
+    try:
+        direction, value, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        value = parse(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, ValidationError):
+        raise InvalidCursor(cursor)
+    if direction not in ('n', 'p') or value is None:
+        raise InvalidCursor(cursor)
+    return direction == 'p', value, pk
+
+
+class KeysetPage:
+    """A page of results with cursors to its neighbours"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_keyset(queryset, cursor, page_size, ordering='-created_at'):
+    """
+    Return the KeysetPage of queryset positioned at cursor, sorted on the
+    ordering field (newest first by default) and then id in the same direction
+    """
+    field = ordering.lstrip('-')
+    descending = ordering.startswith('-')
+    reverse = False
+    if cursor:
+        reverse, value, pk = decode_cursor(cursor, queryset.model._meta.get_field(field).to_python)
+        # Previous pages are read backwards from the cursor
+        descending = descending != reverse
+        lookup = 'lt' if descending else 'gt'
+        # The inclusive bound on the field alone is what lets the index
+        # range scan start at the cursor; the OR only breaks ties
+        queryset = queryset.filter(
+            Q(**{f'{field}__{lookup}': value}) | Q(**{f'pk__{lookup}': pk}), **{f'{field}__{lookup}e': value}
+        )
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}id')
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if reverse:
+        rows.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], field=field) if has_next and rows else None,
+        previous_cursor=encode_cursor(rows[0], reverse=True, field=field) if has_previous and rows else None,
+    )
+
+
+class KeysetPagination(BasePagination):
+    """DRF pagination backed by paginate_keyset"""
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering = '-created_at'
+
+    def get_ordering(self, view):
+        """The view's get_keyset_ordering() when it has one"""
+        if view is not None and hasattr(view, 'get_keyset_ordering'):
+            return view.get_keyset_ordering()
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        try:
+            self.page = paginate_keyset(
+                queryset, request.query_params.get(self.cursor_query_param), self.page_size,
+                ordering=self.get_ordering(view),
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+def estimated_row_count(model, using='default'):
+    """The planner's row estimate for model's table, or None when unavailable"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                       [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 until the table has been vacuumed or analyzed
+    return row[0] if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the table's estimated row count for unfiltered
+    querysets on large tables; filtered or small ones are counted exactly.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_count_threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,23 @@
+"""
+Shared serializer helpers
+"""
+
+
+class SparseFieldsetMixin:
+    """
+    Let clients pick fields with ?fields=a,b,c. Unknown names are ignored and
+    an empty or missing parameter keeps every field.
+    """
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        requested = request.query_params.get(self.fields_query_param)
+        if not requested:
+            return
+        allowed = {name.strip() for name in requested.split(',') if name.strip()}
+        for name in set(self.fields) - allowed:
+            self.fields.pop(name)
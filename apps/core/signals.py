@@ -0,0 +1,102 @@
+"""
+Signal handlers keeping platform statistics up to date
+
+Whether a saved product or user was counted before is judged from the
+values it was loaded with, so saving an instance does not read its row
+again first.
+"""
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from apps.accounts.models import User
+from apps.orders.models import Order
+from apps.products.models import Product
+from .stats import adjust_stat, PRODUCTS_COUNT, ORDERS_COUNT, CUSTOMERS_COUNT
+
+
+def _counted_product(status):
+    return status == Product.Status.ACTIVE
+
+
+def _counted_user(is_staff):
+    return not is_staff
+
+
+def _loaded(instance, field):
+    """Remember a field's value as loaded from the database, if it was"""
+    if instance.pk is not None and field in instance.__dict__:
+        instance._stats_loaded = getattr(instance, field)
+
+
+def _was_counted(sender, instance, field, counted):
+    """
+    Whether the stored row is counted, judged from the value it was loaded
+    with; only rows saved without having been loaded (an explicit pk or a
+    deferred field) are looked up
+    """
+    if instance.pk is None:
+        return False
+    if not instance._state.adding and hasattr(instance, '_stats_loaded'):
+        return counted(instance._stats_loaded)
+    value = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    return value is not None and counted(value)
+
+
+@receiver(post_init, sender=Product)
+def remember_product_status(sender, instance, **kwargs):
+    _loaded(instance, 'status')
+
+
+@receiver(pre_save, sender=Product)
+def check_product_counted(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._stats_was_counted = _was_counted(sender, instance, 'status', _counted_product)
+
+
+@receiver(post_save, sender=Product)
+def update_products_count(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    adjust_stat(PRODUCTS_COUNT, int(_counted_product(instance.status)) - int(instance._stats_was_counted))
+    instance._stats_loaded = instance.status
+
+
+@receiver(post_delete, sender=Product)
+def decrement_products_count(sender, instance, **kwargs):
+    if _counted_product(instance.status):
+        adjust_stat(PRODUCTS_COUNT, -1)
+
+
+@receiver(post_save, sender=Order)
+def increment_orders_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_stat(ORDERS_COUNT, 1)
+
+
+@receiver(post_delete, sender=Order)
+def decrement_orders_count(sender, instance, **kwargs):
+    adjust_stat(ORDERS_COUNT, -1)
+
+
+@receiver(post_init, sender=User)
+def remember_customer_state(sender, instance, **kwargs):
+    _loaded(instance, 'is_staff')
+
+
+@receiver(pre_save, sender=User)
+def check_customer_counted(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._stats_was_counted = _was_counted(sender, instance, 'is_staff', _counted_user)
+
+
+@receiver(post_save, sender=User)
+def update_customers_count(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    adjust_stat(CUSTOMERS_COUNT, int(_counted_user(instance.is_staff)) - int(instance._stats_was_counted))
+    instance._stats_loaded = instance.is_staff
+
+
+@receiver(post_delete, sender=User)
+def decrement_customers_count(sender, instance, **kwargs):
+    if _counted_user(instance.is_staff):
+        adjust_stat(CUSTOMERS_COUNT, -1)
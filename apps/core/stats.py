@@ -0,0 +1,77 @@
+"""
+Platform statistics for the IKr Business Platform
+
+Counters are kept in PlatformStatistic rows, adjusted from model signals and
+served from the cache, so reading them never runs an aggregate query. The
+reconcile_stats management command recomputes them from scratch.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from apps.core.models import PlatformStatistic
+
+PRODUCTS_COUNT = 'products_count'
+ORDERS_COUNT = 'orders_count'
+CUSTOMERS_COUNT = 'customers_count'
+STAT_KEYS = (PRODUCTS_COUNT, ORDERS_COUNT, CUSTOMERS_COUNT)
+
+STATS_CACHE_KEY = 'core:platform_stats'
+
+
+def _cache_timeout():
+    return getattr(settings, 'PLATFORM_STATS_CACHE_TIMEOUT', 60)
+
+
+def compute_platform_stats():
+    """Count the statistics directly from the source tables"""
+    from apps.products.models import Product
+    from apps.orders.models import Order
+    from apps.accounts.models import User
+
+    return {
+        PRODUCTS_COUNT: Product.objects.filter(status=Product.Status.ACTIVE).count(),
+        ORDERS_COUNT: Order.objects.count(),
+        CUSTOMERS_COUNT: User.objects.filter(is_staff=False).count(),
+    }
+
+
+def reconcile_platform_stats():
+    """Overwrite the stored counters with freshly computed values"""
+    stats = compute_platform_stats()
+    with transaction.atomic():
+        for key, value in stats.items():
+            PlatformStatistic.objects.update_or_create(key=key, defaults={'value': value})
+    cache.set(STATS_CACHE_KEY, stats, _cache_timeout())
+    return stats
+
+
+def get_platform_stats():
+    """Get the platform statistics, at most PLATFORM_STATS_CACHE_TIMEOUT seconds stale"""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is not None:
+        return stats
+
+    stats = dict(PlatformStatistic.objects.filter(key__in=STAT_KEYS).values_list('key', 'value'))
+    if len(stats) < len(STAT_KEYS):
+        # Counters have never been seeded
+        return reconcile_platform_stats()
+
+    cache.set(STATS_CACHE_KEY, stats, _cache_timeout())
+    return stats
+
+
+def adjust_stat(key, delta):
+    """Adjust a counter by delta once the current transaction commits"""
+    if not delta:
+        return
+
+    def apply():
+        PlatformStatistic.objects.filter(key=key).update(
+            value=F('value') + delta, updated_at=timezone.now()
+        )
+
+    # Applied after commit so the counter row is never locked for the
+    # duration of the writer's transaction
+    transaction.on_commit(apply)
@@ -0,0 +1,111 @@
+"""
+Database-backed background task queue
+
+Functions decorated with @task are registered by name and queued with
+enqueue(); the run_tasks management command claims due tasks with
+SELECT ... FOR UPDATE SKIP LOCKED so any number of workers can share the
+queue without a broker. A claimed task holds a lease (run_after) and is
+picked up again if its worker dies before finishing it, unless that was
+its last allowed attempt. Failed tasks are retried with exponential backoff
+until max_attempts is reached.
+
+Apps define their tasks in a tasks.py module, which the worker imports.
+"""
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+from .models import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name=None, max_attempts=3):
+    """Register a function as a background task"""
+    def register(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        _registry[task_name] = func
+        func.task_name = task_name
+        func.max_attempts = max_attempts
+        return func
+    return register
+
+
+def autodiscover():
+    """Import every installed app's tasks module so its tasks are registered"""
+    autodiscover_modules('tasks')
+
+
+def enqueue(func, delay=0, **kwargs):
+    """Queue func(**kwargs) to run in a worker; kwargs must be JSON-serializable"""
+    return BackgroundTask.objects.create(
+        name=func.task_name,
+        kwargs=kwargs,
+        max_attempts=func.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def _lease_seconds():
+    return getattr(settings, 'BACKGROUND_TASK_LEASE_SECONDS', 300)
+
+
+def claim(limit=10):
+    """Claim up to limit due tasks for this worker"""
+    now = timezone.now()
+    with transaction.atomic():
+        # A task whose worker died during its last allowed attempt is not run again
+        BackgroundTask.objects.filter(
+            status=BackgroundTask.Status.RUNNING, run_after__lte=now, attempts__gte=F('max_attempts')
+        ).update(status=BackgroundTask.Status.FAILED, last_error="Worker stopped during the last attempt",
+                 updated_at=now)
+        claimed = list(BackgroundTask.objects.filter(
+            status__in=[BackgroundTask.Status.QUEUED, BackgroundTask.Status.RUNNING], run_after__lte=now
+        ).order_by('run_after', 'id').select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+        BackgroundTask.objects.filter(pk__in=claimed).update(
+            status=BackgroundTask.Status.RUNNING,
+            run_after=now + timedelta(seconds=_lease_seconds()),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+    return list(BackgroundTask.objects.filter(pk__in=claimed).order_by('run_after', 'id'))
+
+
+def run(background_task):
+    """Run one claimed task and record its outcome"""
+    func = _registry.get(background_task.name)
+    try:
+        if func is None:
+            raise LookupError(f"Unknown task {background_task.name!r}")
+        func(**background_task.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Background task %s failed", background_task)
+        if func is not None and background_task.attempts < background_task.max_attempts:
+            status = BackgroundTask.Status.QUEUED
+            run_after = timezone.now() + timedelta(seconds=2 ** background_task.attempts)
+        else:
+            status = BackgroundTask.Status.FAILED
+            run_after = background_task.run_after
+        BackgroundTask.objects.filter(pk=background_task.pk).update(
+            status=status, run_after=run_after, last_error=error, updated_at=timezone.now()
+        )
+        return False
+    BackgroundTask.objects.filter(pk=background_task.pk).update(
+        status=BackgroundTask.Status.DONE, last_error='', updated_at=timezone.now()
+    )
+    return True
+
+
+def run_pending(limit=10):
+    """Claim and run a batch of due tasks; returns how many ran"""
+    tasks = claim(limit)
+    for background_task in tasks:
+        run(background_task)
+    return len(tasks)
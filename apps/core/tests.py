@@ -1,3 +1,226 @@
+import base64
+import io
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.orders.models import Order
+from apps.products.models import Category, Product
+from .models import BackgroundTask, PlatformStatistic
+from .pagination import InvalidCursor, KeysetPagination, decode_cursor, encode_cursor, paginate_keyset
+from .stats import CUSTOMERS_COUNT, ORDERS_COUNT, PRODUCTS_COUNT, get_platform_stats, reconcile_platform_stats
+from .tasks import claim, enqueue, run_pending, task
+from .utils import generate_unique_slug
 
-# Create your tests here.
+
+class UniqueSlugTests(TestCase):
+    """Slug allocation cost must not grow with the number of collisions"""
+
+    def test_query_count_is_constant(self):
+        Category.objects.create(name='T-Shirt')
+        with self.assertNumQueries(1):
+            self.assertEqual(generate_unique_slug(Category, 'T-Shirt'), 't-shirt-1')
+
+        for _ in range(40):
+            Category.objects.create(name='T-Shirt')
+        with self.assertNumQueries(1):
+            self.assertEqual(generate_unique_slug(Category, 'T-Shirt'), 't-shirt-41')
+
+    def test_similar_slugs_do_not_collide(self):
+        Category.objects.create(name='T-Shirt', slug='t-shirt')
+        Category.objects.create(name='T-Shirt Dress', slug='t-shirt-dress')
+        Category.objects.create(name='T-Shirt', slug='t-shirt-2')
+        self.assertEqual(generate_unique_slug(Category, 'T-Shirt'), 't-shirt-1')
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Item {i}', description='Item', base_price=10 + i % 3,
+                                                status=Product.Status.ACTIVE) for i in range(7)]
+        # Equal timestamps: only the id breaks ties
+        Product.objects.update(created_at=timezone.now())
+
+    def walk(self, ordering, page_size=3):
+        """Pages forward to the end, then back to the start through the previous cursors"""
+        queryset = Product.objects.all()
+        forward, page = [], paginate_keyset(queryset, None, page_size, ordering)
+        forward.append([p.pk for p in page])
+        while page.has_next():
+            page = paginate_keyset(queryset, page.next_cursor, page_size, ordering)
+            forward.append([p.pk for p in page])
+        backward = [[p.pk for p in page]]
+        while page.has_previous():
+            page = paginate_keyset(queryset, page.previous_cursor, page_size, ordering)
+            backward.insert(0, [p.pk for p in page])
+        return forward, backward
+
+    def test_cursor_round_trip(self):
+        product = self.products[3]
+        product.refresh_from_db()
+        self.assertEqual(decode_cursor(encode_cursor(product, reverse=True)),
+                         (True, product.created_at, product.pk))
+        price = Product._meta.get_field('effective_price').to_python
+        self.assertEqual(decode_cursor(encode_cursor(product, field='effective_price'), price),
+                         (False, product.effective_price, product.pk))
+
+    def test_pages_break_ties_on_id_both_ways(self):
+        ids = sorted(p.pk for p in self.products)
+        forward, backward = self.walk('-created_at')
+        self.assertEqual(forward, [ids[::-1][:3], ids[::-1][3:6], ids[::-1][6:]])
+        self.assertEqual(backward, forward)
+
+        forward, backward = self.walk('effective_price')
+        flat = [pk for page in forward for pk in page]
+        self.assertEqual(sorted(flat), ids)
+        self.assertEqual(flat, sorted(ids, key=lambda pk: (Product.objects.get(pk=pk).effective_price, pk)))
+        self.assertEqual(backward, forward)
+
+    def test_invalid_cursors(self):
+        bad = ['x|2024-01-01T00:00:00+00:00|1', 'n|yesterday|1', 'n|2024-01-01T00:00:00+00:00|one', 'n|1']
+        for cursor in ['garbage'] + [base64.urlsafe_b64encode(raw.encode()).decode() for raw in bad]:
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+        self.assertEqual(self.client.get('/api/v1/products/', {'cursor': 'garbage'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('products:product_list'), {'cursor': 'garbage'}).status_code, 404)
+
+    def test_api_links_follow_the_pages(self):
+        self.addCleanup(setattr, KeysetPagination, 'page_size', KeysetPagination.page_size)
+        KeysetPagination.page_size = 3
+        response = self.client.get('/api/v1/products/').json()
+        self.assertIsNone(response['previous'])
+        second = self.client.get(response['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], response['results'])
+
+
+class PlatformStatsTests(TestCase):
+    """Signals keep the counters in step with the tables without recounting them"""
+
+    def setUp(self):
+        cache.clear()
+        reconcile_platform_stats()
+
+    def counters(self):
+        return dict(PlatformStatistic.objects.values_list('key', 'value'))
+
+    def change(self, func):
+        """Counter deltas from running func and committing"""
+        before = self.counters()
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+        after = self.counters()
+        return {key: after[key] - before[key] for key in after if after[key] != before[key]}
+
+    def test_product_create_status_change_and_delete(self):
+        def create(status):
+            return Product.objects.create(name='Lamp', description='Lamp', base_price=10, status=status)
+
+        self.assertEqual(self.change(lambda: create(Product.Status.ACTIVE)), {PRODUCTS_COUNT: 1})
+        self.assertEqual(self.change(lambda: create(Product.Status.DRAFT)), {})
+        draft = Product.objects.get(status=Product.Status.DRAFT)
+
+        def publish():
+            draft.status = Product.Status.ACTIVE
+            with CaptureQueriesContext(connection) as captured:
+                draft.save()
+            # The previous status comes from the loaded instance, not a query
+            self.assertFalse([q for q in captured if q['sql'].startswith('SELECT "products_product"."status"')])
+
+        self.assertEqual(self.change(publish), {PRODUCTS_COUNT: 1})
+        self.assertEqual(self.change(draft.save), {})
+        self.assertEqual(self.change(draft.delete), {PRODUCTS_COUNT: -1})
+        self.assertEqual(self.change(lambda: Product.objects.get().delete()), {PRODUCTS_COUNT: -1})
+
+    def test_customers_and_orders(self):
+        self.assertEqual(self.change(lambda: User.objects.create(username='customer', email='c@example.com')),
+                         {CUSTOMERS_COUNT: 1})
+        customer = User.objects.get(username='customer')
+        self.assertEqual(self.change(lambda: User.objects.create(username='staff', email='s@example.com',
+                                                                 is_staff=True)), {})
+
+        def promote():
+            user = User.objects.get(pk=customer.pk)
+            user.is_staff = True
+            user.save()
+
+        self.assertEqual(self.change(promote), {CUSTOMERS_COUNT: -1})
+        self.assertEqual(self.change(lambda: Order.objects.create(customer=customer, total_amount=10)),
+                         {ORDERS_COUNT: 1})
+        self.assertEqual(self.change(lambda: Order.objects.get().delete()), {ORDERS_COUNT: -1})
+
+    def test_reconcile_command_recounts(self):
+        Product.objects.create(name='Lamp', description='Lamp', base_price=10, status=Product.Status.ACTIVE)
+        PlatformStatistic.objects.filter(key=PRODUCTS_COUNT).update(value=42)
+        cache.clear()
+        self.assertEqual(get_platform_stats()[PRODUCTS_COUNT], 42)
+
+        out = io.StringIO()
+        call_command('reconcile_stats', stdout=out)
+        self.assertIn(f'{PRODUCTS_COUNT}: 1', out.getvalue())
+        self.assertEqual(get_platform_stats()[PRODUCTS_COUNT], 1)
+        self.assertEqual(self.counters()[PRODUCTS_COUNT], 1)
+
+
+attempts = []
+
+
+@task(name='tests.flaky', max_attempts=2)
+def flaky(fail_times):
+    attempts.append(fail_times)
+    if len(attempts) <= fail_times:
+        raise RuntimeError("Temporary failure")
+
+
+class BackgroundTaskTests(TestCase):
+
+    def setUp(self):
+        attempts.clear()
+
+    def make_due(self, background_task):
+        BackgroundTask.objects.filter(pk=background_task.pk).update(run_after=timezone.now())
+
+    def test_failed_task_is_retried_with_backoff(self):
+        queued = enqueue(flaky, fail_times=1)
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, BackgroundTask.Status.QUEUED)
+        self.assertGreater(queued.run_after, timezone.now())
+        self.assertIn('Temporary failure', queued.last_error)
+        self.assertEqual(run_pending(), 0)
+
+        self.make_due(queued)
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (BackgroundTask.Status.DONE, 2))
+
+    def test_task_fails_after_max_attempts(self):
+        queued = enqueue(flaky, fail_times=5)
+        run_pending()
+        self.make_due(queued)
+        run_pending()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, BackgroundTask.Status.FAILED)
+        self.assertEqual(len(attempts), 2)
+
+    def test_abandoned_task_is_reclaimed_after_its_lease(self):
+        queued = enqueue(flaky, fail_times=0)
+        self.assertEqual(len(claim()), 1)
+        self.assertEqual(claim(), [])
+        self.make_due(queued)
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, BackgroundTask.Status.DONE)
+
+    def test_abandoned_last_attempt_is_not_rerun(self):
+        queued = enqueue(flaky, fail_times=0)
+        BackgroundTask.objects.filter(pk=queued.pk).update(max_attempts=1)
+        self.assertEqual(len(claim()), 1)
+        self.make_due(queued)
+        self.assertEqual(run_pending(), 0)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (BackgroundTask.Status.FAILED, 1))
+        self.assertEqual(attempts, [])
@@ -1,22 +1,51 @@
 """
 Core utilities for the IKr Business Platform
 """
+import re
 import uuid
+from django.db import IntegrityError, transaction
 from django.utils.text import slugify
 from django.core.files.storage import default_storage
 
 
-def generate_unique_slug(model_class, title, slug_field='slug'):
-    """Generate a unique slug for a model instance"""
-    base_slug = slugify(title)
-    slug = base_slug
+def next_free_slug(base_slug, taken):
+    """Return base_slug or the first base_slug-N not in taken"""
+    if base_slug not in taken:
+        return base_slug
     counter = 1
-    
-    while model_class.objects.filter(**{slug_field: slug}).exists():
-        slug = f"{base_slug}-{counter}"
+    while f"{base_slug}-{counter}" in taken:
         counter += 1
-    
-    return slug
+    return f"{base_slug}-{counter}"
+
+
+def generate_unique_slug(model_class, title, slug_field='slug', reserved=()):
+    """Generate a unique slug for a model instance with a single query, avoiding reserved slugs"""
+    base_slug = slugify(title)
+    # startswith lets Postgres use the slug's pattern index; the regex then
+    # keeps only the base slug and its numbered siblings
+    taken = set(model_class.objects.filter(**{
+        f'{slug_field}__startswith': base_slug,
+        f'{slug_field}__regex': rf'^{re.escape(base_slug)}(-[0-9]+)?$',
+    }).values_list(slug_field, flat=True))
+    return next_free_slug(base_slug, taken.union(reserved))
+
+
+def save_with_unique_slug(instance, title, save, *args, slug_field='slug', reserved=(), attempts=3, **kwargs):
+    """
+    Assign a unique slug and call save(*args, **kwargs), allocating a new slug
+    and retrying when a concurrent writer claimed the same one first.
+    """
+    model_class = type(instance)
+    for attempt in range(attempts):
+        slug = generate_unique_slug(model_class, title, slug_field, reserved)
+        setattr(instance, slug_field, slug)
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            lost_race = model_class.objects.filter(**{slug_field: slug}).exists()
+            if not lost_race or attempt == attempts - 1:
+                raise
 
 
 def generate_sku():
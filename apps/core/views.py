@@ -1,18 +1,22 @@
 """
 Core views for the application
 """
+from django.conf import settings
 from django.shortcuts import render
 from django.views.generic import TemplateView
-from django.db.models import Count
 from apps.products.models import Product
-from apps.orders.models import Order
-from apps.accounts.models import User
+from apps.products.cache import CatalogCacheMixin
+from apps.core.stats import get_platform_stats
 
 
-class HomeView(TemplateView):
+class HomeView(CatalogCacheMixin, TemplateView):
     """Home page view with statistics"""
     template_name = 'home.html'
 
+    def get_catalog_cache_timeout(self):
+        # The page embeds platform statistics, so keep their staleness bound
+        return getattr(settings, 'PLATFORM_STATS_CACHE_TIMEOUT', 60)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -21,16 +25,12 @@ class HomeView(TemplateView):
         context['SITE_NAME'] = getattr(settings, 'META_SITE_NAME', 'IKr Platform')
 
         # Get platform statistics
-        context['stats'] = {
-            'products_count': Product.objects.filter(status='active').count(),
-            'orders_count': Order.objects.count(),
-            'customers_count': User.objects.filter(is_staff=False).count(),
-        }
+        context['stats'] = get_platform_stats()
 
         # Get featured products
         context['featured_products'] = Product.objects.filter(
             status='active', featured=True
-        )[:6]
+        ).with_prices()[:6]
 
         return context
 
@@ -2,8 +2,15 @@
 Admin configuration for orders
 """
 from django.contrib import admin
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
-from .models import Order, OrderItem, Payment, ShippingMethod, Coupon
+from apps.core.pagination import EstimatedCountPaginator
+from .models import (Order, OrderItem, Payment, MpesaCallback, Refund, RefundItem, ShippingMethod, TaxRate,
+                     Coupon, CouponRedemption)
+from .payments import resolve_payments
+from .refunds import cancel_refund, process_refunds, resolve_refunds, retry_refunds
+from .totals import recalculate_totals
 
 
 class OrderItemInline(admin.TabularInline):
@@ -24,6 +31,10 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_number', 'customer', 'status', 'payment_status', 
                    'total_amount', 'items_count', 'created_at')
     list_filter = ('status', 'payment_status', 'created_at', 'shipping_country')
+    date_hierarchy = 'created_at'
+    paginator = EstimatedCountPaginator
+    # Skip the second COUNT(*) over the whole table on filtered changelists
+    show_full_result_count = False
     search_fields = ('order_number', 'customer__username', 'customer__email', 
                     'shipping_name', 'shipping_email')
     readonly_fields = ('order_number', 'subtotal', 'tax_amount', 'total_amount', 
@@ -63,6 +74,18 @@ class OrderAdmin(admin.ModelAdmin):
     
     actions = ['mark_as_confirmed', 'mark_as_shipped', 'calculate_totals']
     
+    def get_queryset(self, request):
+        quantities = (OrderItem.objects.filter(order=OuterRef('pk'))
+                      .order_by().values('order').annotate(total=Sum('quantity')).values('total'))
+        return super().get_queryset(request).select_related('customer').annotate(
+            _items_count=Coalesce(Subquery(quantities), 0)
+        )
+    
+    def items_count(self, obj):
+        return obj._items_count
+    items_count.short_description = 'Items'
+    items_count.admin_order_field = '_items_count'
+    
     def mark_as_confirmed(self, request, queryset):
         queryset.update(status=Order.Status.CONFIRMED)
     mark_as_confirmed.short_description = "Mark selected orders as confirmed"
@@ -73,9 +96,9 @@ class OrderAdmin(admin.ModelAdmin):
     mark_as_shipped.short_description = "Mark selected orders as shipped"
     
     def calculate_totals(self, request, queryset):
-        for order in queryset:
-            order.calculate_totals()
-    calculate_totals.short_description = "Recalculate totals for selected orders"
+        changed = recalculate_totals(queryset)
+        self.message_user(request, f"Recalculated totals; {changed} order(s) changed.")
+    calculate_totals.short_description = "Recalculate totals for selected unpaid orders"
 
 
 @admin.register(Payment)
@@ -84,15 +107,86 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ('method', 'status', 'created_at')
     search_fields = ('order__order_number', 'transaction_id', 'mpesa_receipt')
     readonly_fields = ('created_at', 'updated_at')
+    actions = ['resolve_paid', 'resolve_failed']
+    
+    def resolve_paid(self, request, queryset):
+        self.message_user(request, f"{resolve_payments(queryset, succeeded=True)} payment(s) marked as paid.")
+    resolve_paid.short_description = "Mark selected unanswered M-Pesa prompts as paid (checked with Safaricom)"
+    
+    def resolve_failed(self, request, queryset):
+        self.message_user(request, f"{resolve_payments(queryset, succeeded=False)} payment(s) marked as failed.")
+    resolve_failed.short_description = "Mark selected unanswered M-Pesa prompts as failed (checked with Safaricom)"
+
+
+class RefundItemInline(admin.TabularInline):
+    model = RefundItem
+    extra = 0
+    raw_id_fields = ('order_item',)
+
+
+@admin.register(Refund)
+class RefundAdmin(admin.ModelAdmin):
+    list_display = ('payment', 'amount', 'status', 'restock', 'processed_at', 'created_at')
+    list_filter = ('status', 'restock', 'created_at')
+    search_fields = ('payment__order__order_number', 'gateway_reference')
+    list_select_related = ('payment__order',)
+    raw_id_fields = ('payment', 'requested_by')
+    readonly_fields = ('status', 'gateway_reference', 'gateway_response', 'processed_at',
+                       'created_at', 'updated_at')
+    inlines = [RefundItemInline]
+    actions = ['process_now', 'retry_failed', 'cancel_requested', 'resolve_succeeded', 'resolve_failed']
+    
+    def process_now(self, request, queryset):
+        counts = process_refunds(queryset)
+        summary = ', '.join(f"{count} {status}" for status, count in counts.items()) or 'nothing to process'
+        self.message_user(request, f"Processed refunds: {summary}.")
+    process_now.short_description = "Submit selected requested refunds now"
+    
+    def retry_failed(self, request, queryset):
+        self.message_user(request, f"{retry_refunds(queryset)} failed refund(s) queued again.")
+    retry_failed.short_description = "Retry selected failed refunds"
+    
+    def cancel_requested(self, request, queryset):
+        requested = queryset.filter(status=Refund.Status.REQUESTED)
+        for refund in requested:
+            cancel_refund(refund)
+        self.message_user(request, f"{len(requested)} requested refund(s) cancelled.")
+    cancel_requested.short_description = "Cancel selected requested refunds"
+    
+    def resolve_succeeded(self, request, queryset):
+        self.message_user(request, f"{resolve_refunds(queryset, succeeded=True)} refund(s) marked as succeeded.")
+    resolve_succeeded.short_description = "Mark selected unknown refunds as paid out (checked with the gateway)"
+    
+    def resolve_failed(self, request, queryset):
+        self.message_user(request, f"{resolve_refunds(queryset, succeeded=False)} refund(s) marked as failed.")
+    resolve_failed.short_description = "Mark selected unknown refunds as not paid out (checked with the gateway)"
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ('checkout_request_id', 'result_code', 'payment', 'processed_at', 'created_at')
+    list_filter = ('result_code',)
+    search_fields = ('checkout_request_id',)
+    list_select_related = ('payment__order',)
+    readonly_fields = ('checkout_request_id', 'result_code', 'payload', 'payment', 'processed_at',
+                       'created_at', 'updated_at')
 
 
 @admin.register(ShippingMethod)
 class ShippingMethodAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'estimated_days', 'is_active')
+    list_display = ('name', 'price', 'free_over', 'estimated_days', 'available_countries', 'is_active')
     list_filter = ('is_active',)
     search_fields = ('name', 'description')
 
 
+@admin.register(TaxRate)
+class TaxRateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'rate', 'category', 'country', 'is_active')
+    list_filter = ('is_active', 'country')
+    search_fields = ('name', 'category__name', 'country')
+    list_select_related = ('category',)
+
+
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
     list_display = ('code', 'name', 'discount_display', 'usage_display', 
@@ -100,6 +194,9 @@ class CouponAdmin(admin.ModelAdmin):
     list_filter = ('discount_type', 'is_active', 'first_order_only', 'valid_from')
     search_fields = ('code', 'name', 'description')
     readonly_fields = ('usage_count', 'created_at', 'updated_at')
+    # Generated single-use codes can run into the millions
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def discount_display(self, obj):
         if obj.discount_type == obj.DiscountType.FIXED:
@@ -112,4 +209,13 @@ class CouponAdmin(admin.ModelAdmin):
         if obj.usage_limit:
             return f"{obj.usage_count}/{obj.usage_limit}"
         return f"{obj.usage_count}/∞"
-    usage_display.short_description = 'Usage'
\ No newline at end of file
+    usage_display.short_description = 'Usage'
+
+
+@admin.register(CouponRedemption)
+class CouponRedemptionAdmin(admin.ModelAdmin):
+    list_display = ('coupon', 'customer', 'order', 'discount_amount', 'created_at')
+    search_fields = ('coupon__code', 'order__order_number', 'customer__email')
+    list_select_related = ('coupon', 'customer', 'order')
+    raw_id_fields = ('coupon', 'customer', 'order')
+    readonly_fields = ('created_at', 'updated_at')
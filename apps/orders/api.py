@@ -1,9 +1,19 @@
 """
 API Views for the orders app
 """
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from . import cart as carts
+from .checkout import CheckoutError, checkout
 from .models import Order
-from .serializers import OrderSerializer
+from .pricing import PricingError, quote
+from .serializers import (CartItemAddSerializer, CartItemUpdateSerializer, CartSerializer,
+                          CheckoutSerializer, OrderSerializer, ShippingQuoteRequestSerializer,
+                          ShippingQuoteSerializer)
 
 
 class OrderViewSet(viewsets.ReadOnlyModelViewSet):
@@ -18,4 +28,102 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
         This view should return a list of all the purchases
         for the currently authenticated user.
         """
-        return Order.objects.filter(customer=self.request.user)
\ No newline at end of file
+        return Order.objects.filter(customer=self.request.user)
+
+
+class CartViewSet(viewsets.ViewSet):
+    """
+    API endpoint for the current user's (or anonymous session's) cart.
+    """
+    # Browsers keep their cart through the session, API clients through JWT
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.AllowAny]
+    serializer_class = CartSerializer
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # DRF only checks CSRF for session-authenticated users, but an
+        # anonymous visitor's cart is reached through the session cookie too
+        if request.method not in permissions.SAFE_METHODS and not request.user.is_authenticated:
+            SessionAuthentication().enforce_csrf(request)
+
+    def cart_response(self, cart, status_code=status.HTTP_200_OK):
+        return Response(CartSerializer(carts.cart_summary(cart)).data, status=status_code)
+
+    def list(self, request):
+        return self.cart_response(carts.get_cart(request))
+
+    @action(detail=False, methods=['post'], serializer_class=CartItemAddSerializer)
+    def items(self, request):
+        """Add a product or variant to the cart"""
+        serializer = CartItemAddSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = carts.get_cart(request, create=True)
+        carts.add_item(cart, serializer.validated_data['product'],
+                       serializer.validated_data.get('variant'), serializer.validated_data['quantity'])
+        return self.cart_response(cart, status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['patch', 'delete'], url_path=r'items/(?P<item_id>[0-9]+)',
+            serializer_class=CartItemUpdateSerializer)
+    def item(self, request, item_id=None):
+        """Change the quantity of a cart line, or remove it"""
+        cart = carts.get_cart(request)
+        if request.method == 'DELETE':
+            found = cart is not None and carts.remove_item(cart, item_id)
+        else:
+            serializer = CartItemUpdateSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            found = cart is not None and carts.set_quantity(cart, item_id, serializer.validated_data['quantity'])
+        if not found:
+            raise NotFound('Cart item not found.')
+        return self.cart_response(cart)
+
+    @action(detail=False, methods=['post'])
+    def clear(self, request):
+        """Remove every line from the cart"""
+        cart = carts.get_cart(request)
+        if cart is not None:
+            carts.clear_cart(cart)
+        return self.cart_response(cart)
+
+    @action(detail=False, methods=['post'], serializer_class=CheckoutSerializer,
+            permission_classes=[permissions.IsAuthenticated])
+    def checkout(self, request):
+        """Place an order for the cart's contents"""
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = dict(serializer.validated_data)
+        coupon_code = data.pop('coupon_code', '')
+        notes = data.pop('notes', '')
+        cart = carts.get_cart(request)
+        if cart is None:
+            raise ValidationError({'detail': 'Your cart is empty'})
+        try:
+            order = checkout(cart, request.user, data, coupon_code=coupon_code, notes=notes)
+        except CheckoutError as exc:
+            raise ValidationError({'detail': str(exc)})
+        order = Order.objects.select_related('customer').prefetch_related('items').get(pk=order.pk)
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
+
+class ShippingViewSet(viewsets.ViewSet):
+    """
+    API endpoint quoting tax and shipping for the current cart.
+    """
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.AllowAny]
+    serializer_class = ShippingQuoteSerializer
+
+    @action(detail=False, methods=['get'])
+    def quote(self, request):
+        """Tax, the available shipping methods and their cost for a destination country"""
+        serializer = ShippingQuoteRequestSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        cart = carts.get_cart(request)
+        lines = carts.pricing_lines(carts.load_items(cart), carts.member_tier(cart))
+        try:
+            result = quote(lines, serializer.validated_data['country'],
+                           serializer.validated_data.get('shipping_method'))
+        except PricingError as exc:
+            raise ValidationError({'detail': str(exc)})
+        return Response(ShippingQuoteSerializer(result).data)
@@ -0,0 +1,178 @@
+"""
+Database-backed shopping cart
+
+Signed-in users own one cart; anonymous visitors get a cart whose id is the
+only thing stored in their session. Lines are always loaded together with
+their products and variants in a single query, and prices that changed since
+the last visit are written back with one bulk UPDATE. Anonymous carts left
+untouched for ANONYMOUS_CART_DAYS are deleted by delete_abandoned_carts().
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from apps.products.models import Product
+from apps.products.prices import unit_price
+from .models import Cart, CartItem
+
+CART_SESSION_KEY = 'cart_id'
+
+
+def get_cart(request, create=False):
+    """Return the request's cart, creating it when create is True"""
+    if request.user.is_authenticated:
+        if create:
+            cart = Cart.objects.get_or_create(user=request.user)[0]
+        else:
+            cart = Cart.objects.filter(user=request.user).first()
+        if cart is not None:
+            # Spares a query when the cart is priced for the member
+            cart.user = request.user
+        return cart
+
+    cart_id = request.session.get(CART_SESSION_KEY)
+    cart = Cart.objects.filter(pk=cart_id, user__isnull=True).first() if cart_id else None
+    if cart is None and create:
+        cart = Cart.objects.create()
+        request.session[CART_SESSION_KEY] = cart.pk
+    return cart
+
+
+def member_tier(cart):
+    """Membership tier the cart is priced for; None for anonymous carts"""
+    if cart is None or cart.user_id is None:
+        return None
+    return cart.user.membership_tier
+
+
+def current_price(item, membership_tier=None):
+    """Live price of a cart line's product or variant for a member of membership_tier"""
+    return unit_price(item.product, item.variant, membership_tier)
+
+
+def available_quantity(item):
+    """Units that can currently be bought, or None when stock is not tracked"""
+    if item.variant is not None:
+        return item.variant.stock_quantity
+    if not item.product.track_inventory:
+        return None
+    return item.product.stock_quantity
+
+
+def pricing_lines(items, membership_tier=None):
+    """(category_id, line total) pairs of cart lines, as taken by pricing.quote()"""
+    return [(item.product.category_id, current_price(item, membership_tier) * item.quantity) for item in items]
+
+
+def load_items(cart):
+    """All lines of a cart with their products and variants, in one query"""
+    if cart is None:
+        return []
+    return list(CartItem.objects.filter(cart=cart).select_related('product', 'variant'))
+
+
+def refresh_items(cart):
+    """
+    Load the cart's lines, refresh prices and stock from their products and
+    save changed prices in a single bulk UPDATE. Every returned line carries
+    an is_available flag.
+    """
+    items = load_items(cart)
+    tier = member_tier(cart)
+    stale = []
+    for item in items:
+        price = current_price(item, tier)
+        if item.unit_price != price:
+            item.unit_price = price
+            stale.append(item)
+        available = available_quantity(item)
+        item.available_quantity = available
+        item.is_available = (
+            item.product.status == Product.Status.ACTIVE
+            and (item.variant is None or item.variant.is_active)
+            and (available is None or item.quantity <= available)
+        )
+    if stale:
+        CartItem.objects.bulk_update(stale, ['unit_price'])
+    return items
+
+
+def cart_summary(cart):
+    """Refreshed lines plus totals, ready for rendering or serializing"""
+    items = refresh_items(cart)
+    return {
+        'items': items,
+        'item_count': sum(item.quantity for item in items),
+        'subtotal': sum((item.line_total for item in items), 0),
+        'is_available': all(item.is_available for item in items),
+    }
+
+
+def add_item(cart, product, variant=None, quantity=1):
+    """Add quantity of a product or variant, merging with an existing line"""
+    if variant is not None and variant.product_id != product.pk:
+        raise ValueError("Variant does not belong to product")
+    price = unit_price(product, variant, member_tier(cart))
+    lines = CartItem.objects.filter(cart=cart, product=product, variant=variant)
+    changes = {'quantity': F('quantity') + quantity, 'unit_price': price, 'updated_at': timezone.now()}
+    if lines.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product=product, variant=variant,
+                                    quantity=quantity, unit_price=price)
+    except IntegrityError:
+        # A concurrent request created the line first
+        lines.update(**changes)
+
+
+def set_quantity(cart, item_id, quantity):
+    """Change a line's quantity; zero removes it. Returns False for unknown lines."""
+    lines = CartItem.objects.filter(cart=cart, pk=item_id)
+    if quantity <= 0:
+        return lines.delete()[0] > 0
+    return lines.update(quantity=quantity, updated_at=timezone.now()) > 0
+
+
+def remove_item(cart, item_id):
+    return set_quantity(cart, item_id, 0)
+
+
+def clear_cart(cart):
+    CartItem.objects.filter(cart=cart).delete()
+
+
+def merge_carts(source, target):
+    """Fold source's lines into target, then delete source"""
+    with transaction.atomic():
+        existing = {(item.product_id, item.variant_id): item
+                    for item in CartItem.objects.filter(cart=target)}
+        merged, moved = [], []
+        for item in CartItem.objects.filter(cart=source):
+            match = existing.get((item.product_id, item.variant_id))
+            if match is None:
+                moved.append(item.pk)
+            else:
+                match.quantity += item.quantity
+                merged.append(match)
+        CartItem.objects.filter(pk__in=moved).update(cart=target)
+        CartItem.objects.bulk_update(merged, ['quantity'])
+        source.delete()
+
+
+def delete_abandoned_carts(days=None, batch_size=1000):
+    """Delete anonymous carts whose lines have not changed for days; returns how many"""
+    days = settings.ANONYMOUS_CART_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    abandoned = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff).exclude(
+        items__updated_at__gte=cutoff
+    ).order_by('pk')
+    total = 0
+    while True:
+        pks = list(abandoned.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        with transaction.atomic():
+            CartItem.objects.filter(cart__in=pks).delete()
+            total += Cart.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,90 @@
+"""
+Checkout: turn a cart into an order
+
+The whole checkout runs in one transaction with a fixed number of queries,
+however many lines the cart has: the cart's lines are loaded with their
+products and variants in one query, stock for every line is reserved with
+one lock and one UPDATE per model, order lines are written with a single
+bulk_create and totals are computed in memory.
+"""
+from django.db import transaction
+from apps.products import inventory
+from apps.products.models import Product
+from . import coupons
+from .cart import current_price, load_items
+from .models import Cart, CartItem, Order, OrderItem
+from .pricing import PricingError
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into an order; nothing is saved"""
+
+
+def _check_line(item):
+    if item.product.status != Product.Status.ACTIVE:
+        raise CheckoutError(f"{item.product.name} is no longer available")
+    if item.variant is not None and not item.variant.is_active:
+        raise CheckoutError(f"{item.product.name} ({item.variant.name}) is no longer available")
+
+
+def checkout(cart, customer, shipping, coupon_code='', notes=''):
+    """
+    Place an order for every line of cart and empty it. shipping holds the
+    Order's shipping_* fields and optionally its shipping_method. Raises
+    CheckoutError when a line is unavailable, stock is short, the coupon is
+    invalid or the order cannot be shipped.
+    """
+    with transaction.atomic():
+        # Locking the cart stops a double submit from ordering it twice
+        cart = Cart.objects.select_for_update().get(pk=cart.pk)
+        items = load_items(cart)
+        if not items:
+            raise CheckoutError("Your cart is empty")
+
+        lines = []
+        for item in items:
+            _check_line(item)
+            price = current_price(item, customer.membership_tier)
+            lines.append(OrderItem(
+                product=item.product,
+                product_variant=item.variant,
+                product_name=item.product.name,
+                product_sku=item.variant.sku if item.variant is not None else item.product.sku,
+                unit_price=price,
+                quantity=item.quantity,
+                total_price=price * item.quantity,
+            ))
+        subtotal = sum(line.total_price for line in lines)
+
+        order = Order(customer=customer, notes=notes, **shipping)
+        coupon = None
+        if coupon_code:
+            try:
+                coupon, order.discount_amount = coupons.redeem(coupon_code, subtotal, customer)
+            except coupons.CouponError as exc:
+                raise CheckoutError(str(exc)) from exc
+            order.internal_notes = f"Coupon: {coupon.code}"
+        try:
+            order.set_totals(subtotal, [(line.product.category_id, line.total_price) for line in lines])
+        except PricingError as exc:
+            raise CheckoutError(str(exc)) from exc
+        order.save()
+        if coupon is not None:
+            coupons.record_redemption(coupon, order)
+
+        try:
+            reservations = inventory.reserve(
+                [(line.product_id, line.product_variant_id, line.quantity) for line in lines],
+                reference=order.order_number,
+            )
+        except inventory.InsufficientStock as exc:
+            short = next(line for line in lines if line.product_id == exc.line.product_id
+                         and line.product_variant_id == exc.line.variant_id)
+            raise CheckoutError(f"Not enough stock for {short.product_name} ({short.product_sku})") from exc
+        inventory.commit(reservations)
+
+        for line in lines:
+            line.order = order
+        OrderItem.objects.bulk_create(lines)
+        CartItem.objects.filter(cart=cart).delete()
+    return order
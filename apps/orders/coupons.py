@@ -0,0 +1,134 @@
+"""
+Coupon validation and redemption
+
+Coupon definitions are cached by code (COUPON_CACHE_TIMEOUT) and dropped
+from the cache whenever a coupon is saved or deleted. The cached copy is
+only used to turn away codes that are obviously unusable and to compute the
+discount: a redemption is a single conditional UPDATE that re-checks
+everything that can change underneath it (active flag, validity window, the
+global and per-customer limits, first order) and increments usage_count in
+the same statement, so concurrent checkouts can never take more uses than
+the coupon has. Every use is recorded in CouponRedemption, which is what the
+per-customer limit counts.
+"""
+import secrets
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Coupon, CouponRedemption, Order
+
+COUPON_KEY = 'coupon:{}'
+# Codes that do not exist are cached too, as this placeholder
+MISSING = 'missing'
+
+# Generated codes avoid characters that are easily confused (0/O, 1/I/L)
+CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+
+# Fields of a template coupon that generated codes do not copy
+GENERATED_EXCLUDE = {'id', 'code', 'usage_limit', 'usage_count', 'per_user_limit', 'created_at', 'updated_at'}
+
+
+class CouponError(Exception):
+    """Raised when a coupon cannot be applied"""
+
+
+def coupon_cache_key(code):
+    return COUPON_KEY.format(code)
+
+
+def get_coupon(code):
+    """The coupon with this code, from the cache when possible, or None"""
+    key = coupon_cache_key(code)
+    coupon = cache.get(key)
+    if coupon is None:
+        coupon = Coupon.objects.filter(code=code).first() or MISSING
+        cache.set(key, coupon, settings.COUPON_CACHE_TIMEOUT)
+    return None if isinstance(coupon, str) else coupon
+
+
+def invalidate_coupon(code):
+    cache.delete(coupon_cache_key(code))
+
+
+def _redeemable(coupon, customer, now):
+    """The coupon, filtered to match only while it can still be used by customer"""
+    used = (CouponRedemption.objects.filter(coupon=OuterRef('pk'), customer=customer)
+            .order_by().values('coupon').annotate(uses=Count('pk')).values('uses'))
+    queryset = Coupon.objects.filter(
+        Q(usage_limit__isnull=True) | Q(usage_count__lt=F('usage_limit')),
+        Q(per_user_limit__isnull=True) | Q(per_user_limit__gt=Coalesce(Subquery(used), 0)),
+        pk=coupon.pk, code=coupon.code, is_active=True, valid_from__lte=now, valid_until__gte=now,
+    )
+    if coupon.first_order_only:
+        queryset = queryset.filter(~Exists(Order.objects.filter(customer=customer)))
+    return queryset
+
+
+def _rejection(coupon, subtotal, customer, now):
+    """Why a coupon that failed to redeem was refused"""
+    coupon = Coupon.objects.filter(pk=coupon.pk, code=coupon.code).first()
+    if coupon is None:
+        return "Invalid coupon code"
+    valid, message = coupon.is_valid(order_amount=subtotal, now=now)
+    if not valid:
+        return message
+    if coupon.first_order_only and Order.objects.filter(customer=customer).exists():
+        return "Coupon is only valid for first orders"
+    return "You have already used this coupon"
+
+
+def redeem(code, subtotal, customer):
+    """
+    Validate a coupon for an order of subtotal and count one use; returns
+    (coupon, discount). Call record_redemption() once the order is saved.
+
+    Checkouts by the same customer are serialized by the lock on their cart,
+    which is what keeps the per-customer checks exact.
+    """
+    now = timezone.now()
+    coupon = get_coupon(code)
+    if coupon is None:
+        raise CouponError("Invalid coupon code")
+    # The cached usage_count may be behind, never ahead; the UPDATE decides
+    valid, message = coupon.is_valid(order_amount=subtotal, now=now)
+    if not valid:
+        raise CouponError(message)
+    if not _redeemable(coupon, customer, now).update(usage_count=F('usage_count') + 1, updated_at=now):
+        invalidate_coupon(code)
+        raise CouponError(_rejection(coupon, subtotal, customer, now))
+    return coupon, coupon.calculate_discount(subtotal).quantize(Decimal('0.01'))
+
+
+def record_redemption(coupon, order):
+    return CouponRedemption.objects.create(coupon=coupon, customer_id=order.customer_id, order=order,
+                                           discount_amount=order.discount_amount)
+
+
+def _random_code(prefix, length):
+    return prefix + ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def generate_codes(template, count, prefix='', length=10, batch_size=5000, progress=None):
+    """
+    Create count single-use coupons with the template coupon's terms and
+    unique random codes, batch_size rows per INSERT. Returns how many were
+    created; progress(created) is called after every batch.
+    """
+    if len(prefix) + length > Coupon._meta.get_field('code').max_length:
+        raise ValueError("Prefix and length exceed the maximum code length")
+    terms = {field.attname: getattr(template, field.attname) for field in Coupon._meta.concrete_fields
+             if field.attname not in GENERATED_EXCLUDE}
+
+    created = 0
+    while created < count:
+        codes = {_random_code(prefix, length) for _ in range(min(batch_size, count - created))}
+        codes.difference_update(Coupon.objects.filter(code__in=codes).values_list('code', flat=True))
+        Coupon.objects.bulk_create([Coupon(code=code, usage_limit=1, **terms) for code in codes],
+                                   ignore_conflicts=True)
+        created += len(codes)
+        if progress:
+            progress(created)
+    return created
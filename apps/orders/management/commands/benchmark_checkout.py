@@ -0,0 +1,63 @@
+"""
+Measure checkout throughput for carts of a given size
+"""
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from apps.accounts.models import User
+from apps.orders.checkout import checkout
+from apps.orders.models import Cart, CartItem
+from apps.products.models import Product
+
+SHIPPING = {
+    'shipping_name': 'Benchmark Customer',
+    'shipping_email': 'benchmark@example.com',
+    'shipping_address_line1': '1 Benchmark Road',
+    'shipping_city': 'Nairobi',
+    'shipping_state': 'Nairobi',
+    'shipping_postal_code': '00100',
+}
+
+
+class Command(BaseCommand):
+    help = "Place throwaway orders from generated carts and report orders/sec (all data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=50, help="Lines per cart")
+        parser.add_argument('--orders', type=int, default=100, help="Orders to place")
+
+    def handle(self, *args, **options):
+        lines, orders = options['lines'], options['orders']
+        tag = uuid.uuid4().hex[:8]
+
+        with transaction.atomic():
+            customer = User.objects.create(username=f'benchmark-{tag}', email=f'{tag}@example.com')
+            products = Product.objects.bulk_create([
+                Product(name=f'Benchmark {tag} {i}', slug=f'benchmark-{tag}-{i}', sku=f'BM-{tag}-{i}',
+                        description='Benchmark product', base_price=100 + i,
+                        stock_quantity=orders * 2, status=Product.Status.ACTIVE)
+                for i in range(lines)
+            ])
+
+            elapsed = 0.0
+            queries = 0
+            for _ in range(orders):
+                cart = Cart.objects.create()
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product=product, quantity=2, unit_price=product.base_price)
+                    for product in products
+                ])
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    checkout(cart, customer, SHIPPING)
+                    elapsed += time.perf_counter() - started
+                queries = len(captured)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{orders} orders of {lines} lines in {elapsed:.2f}s "
+            f"({orders / elapsed:.1f} orders/sec, {queries} queries per checkout)"
+        ))
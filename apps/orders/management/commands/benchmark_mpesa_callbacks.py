@@ -0,0 +1,95 @@
+"""
+Replay M-Pesa STK callbacks concurrently against a local server
+"""
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+from apps.accounts.models import User
+from apps.orders.models import MpesaCallback, Order, Payment
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Fire duplicated STK callbacks at an in-process server and check each payment "
+            "is settled exactly once (the generated data is deleted afterwards)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=500, help="Pending payments to settle")
+        parser.add_argument('--duplicates', type=int, default=4, help="Deliveries of each callback")
+        parser.add_argument('--concurrency', type=int, default=16, help="Concurrent senders")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        customer = User.objects.create(username=f'callback-benchmark-{tag}', email=f'{tag}@example.com')
+        orders = Order.objects.bulk_create([
+            Order(customer=customer, order_number=f'BM-{tag}-{i}', total_amount=100, shipping_name='Benchmark',
+                  shipping_email='benchmark@example.com', shipping_address_line1='1 Benchmark Road',
+                  shipping_city='Nairobi', shipping_state='Nairobi', shipping_postal_code='00100')
+            for i in range(options['payments'])
+        ])
+        payments = Payment.objects.bulk_create([
+            Payment(order=order, amount=100, method=Payment.PaymentMethod.MPESA,
+                    mpesa_checkout_request_id=f'ws_CO_{tag}_{i}')
+            for i, order in enumerate(orders)
+        ])
+
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+        server.set_app(get_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}{reverse('orders:mpesa_callback')}"
+
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=options['concurrency']))
+        deliveries = [payment for payment in payments for _ in range(options['duplicates'])]
+
+        def deliver(payment):
+            body = {'Body': {'stkCallback': {
+                'CheckoutRequestID': payment.mpesa_checkout_request_id, 'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': f'R{payment.pk}'}]},
+            }}}
+            started = time.perf_counter()
+            response = session.post(url, json=body, timeout=30)
+            return time.perf_counter() - started, response.status_code, response.json().get('applied')
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                results = list(pool.map(deliver, deliveries))
+            elapsed = time.perf_counter() - started
+
+            latencies = sorted(result[0] for result in results)
+            errors = sum(1 for result in results if result[1] != 200)
+            applied = sum(1 for result in results if result[2])
+            settled = Payment.objects.filter(pk__in=[p.pk for p in payments], status=Payment.Status.SUCCESS).count()
+            paid = Order.objects.filter(customer=customer, payment_status=Order.PaymentStatus.PAID).count()
+        finally:
+            server.shutdown()
+            server.server_close()
+            MpesaCallback.objects.filter(checkout_request_id__startswith=f'ws_CO_{tag}_').delete()
+            # The orders were bulk-created without signals, so they are deleted without them too:
+            # the platform statistics never counted them and must not be decremented
+            for queryset in (Payment.objects.filter(order__customer=customer), Order.objects.filter(customer=customer)):
+                queryset._raw_delete(queryset.db)
+            customer.delete()
+
+        self.stdout.write(
+            f"{len(results)} callbacks in {elapsed:.2f}s ({len(results) / elapsed:.0f}/sec), "
+            f"p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms"
+        )
+        if errors or applied != len(payments) or settled != len(payments) or paid != len(payments):
+            raise CommandError(f"{errors} errors, {applied} applied, {settled} settled payments, "
+                               f"{paid} paid orders (expected {len(payments)} each)")
+        self.stdout.write(self.style.SUCCESS(f"Each of {len(payments)} payments was settled exactly once"))
@@ -0,0 +1,92 @@
+"""
+Measure tax and shipping quote throughput
+"""
+import random
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.accounts.models import User
+from apps.orders import pricing
+from apps.orders.api import ShippingViewSet
+from apps.orders.models import Cart, CartItem, ShippingMethod, TaxRate
+from apps.products.models import Category, Product
+
+COUNTRIES = ['KE', 'UG', 'TZ', 'RW', 'ET']
+
+
+class Command(BaseCommand):
+    help = "Quote generated carts against generated rules and report quotes/sec (all data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quotes', type=int, default=10000, help="Quotes computed in memory")
+        parser.add_argument('--requests', type=int, default=500, help="Requests to the quote endpoint")
+        parser.add_argument('--lines', type=int, default=20, help="Lines per cart")
+        parser.add_argument('--categories', type=int, default=50, help="Categories (two levels deep)")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            parents = [Category.objects.create(name=f'Benchmark {tag} {i}', slug=f'benchmark-{tag}-{i}')
+                       for i in range(max(options['categories'] // 5, 1))]
+            categories = parents + [
+                Category.objects.create(name=f'Benchmark {tag} {i}', slug=f'benchmark-{tag}-sub-{i}',
+                                        parent=parents[i % len(parents)])
+                for i in range(options['categories'] - len(parents))
+            ]
+            TaxRate.objects.bulk_create(
+                [TaxRate(name=f'{country} VAT', rate=16, country=country) for country in COUNTRIES]
+                + [TaxRate(name='Reduced', rate=8, category=category) for category in parents[::2]]
+            )
+            ShippingMethod.objects.bulk_create([
+                ShippingMethod(name='Standard', price=200, free_over=1000, estimated_days=5),
+                ShippingMethod(name='Express', price=500, estimated_days=1, available_countries='KE, UG'),
+                ShippingMethod(name='Regional', price=350, estimated_days=3, available_countries='TZ,RW,ET'),
+            ])
+            pricing.reset_index()
+
+            carts = [
+                [(random.choice(categories).pk, Decimal(random.randint(50, 5000))) for _ in range(options['lines'])]
+                for _ in range(100)
+            ]
+            pricing.quote(carts[0], 'KE')
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                for i in range(options['quotes']):
+                    pricing.quote(carts[i % len(carts)], COUNTRIES[i % len(COUNTRIES)])
+                elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{options['quotes']} quotes of {options['lines']} lines in {elapsed:.2f}s "
+                f"({options['quotes'] / elapsed:.0f} quotes/sec, {len(captured)} queries)"
+            ))
+
+            customer = User.objects.create(username=f'benchmark-{tag}', email=f'{tag}@example.com')
+            products = Product.objects.bulk_create([
+                Product(name=f'Benchmark {tag} {i}', slug=f'benchmark-{tag}-{i}', sku=f'BM-{tag}-{i}',
+                        description='Benchmark product', base_price=100 + i, category=random.choice(categories),
+                        status=Product.Status.ACTIVE)
+                for i in range(options['lines'])
+            ])
+            cart = Cart.objects.create(user=customer)
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=2, unit_price=product.base_price)
+                for product in products
+            ])
+            view = ShippingViewSet.as_view({'get': 'quote'})
+            factory = APIRequestFactory()
+            started = time.perf_counter()
+            for i in range(options['requests']):
+                request = factory.get('/api/v1/shipping/quote/', {'country': COUNTRIES[i % len(COUNTRIES)]})
+                force_authenticate(request, user=customer)
+                view(request)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{options['requests']} quote requests in {elapsed:.2f}s "
+                f"({options['requests'] / elapsed:.0f} requests/sec)"
+            ))
+
+            transaction.set_rollback(True)
+        pricing.reset_index()
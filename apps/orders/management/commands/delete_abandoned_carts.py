@@ -0,0 +1,17 @@
+"""
+Delete anonymous carts nobody has touched for a while
+"""
+from django.core.management.base import BaseCommand
+from apps.orders.cart import delete_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = "Delete anonymous carts left untouched for ANONYMOUS_CART_DAYS (run periodically)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Days without changes (default ANONYMOUS_CART_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Carts deleted per transaction")
+
+    def handle(self, *args, **options):
+        deleted = delete_abandoned_carts(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} abandoned carts"))
@@ -0,0 +1,32 @@
+"""
+Generate single-use coupon codes from a template coupon
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.orders.coupons import generate_codes
+from apps.orders.models import Coupon
+
+
+class Command(BaseCommand):
+    help = "Create unique single-use coupons with the same terms as an existing coupon"
+
+    def add_arguments(self, parser):
+        parser.add_argument('template', help="Code of the coupon whose terms are copied")
+        parser.add_argument('--count', type=int, required=True, help="Number of codes to create")
+        parser.add_argument('--prefix', default='', help="Prefix for every generated code")
+        parser.add_argument('--length', type=int, default=10, help="Random characters per code")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Coupons inserted per statement")
+
+    def handle(self, *args, **options):
+        template = Coupon.objects.filter(code=options['template']).first()
+        if template is None:
+            raise CommandError(f"No coupon with code {options['template']!r}")
+
+        def progress(created):
+            self.stdout.write(f"{created}/{options['count']} codes created")
+
+        try:
+            created = generate_codes(template, options['count'], options['prefix'], options['length'],
+                                     options['batch_size'], progress)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Created {created} single-use coupons"))
@@ -0,0 +1,19 @@
+"""
+Submit requested refunds to their payment gateways
+"""
+from django.core.management.base import BaseCommand
+from apps.orders.refunds import process_refunds
+
+
+class Command(BaseCommand):
+    help = "Submit every requested refund, a batch at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Refunds claimed per batch")
+        parser.add_argument('--concurrency', type=int,
+                            help="Concurrent gateway calls (default: each processor's max_concurrency)")
+
+    def handle(self, *args, **options):
+        counts = process_refunds(batch_size=options['batch_size'], max_concurrency=options['concurrency'])
+        summary = ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))
+        self.stdout.write(self.style.SUCCESS(f"Refunds processed: {summary or 'none requested'}"))
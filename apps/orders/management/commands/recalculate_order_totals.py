@@ -0,0 +1,27 @@
+"""
+Recalculate stored order totals from their line items
+"""
+from django.core.management.base import BaseCommand
+from apps.orders.models import Order
+from apps.orders.totals import recalculate_totals
+
+
+class Command(BaseCommand):
+    help = "Recalculate subtotal, tax, shipping and total for unpaid pending orders in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Orders read and written per batch")
+        parser.add_argument('--status', action='append', choices=Order.Status.values,
+                            help="Only orders with this status (repeatable)")
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options['status']:
+            queryset = queryset.filter(status__in=options['status'])
+
+        def progress(processed, total):
+            self.stdout.write(f"{processed}/{total} orders processed")
+
+        changed = recalculate_totals(queryset, options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(f"Totals recalculated; {changed} orders changed"))
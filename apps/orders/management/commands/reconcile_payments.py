@@ -0,0 +1,43 @@
+"""
+Settle pending M-Pesa payments whose callbacks were lost
+"""
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.orders.reconciliation import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = "Query Safaricom for pending M-Pesa payments and record their results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int,
+                            help="Seconds a payment must have been pending (default MPESA_STATUS_QUERY_AFTER)")
+        parser.add_argument('--batch-size', type=int, default=200, help="Payments read per batch")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent status queries")
+        parser.add_argument('--interval', type=int,
+                            help="Keep running, reconciling every this many seconds")
+        parser.add_argument('--json', action='store_true', help="Print metrics as JSON")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            report = reconcile_payments(options['older_than'], options['batch_size'], options['workers'])
+            self.report(report, options['json'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def report(self, report, as_json):
+        metrics = report.as_dict()
+        if as_json:
+            self.stdout.write(json.dumps(metrics))
+            return
+        latency = metrics['query_latency_ms']
+        self.stdout.write(self.style.SUCCESS(
+            f"{metrics['scanned']} pending payments scanned in {metrics['elapsed_seconds']:.2f}s: "
+            f"{metrics['succeeded']} succeeded, {metrics['failed']} failed, "
+            f"{metrics['still_pending']} still pending, {metrics['skipped']} skipped, {metrics['errors']} errors "
+            f"(query latency p50 {latency['p50']}ms, p95 {latency['p95']}ms)"
+        ))
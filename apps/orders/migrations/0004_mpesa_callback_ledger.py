@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('result_code', models.CharField(max_length=10)),
+                ('payload', models.JSONField()),
+                ('processed_at', models.DateTimeField(blank=True, help_text='When the result was applied to its payment', null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(condition=models.Q(('mpesa_checkout_request_id', ''), _negated=True), fields=('mpesa_checkout_request_id',), name='unique_mpesa_checkout_request'),
+        ),
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='callbacks', to='orders.payment'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_mpesa_callback_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='payment_pending_idx'),
+        ),
+    ]
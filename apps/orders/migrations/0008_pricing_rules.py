@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_coupon_redemptions'),
+        ('products', '0004_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='shipping_method',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='orders.shippingmethod'),
+        ),
+        migrations.AddField(
+            model_name='shippingmethod',
+            name='free_over',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Orders with at least this subtotal ship free', max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='TaxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=100)),
+                ('rate', models.DecimalField(decimal_places=2, help_text='Percentage', max_digits=5)),
+                ('country', models.CharField(blank=True, help_text='Country code or name (leave blank for all)', max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(blank=True, help_text='Leave blank for every category', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tax_rates', to='products.category')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='taxrate',
+            constraint=models.UniqueConstraint(fields=('category', 'country'), name='unique_tax_rate_category_country'),
+        ),
+        migrations.AddConstraint(
+            model_name='taxrate',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('country',), name='unique_default_tax_rate_country'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_pricing_rules'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='refund',
+            name='status',
+            field=models.CharField(choices=[('requested', 'Requested'), ('processing', 'Processing'), ('submitted', 'Submitted'), ('unknown', 'Outcome unknown'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='requested', max_length=20),
+        ),
+    ]
@@ -26,6 +26,10 @@ class Order(TimestampMixin):
         PARTIAL = 'partial', 'Partially Paid'
         FAILED = 'failed', 'Failed'
         REFUNDED = 'refunded', 'Refunded'
+        PARTIALLY_REFUNDED = 'partially_refunded', 'Partially Refunded'
+    
+    # Orders whose totals may still be re-quoted; once paid, the totals are what the customer was charged
+    REPRICEABLE = models.Q(status=Status.PENDING, payment_status__in=[PaymentStatus.PENDING, PaymentStatus.FAILED])
     
     # Order Identification
     order_number = models.CharField(max_length=50, unique=True, blank=True)
@@ -54,6 +58,8 @@ class Order(TimestampMixin):
     shipping_state = models.CharField(max_length=100)
     shipping_postal_code = models.CharField(max_length=20)
     shipping_country = models.CharField(max_length=100, default='Kenya')
+    shipping_method = models.ForeignKey('ShippingMethod', on_delete=models.SET_NULL,
+                                        blank=True, null=True, related_name='orders')
     
     # Billing Information (can be same as shipping)
     billing_same_as_shipping = models.BooleanField(default=True)
@@ -81,6 +87,10 @@ class Order(TimestampMixin):
         indexes = [
             models.Index(fields=['customer', 'status']),
             models.Index(fields=['order_number']),
+            # Changelist ordering and date hierarchy drill-down, alone or per status
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['payment_status', 'created_at']),
         ]
     
     def __str__(self):
@@ -105,20 +115,34 @@ class Order(TimestampMixin):
         
         super().save(*args, **kwargs)
     
-    def calculate_totals(self):
-        """Calculate order totals from line items"""
-        self.subtotal = sum(item.total_price for item in self.items.all())
-        
-        # Simple tax calculation (16% VAT for Kenya)
-        self.tax_amount = self.subtotal * Decimal('0.16')
-        
-        # Simple shipping calculation
-        if self.subtotal < 1000:  # Free shipping over 1000 KES
-            self.shipping_amount = Decimal('200')
-        else:
-            self.shipping_amount = Decimal('0')
+    def set_totals(self, subtotal, lines=None):
+        """
+        Set tax, shipping and total from a line-item subtotal without saving.
+        lines are (category_id, amount) pairs for category-specific tax
+        rates; without them the whole subtotal is taxed at the default rate.
+        Raises PricingError when the order cannot be shipped.
+        """
+        from .pricing import quote
         
+        result = quote(lines if lines is not None else [(None, subtotal)],
+                       self.shipping_country, self.shipping_method_id)
+        self.subtotal = subtotal
+        self.tax_amount = result.tax
+        self.shipping_amount = result.shipping
+        self.shipping_method_id = result.method.id
         self.total_amount = self.subtotal + self.tax_amount + self.shipping_amount - self.discount_amount
+    
+    def calculate_totals(self):
+        """
+        Calculate order totals from line items.
+        Raises PricingError for orders past payment, whose totals are final.
+        """
+        from .pricing import PricingError
+        
+        if not Order.objects.filter(Order.REPRICEABLE, pk=self.pk).exists():
+            raise PricingError(f"{self} is no longer pending payment; its totals are final")
+        lines = [(item.product.category_id, item.total_price) for item in self.items.select_related('product')]
+        self.set_totals(sum(amount for _, amount in lines), lines)
         self.save()
     
     @property
@@ -161,6 +185,43 @@ class OrderItem(TimestampMixin):
         super().save(*args, **kwargs)
 
 
+class Cart(TimestampMixin):
+    """Shopping cart owned by a user, or by an anonymous session when user is empty"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                related_name='cart', blank=True, null=True)
+
+    def __str__(self):
+        return f"Cart #{self.pk} ({self.user or 'anonymous'})"
+
+
+class CartItem(TimestampMixin):
+    """A product (or variant) line in a cart"""
+    cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
+    variant = models.ForeignKey('products.ProductVariant', on_delete=models.CASCADE,
+                                blank=True, null=True)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2,
+                                     help_text="Price when the line was last refreshed")
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], condition=models.Q(variant__isnull=True),
+                                    name='unique_cart_product'),
+            models.UniqueConstraint(fields=['cart', 'product', 'variant'],
+                                    condition=models.Q(variant__isnull=False),
+                                    name='unique_cart_product_variant'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x product {self.product_id} in cart {self.cart_id}"
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+
 class Payment(TimestampMixin):
     """Payment records for orders"""
     
@@ -191,10 +252,109 @@ class Payment(TimestampMixin):
     mpesa_checkout_request_id = models.CharField(max_length=100, blank=True)
     mpesa_response_code = models.CharField(max_length=10, blank=True)
     
+    class Meta:
+        indexes = [
+            # Reconciliation scans the (small) set of pending payments by id
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='payment_pending_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['mpesa_checkout_request_id'],
+                                    condition=~models.Q(mpesa_checkout_request_id=''),
+                                    name='unique_mpesa_checkout_request'),
+        ]
+    
     def __str__(self):
         return f"Payment of {self.amount} for {self.order}"
 
 
+class InvalidRefundTransition(ValueError):
+    """Raised when a refund is moved to a status its current status cannot reach"""
+
+
+class Refund(TimestampMixin):
+    """Money returned to a customer from a settled payment, in full or in part"""
+    
+    class Status(models.TextChoices):
+        REQUESTED = 'requested', 'Requested'
+        PROCESSING = 'processing', 'Processing'
+        SUBMITTED = 'submitted', 'Submitted'
+        UNKNOWN = 'unknown', 'Outcome unknown'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+        CANCELLED = 'cancelled', 'Cancelled'
+    
+    # Status -> statuses it may move to. SUBMITTED means the gateway accepted
+    # the reversal and reports the final result later. UNKNOWN means the
+    # request may have reached the gateway without us hearing back (a read
+    # timeout, a 5xx, a worker crash); it is never resent automatically, and
+    # is settled by the gateway's result or by staff.
+    TRANSITIONS = {
+        Status.REQUESTED: {Status.PROCESSING, Status.CANCELLED},
+        Status.PROCESSING: {Status.SUBMITTED, Status.UNKNOWN, Status.SUCCEEDED, Status.FAILED},
+        Status.SUBMITTED: {Status.SUCCEEDED, Status.FAILED},
+        Status.UNKNOWN: {Status.SUCCEEDED, Status.FAILED},
+        Status.FAILED: {Status.REQUESTED, Status.CANCELLED},
+        Status.SUCCEEDED: set(),
+        Status.CANCELLED: set(),
+    }
+    
+    payment = models.ForeignKey(Payment, related_name='refunds', on_delete=models.PROTECT)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.REQUESTED)
+    reason = models.TextField(blank=True)
+    restock = models.BooleanField(default=False, help_text="Return the refunded items to stock")
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                                     related_name='+', blank=True, null=True)
+    
+    # Gateway info
+    gateway_reference = models.CharField(max_length=100, blank=True)
+    gateway_response = models.JSONField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['gateway_reference']),
+        ]
+    
+    def __str__(self):
+        return f"Refund of {self.amount} for {self.payment.order}"
+    
+    def can_transition(self, status):
+        return status in self.TRANSITIONS[self.status]
+    
+    def transition(self, status):
+        """Move to status, raising InvalidRefundTransition when it is not allowed"""
+        if not self.can_transition(status):
+            raise InvalidRefundTransition(f"Cannot move a {self.status} refund to {status}")
+        self.status = status
+
+
+class RefundItem(models.Model):
+    """Quantity of an order line covered by a refund"""
+    refund = models.ForeignKey(Refund, related_name='items', on_delete=models.CASCADE)
+    order_item = models.ForeignKey(OrderItem, related_name='refund_items', on_delete=models.PROTECT)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.order_item.product_name}"
+
+
+class MpesaCallback(TimestampMixin):
+    """Ledger of received STK push callbacks; one row per checkout request"""
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    result_code = models.CharField(max_length=10)
+    payload = models.JSONField()
+    payment = models.ForeignKey(Payment, related_name='callbacks', on_delete=models.SET_NULL,
+                                blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True,
+                                        help_text="When the result was applied to its payment")
+    
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.result_code})"
+
+
 class ShippingMethod(TimestampMixin):
     """Available shipping methods"""
     name = models.CharField(max_length=100)
@@ -203,6 +363,9 @@ class ShippingMethod(TimestampMixin):
     estimated_days = models.PositiveIntegerField(help_text="Estimated delivery days")
     is_active = models.BooleanField(default=True)
     
+    free_over = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True,
+                                    help_text="Orders with at least this subtotal ship free")
+    
     # Geographic restrictions
     available_countries = models.TextField(
         blank=True,
@@ -211,6 +374,36 @@ class ShippingMethod(TimestampMixin):
     
     def __str__(self):
         return f"{self.name} - {self.price} KES"
+    
+    def country_list(self):
+        """Normalized countries this method ships to; empty means everywhere"""
+        return [country.strip().casefold() for country in self.available_countries.split(',') if country.strip()]
+
+
+class TaxRate(TimestampMixin):
+    """
+    Tax rate for a product category and/or country. The most specific rate
+    wins: a category's own rate before its parents', and within a category
+    a country's rate before the one for all countries.
+    """
+    name = models.CharField(max_length=100)
+    rate = models.DecimalField(max_digits=5, decimal_places=2, help_text="Percentage")
+    category = models.ForeignKey('products.Category', on_delete=models.CASCADE,
+                                 blank=True, null=True, related_name='tax_rates',
+                                 help_text="Leave blank for every category")
+    country = models.CharField(max_length=100, blank=True,
+                               help_text="Country code or name (leave blank for all)")
+    is_active = models.BooleanField(default=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'country'], name='unique_tax_rate_category_country'),
+            models.UniqueConstraint(fields=['country'], condition=models.Q(category__isnull=True),
+                                    name='unique_default_tax_rate_country'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.rate}%)"
 
 
 class Coupon(TimestampMixin):
@@ -236,6 +429,8 @@ class Coupon(TimestampMixin):
     usage_limit = models.PositiveIntegerField(blank=True, null=True,
                                             help_text="Maximum number of uses")
     usage_count = models.PositiveIntegerField(default=0)
+    per_user_limit = models.PositiveIntegerField(blank=True, null=True,
+                                               help_text="Maximum number of uses per customer")
     
     # Validity period
     valid_from = models.DateTimeField()
@@ -248,28 +443,30 @@ class Coupon(TimestampMixin):
     def __str__(self):
         return f"{self.code} - {self.name}"
     
-    def is_valid(self, order_amount=None, user=None):
-        """Check if coupon is valid for use"""
+    def is_valid(self, order_amount=None, user=None, now=None):
+        """
+        Check if coupon is valid for use. Only the coupon's own fields are
+        checked; per-customer restrictions are enforced when it is redeemed
+        (see apps.orders.coupons).
+        """
         from django.utils import timezone
         
+        now = now or timezone.now()
         if not self.is_active:
             return False, "Coupon is not active"
         
-        if timezone.now() < self.valid_from:
+        if now < self.valid_from:
             return False, "Coupon is not yet valid"
         
-        if timezone.now() > self.valid_until:
+        if now > self.valid_until:
             return False, "Coupon has expired"
         
-        if self.usage_limit and self.usage_count >= self.usage_limit:
+        if self.usage_limit is not None and self.usage_count >= self.usage_limit:
             return False, "Coupon usage limit reached"
         
         if order_amount and order_amount < self.minimum_amount:
             return False, f"Minimum order amount is {self.minimum_amount}"
         
-        if self.first_order_only and user and user.orders.exists():
-            return False, "Coupon is only valid for first orders"
-        
         return True, "Valid"
     
     def calculate_discount(self, order_amount):
@@ -281,4 +478,23 @@ class Coupon(TimestampMixin):
             if self.maximum_discount:
                 discount = min(discount, self.maximum_discount)
         
-        return discount
\ No newline at end of file
+        return discount
+
+
+class CouponRedemption(TimestampMixin):
+    """One use of a coupon by a customer's order"""
+    
+    coupon = models.ForeignKey(Coupon, related_name='redemptions', on_delete=models.CASCADE)
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='coupon_redemptions',
+                                 on_delete=models.CASCADE)
+    order = models.OneToOneField(Order, related_name='coupon_redemption', on_delete=models.CASCADE)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        indexes = [
+            # Per-customer usage checks at redemption time
+            models.Index(fields=['customer', 'coupon'], name='coupon_redemption_customer_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.coupon.code} on {self.order.order_number}"
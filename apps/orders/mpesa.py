@@ -0,0 +1,165 @@
+"""
+HTTP client for the Safaricom Daraja (M-Pesa) API
+
+Requests go through pooled requests.Sessions shared by the process, with
+explicit connect/read timeouts and retries with backoff. What is retried
+depends on whether the call is safe to send twice: token requests retry
+connection and read errors and 5xx responses, while POSTs by default only
+retry connections that were never established, since Daraja may have acted
+on a request that then timed out or failed (a second STK push prompts the
+customer again). Status queries, which change nothing, retry connection and
+read errors but not the 5xx Daraja answers while a prompt is pending;
+is_query_pending() tells that answer apart from real failures. OAuth access
+tokens are cached per consumer key, in process memory and in the shared
+cache, and refreshed shortly before they expire instead of being fetched for
+every call.
+"""
+import hashlib
+import threading
+import time
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Tokens are refreshed this many seconds before Daraja expires them
+TOKEN_REFRESH_MARGIN = 60
+
+# Retry policies, by how safe it is for Daraja to receive a request twice
+RETRY_ALL = 'all'              # connection and read errors, and 5xx responses
+RETRY_NO_STATUS = 'no-status'  # connection and read errors; 5xx answers are returned
+RETRY_CONNECT = 'connect'      # only connections that were never established
+
+# errorCode of Daraja's answer to a status query while the customer has not responded to the prompt
+QUERY_PENDING_ERROR = '500.001.1001'
+
+_sessions = {}
+_session_lock = threading.Lock()
+_tokens = {}
+_token_lock = threading.Lock()
+
+
+def _retry(policy):
+    retries = settings.MPESA_MAX_RETRIES
+    if policy == RETRY_CONNECT:
+        return Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                     backoff_factor=settings.MPESA_RETRY_BACKOFF, raise_on_status=False)
+    return Retry(
+        total=retries,
+        backoff_factor=settings.MPESA_RETRY_BACKOFF,
+        status_forcelist=(500, 502, 503, 504) if policy == RETRY_ALL else (),
+        allowed_methods=frozenset({'GET', 'POST'}),
+        respect_retry_after_header=policy == RETRY_ALL,
+        raise_on_status=False,
+    )
+
+
+def get_session(policy=RETRY_ALL):
+    """The process-wide pooled session retrying requests by policy"""
+    session = _sessions.get(policy)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(policy)
+            if session is None:
+                adapter = HTTPAdapter(pool_maxsize=settings.MPESA_POOL_SIZE, max_retries=_retry(policy))
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[policy] = session
+    return session
+
+
+def reset_session():
+    """Drop the pooled sessions and cached tokens (e.g. after changing settings)"""
+    with _session_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+    with _token_lock:
+        _tokens.clear()
+
+
+def is_query_pending(error):
+    """
+    Whether a failed STK status query only means the prompt is still
+    pending: Daraja answers those with a 500 and errorCode 500.001.1001
+    ("The transaction is being processed"). Any other failure is an error.
+    """
+    if not isinstance(error, requests.HTTPError) or error.response is None:
+        return False
+    try:
+        body = error.response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    return (body.get('errorCode') == QUERY_PENDING_ERROR
+            or 'being processed' in str(body.get('errorMessage', '')).lower())
+
+
+class DarajaClient:
+    """Authenticated JSON calls to the Daraja API"""
+
+    def __init__(self, consumer_key, consumer_secret, base_url):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.base_url = base_url.rstrip('/')
+        digest = hashlib.sha256(f"{self.base_url}|{consumer_key}".encode()).hexdigest()[:32]
+        self.token_cache_key = f"mpesa:token:{digest}"
+
+    @property
+    def timeout(self):
+        return (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+
+    def get_access_token(self, force_refresh=False):
+        """Return a valid access token, fetching a new one only when needed"""
+        if not force_refresh:
+            token = self._cached_token()
+            if token:
+                return token
+        with _token_lock:
+            # Another thread may have refreshed it while we waited
+            token = None if force_refresh else self._cached_token()
+            if token:
+                return token
+            response = get_session().get(
+                f"{self.base_url}/oauth/v1/generate",
+                params={'grant_type': 'client_credentials'},
+                auth=(self.consumer_key, self.consumer_secret),
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data = response.json()
+            lifetime = max(int(data.get('expires_in', 3599)) - TOKEN_REFRESH_MARGIN, 1)
+            token = data['access_token']
+            _tokens[self.token_cache_key] = (token, time.time() + lifetime)
+            cache.set(self.token_cache_key, (token, time.time() + lifetime), lifetime)
+            return token
+
+    def _cached_token(self):
+        entry = _tokens.get(self.token_cache_key)
+        if entry is None:
+            entry = cache.get(self.token_cache_key)
+            if entry is not None:
+                _tokens[self.token_cache_key] = entry
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def post(self, path, payload, retry=RETRY_CONNECT):
+        """POST payload as JSON and return the decoded response; retry is the session's retry policy"""
+        response = self._post(path, payload, self.get_access_token(), retry)
+        if response.status_code == 401:
+            # The token was revoked or expired early; fetch a new one once
+            response = self._post(path, payload, self.get_access_token(force_refresh=True), retry)
+        response.raise_for_status()
+        return response.json()
+
+    def _post(self, path, payload, token, retry):
+        return get_session(retry).post(
+            f"{self.base_url}{path}",
+            json=payload,
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=self.timeout,
+        )
@@ -1,35 +1,132 @@
 """
 Payment processors for flexible payment methods
+
+Processors are configured per payment method in settings.PAYMENT_PROCESSORS
+and instantiated once per process by get_payment_processor(). Every
+processor offers the same interface over Payment rows: initiate, confirm,
+refund, confirm_many and refund_many, plus awaitable variants for async
+callers.
 """
-import requests
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils.module_loading import import_string
 from decimal import Decimal
+from urllib3.exceptions import NewConnectionError
+from .mpesa import RETRY_CONNECT, RETRY_NO_STATUS, DarajaClient
+
+# Outcome of one call in confirm_many() or refund_many(); error is the exception raised, if any
+ConfirmResult = namedtuple('ConfirmResult', ['payment', 'response', 'error', 'seconds'])
+RefundResult = namedtuple('RefundResult', ['refund', 'response', 'error', 'seconds'])
+
+
+def may_have_reached_gateway(error):
+    """
+    Whether a call that raised error may still have been acted on: the
+    request went out but no answer (or a 5xx) came back. Sending it again
+    could then move the money twice.
+    """
+    if not isinstance(error, requests.RequestException):
+        return False
+    if error.request is not None and error.request.method != 'POST':
+        # Only POSTs act; a failed GET (e.g. the access token) sent nothing
+        return False
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return not isinstance(reason, NewConnectionError)
+    return True
 
 
 class PaymentProcessor(ABC):
     """Abstract base class for payment processors"""
 
+    # Upper bound on concurrent gateway calls made by the batch methods
+    max_concurrency = 4
+
+    def __init__(self, **options):
+        self.options = options
+        self.max_concurrency = options.get('MAX_CONCURRENCY', self.max_concurrency)
+
     @abstractmethod
-    def initiate_payment(self, order, phone_number):
-        """Initiate a payment request"""
+    def initiate(self, payment):
+        """Start collecting a pending payment; returns the gateway response"""
         pass
 
     @abstractmethod
-    def confirm_payment(self, transaction_id):
-        """Confirm payment status"""
+    def confirm(self, payment):
+        """Ask the gateway for the payment's current status"""
         pass
 
     @abstractmethod
-    def refund_payment(self, transaction_id, amount):
-        """Refund a payment"""
+    def refund(self, payment, amount):
+        """
+        Return amount of a settled payment to the customer. The response's
+        'status' is 'succeeded', 'failed' or 'submitted' (the gateway reports
+        the final result later, quoting 'reference').
+        """
         pass
 
+    def confirm_many(self, payments, max_concurrency=None):
+        """Confirm many payments with at most max_concurrency calls in flight"""
+        return [ConfirmResult(*outcome) for outcome in
+                self._map(self.confirm, [(payment,) for payment in payments], max_concurrency)]
+
+    def refund_many(self, refunds, max_concurrency=None):
+        """Submit many Refunds with at most max_concurrency calls in flight"""
+        outcomes = self._map(self.refund, [(refund.payment, refund.amount) for refund in refunds], max_concurrency)
+        return [RefundResult(refund, *outcome[1:]) for refund, outcome in zip(refunds, outcomes)]
+
+    def _map(self, func, calls, max_concurrency=None):
+        """Run func over argument tuples; returns (first argument, response, error, seconds) per call"""
+        def call(args):
+            started = time.perf_counter()
+            try:
+                response, error = func(*args), None
+            except Exception as exc:
+                response, error = None, exc
+            return args[0], response, error, time.perf_counter() - started
+
+        calls = list(calls)
+        if len(calls) <= 1:
+            return [call(args) for args in calls]
+        with ThreadPoolExecutor(max_workers=min(max_concurrency or self.max_concurrency, len(calls))) as pool:
+            return list(pool.map(call, calls))
+
+    async def ainitiate(self, payment):
+        return await sync_to_async(self.initiate, thread_sensitive=False)(payment)
+
+    async def aconfirm(self, payment):
+        return await sync_to_async(self.confirm, thread_sensitive=False)(payment)
+
+    async def arefund(self, payment, amount):
+        return await sync_to_async(self.refund, thread_sensitive=False)(payment, amount)
+
+    async def aconfirm_many(self, payments, max_concurrency=None):
+        return await sync_to_async(self.confirm_many, thread_sensitive=False)(payments, max_concurrency)
+
+    async def arefund_many(self, refunds, max_concurrency=None):
+        return await sync_to_async(self.refund_many, thread_sensitive=False)(refunds, max_concurrency)
+
 
 class MpesaProcessor(PaymentProcessor):
     """M-Pesa payment processor"""
 
-    def __init__(self):
+    max_concurrency = 8
+
+    def __init__(self, **options):
+        super().__init__(**options)
         self.consumer_key = settings.MPESA_CONSUMER_KEY
         self.consumer_secret = settings.MPESA_CONSUMER_SECRET
         self.shortcode = settings.MPESA_SHORTCODE
@@ -39,23 +136,31 @@ class MpesaProcessor(PaymentProcessor):
         if not all([self.consumer_key, self.consumer_secret, self.shortcode, self.passkey]):
             raise ValueError("M-Pesa credentials not configured. Please set MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET, MPESA_SHORTCODE, and MPESA_PASSKEY in your environment variables.")
 
+        self.client = DarajaClient(self.consumer_key, self.consumer_secret, self.base_url)
+
+    def initiate(self, payment):
+        return self.initiate_payment(payment.order, payment.mpesa_phone)
+
+    def confirm(self, payment):
+        return self.confirm_payment(payment.mpesa_checkout_request_id)
+
+    def refund(self, payment, amount):
+        # Daraja reverses whole transactions only; partial refunds are paid
+        # back to the customer's phone as a B2C payment
+        if amount >= payment.amount:
+            response = self.refund_payment(payment.mpesa_receipt, amount)
+        else:
+            response = self.pay_customer(payment.mpesa_phone, amount, f"Refund for {payment.order.order_number}")
+        accepted = str(response.get('ResponseCode')) == '0'
+        return dict(response, status='submitted' if accepted else 'failed',
+                    reference=response.get('ConversationID', ''))
+
     def get_access_token(self):
-        """Get M-Pesa access token"""
-        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-        response = requests.get(url, auth=(self.consumer_key, self.consumer_secret))
-        response.raise_for_status()
-        return response.json()['access_token']
+        """Get M-Pesa access token (cached until shortly before it expires)"""
+        return self.client.get_access_token()
 
     def initiate_payment(self, order, phone_number):
         """Initiate STK Push for M-Pesa"""
-        access_token = self.get_access_token()
-        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
         timestamp = self._get_timestamp()
         password = self._generate_password(timestamp)
 
@@ -68,25 +173,15 @@ class MpesaProcessor(PaymentProcessor):
             "PartyA": phone_number,
             "PartyB": self.shortcode,
             "PhoneNumber": phone_number,
-            "CallBackURL": f"{settings.SITE_DOMAIN}/orders/mpesa/callback/",
+            "CallBackURL": self._callback_url(),
             "AccountReference": f"Order {order.order_number}",
             "TransactionDesc": f"Payment for order {order.order_number}"
         }
 
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return self.client.post('/mpesa/stkpush/v1/processrequest', payload)
 
     def confirm_payment(self, transaction_id):
         """Check payment status"""
-        access_token = self.get_access_token()
-        url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
-
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
         timestamp = self._get_timestamp()
         password = self._generate_password(timestamp)
 
@@ -97,15 +192,56 @@ class MpesaProcessor(PaymentProcessor):
             "CheckoutRequestID": transaction_id
         }
 
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        # A query for a prompt the customer has not answered yet gets a 500;
+        # retrying that only repeats the same answer
+        return self.client.post('/mpesa/stkpushquery/v1/query', payload, retry=RETRY_NO_STATUS)
 
     def refund_payment(self, transaction_id, amount):
-        """Refund payment (simplified)"""
-        # M-Pesa refund logic would go here
-        # For now, return success
-        return {"ResponseCode": "0", "ResponseDescription": "Refund successful"}
+        """Request a reversal of an M-Pesa transaction; the result arrives at the refund result URL"""
+        payload = {
+            "Initiator": self._initiator_name(),
+            "SecurityCredential": settings.MPESA_SECURITY_CREDENTIAL,
+            "CommandID": "TransactionReversal",
+            "TransactionID": transaction_id,
+            "Amount": int(amount),
+            "ReceiverParty": self.shortcode,
+            "RecieverIdentifierType": "11",
+            "ResultURL": self._absolute_url('orders:mpesa_refund_result'),
+            "QueueTimeOutURL": self._absolute_url('orders:mpesa_refund_timeout'),
+            "Remarks": "Refund",
+            "Occasion": transaction_id,
+        }
+        # Never resent once delivered: a second reversal could be honoured too
+        return self.client.post('/mpesa/reversal/v1/request', payload, retry=RETRY_CONNECT)
+
+    def pay_customer(self, phone_number, amount, remarks):
+        """Send money from the shortcode to a customer's phone (B2C)"""
+        if amount != int(amount):
+            raise ValueError(f"M-Pesa payments are in whole shillings, not {amount}")
+        payload = {
+            "InitiatorName": self._initiator_name(),
+            "SecurityCredential": settings.MPESA_SECURITY_CREDENTIAL,
+            "CommandID": "BusinessPayment",
+            "Amount": int(amount),
+            "PartyA": self.shortcode,
+            "PartyB": phone_number,
+            "Remarks": remarks,
+            "QueueTimeOutURL": self._absolute_url('orders:mpesa_refund_timeout'),
+            "ResultURL": self._absolute_url('orders:mpesa_refund_result'),
+            "Occasion": remarks,
+        }
+        return self.client.post('/mpesa/b2c/v1/paymentrequest', payload, retry=RETRY_CONNECT)
+
+    def _initiator_name(self):
+        if not (settings.MPESA_INITIATOR_NAME and settings.MPESA_SECURITY_CREDENTIAL):
+            raise ValueError("M-Pesa refunds need MPESA_INITIATOR_NAME and MPESA_SECURITY_CREDENTIAL.")
+        return settings.MPESA_INITIATOR_NAME
+
+    def _callback_url(self):
+        return self._absolute_url('orders:mpesa_callback')
+
+    def _absolute_url(self, name):
+        return f"{settings.META_SITE_PROTOCOL}://{settings.META_SITE_DOMAIN}{reverse(name)}"
 
     def _get_timestamp(self):
         from datetime import datetime
@@ -117,10 +253,61 @@ class MpesaProcessor(PaymentProcessor):
         return base64.b64encode(data.encode()).decode('utf-8')
 
 
-# Factory function to get processor
+class ManualPaymentProcessor(PaymentProcessor):
+    """
+    Payments settled outside the platform (bank transfer, cash on delivery)
+    and marked as paid or refunded by staff; the stored status is the truth
+    """
+    instructions = ''
+
+    def initiate(self, payment):
+        return {
+            'status': payment.status,
+            'reference': payment.order.order_number,
+            'instructions': self.options.get('INSTRUCTIONS', self.instructions),
+        }
+
+    def confirm(self, payment):
+        return {'status': payment.status}
+
+    def refund(self, payment, amount):
+        # Staff pay the money back; recording the refund is all there is to do
+        return {'status': 'succeeded', 'amount': str(amount), 'reference': '',
+                'message': 'Refund to be paid out by staff'}
+
+
+class BankTransferProcessor(ManualPaymentProcessor):
+    """Bank transfers reconciled against statements by staff"""
+    instructions = 'Transfer the order total quoting your order number as the reference.'
+
+
+class CashOnDeliveryProcessor(ManualPaymentProcessor):
+    """Cash collected by the courier on delivery"""
+    instructions = 'Pay the courier in cash when your order is delivered.'
+
+
+_processors = {}
+_processors_lock = threading.Lock()
+
+
 def get_payment_processor(method):
-    """Get payment processor based on method"""
-    if method == 'mpesa':
-        return MpesaProcessor()
-    else:
-        raise ValueError(f"Unsupported payment method: {method}")
+    """Get the shared processor instance configured for a payment method"""
+    processor = _processors.get(method)
+    if processor is None:
+        with _processors_lock:
+            processor = _processors.get(method)
+            if processor is None:
+                config = settings.PAYMENT_PROCESSORS.get(method)
+                if config is None:
+                    raise ValueError(f"Unsupported payment method: {method}")
+                processor = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+                _processors[method] = processor
+    return processor
+
+
+@receiver(setting_changed)
+def reset_payment_processors(setting, **kwargs):
+    """Rebuild processors when their configuration changes (e.g. in tests)"""
+    if setting == 'PAYMENT_PROCESSORS' or setting.startswith('MPESA_'):
+        with _processors_lock:
+            _processors.clear()
@@ -0,0 +1,162 @@
+"""
+Payment status resolution
+
+The locally stored Payment is the source of truth: the M-Pesa callback
+normally records the final result. Safaricom's STK query API is only asked
+about payments that are still pending some time after the prompt was sent,
+at most once per interval per checkout request, and always from a
+background worker rather than the web request.
+
+Callbacks are recorded in the MpesaCallback ledger, keyed by checkout
+request id, so repeated deliveries are acknowledged without being applied
+again; results are applied under a row lock on the payment. An STK push
+that failed after it may have reached Daraja leaves its payment pending,
+with no checkout request id to match, until staff settle it.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from apps.core.tasks import enqueue
+from .models import MpesaCallback, Order, Payment
+
+
+def apply_mpesa_result(payment, result_code, data, receipt=''):
+    """Record a final M-Pesa result code (0 is success) on a payment and its order"""
+    success = str(result_code) == '0'
+    payment.status = Payment.Status.SUCCESS if success else Payment.Status.FAILED
+    payment.mpesa_response_code = str(result_code)
+    payment.gateway_response = data
+    fields = ['status', 'mpesa_response_code', 'gateway_response', 'updated_at']
+    if receipt:
+        payment.mpesa_receipt = receipt
+        fields.append('mpesa_receipt')
+    payment.save(update_fields=fields)
+    if success:
+        Order.objects.filter(pk=payment.order_id).update(payment_status=Order.PaymentStatus.PAID,
+                                                         updated_at=timezone.now())
+
+
+def record_mpesa_result(checkout_request_id, result_code, data, receipt=''):
+    """
+    Apply a result to the pending payment for checkout_request_id under a row
+    lock. Returns the payment, or None when it is unknown; results for
+    payments that are already settled are ignored.
+    """
+    with transaction.atomic():
+        payment = (Payment.objects.select_for_update()
+                   .filter(mpesa_checkout_request_id=checkout_request_id).first())
+        if payment is not None and payment.status == Payment.Status.PENDING:
+            apply_mpesa_result(payment, result_code, data, receipt)
+        return payment
+
+
+def parse_stk_callback(data):
+    """Return (checkout_request_id, result_code, receipt) from a Daraja STK callback body"""
+    callback = data.get('Body', {}).get('stkCallback', data)
+    items = callback.get('CallbackMetadata', {}).get('Item', [])
+    receipt = next((item.get('Value') for item in items if item.get('Name') == 'MpesaReceiptNumber'), '')
+    checkout_request_id = callback.get('CheckoutRequestID')
+    if not checkout_request_id or callback.get('ResultCode') is None:
+        raise ValueError("Not an STK push callback")
+    return checkout_request_id, str(callback['ResultCode']), str(receipt or '')
+
+
+def ingest_mpesa_callback(data):
+    """
+    Record a callback in the ledger and apply it to its payment. Repeated
+    deliveries are short-circuited by the ledger's unique checkout request id.
+    Returns True when this call applied the result.
+    """
+    checkout_request_id, result_code, receipt = parse_stk_callback(data)
+    with transaction.atomic():
+        entry, created = MpesaCallback.objects.get_or_create(
+            checkout_request_id=checkout_request_id,
+            defaults={'result_code': result_code, 'payload': data},
+        )
+        if not created:
+            entry = MpesaCallback.objects.select_for_update().get(pk=entry.pk)
+        if entry.processed_at:
+            return False
+        return _settle(entry, receipt)
+
+
+def settle_waiting_callback(checkout_request_id):
+    """Apply a callback that arrived before its payment stored the checkout request id"""
+    with transaction.atomic():
+        entry = MpesaCallback.objects.select_for_update().filter(
+            checkout_request_id=checkout_request_id, processed_at__isnull=True
+        ).first()
+        if entry is None:
+            return False
+        _, _, receipt = parse_stk_callback(entry.payload)
+        return _settle(entry, receipt)
+
+
+def _settle(entry, receipt):
+    payment = record_mpesa_result(entry.checkout_request_id, entry.result_code, entry.payload, receipt)
+    if payment is None:
+        # Kept unprocessed until the STK push task stores the checkout request id
+        return False
+    entry.payment = payment
+    entry.processed_at = timezone.now()
+    entry.save(update_fields=['payment', 'processed_at', 'updated_at'])
+    return True
+
+
+def resolve_payments(queryset, succeeded):
+    """
+    Settle pending payments whose STK push failed after it may have reached
+    Daraja, once staff have checked with Safaricom; returns how many
+    """
+    status = Payment.Status.SUCCESS if succeeded else Payment.Status.FAILED
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(queryset.filter(status=Payment.Status.PENDING, mpesa_checkout_request_id='',
+                                   gateway_response__has_key='error')
+                   .select_for_update().values_list('pk', flat=True))
+        Payment.objects.filter(pk__in=ids).update(status=status, updated_at=now)
+        if succeeded:
+            Order.objects.filter(payments__in=ids).update(payment_status=Order.PaymentStatus.PAID, updated_at=now)
+    return len(ids)
+
+
+def needs_upstream_query(payment, now=None):
+    """True when a pending M-Pesa payment has waited long enough to ask Safaricom"""
+    if (payment is None or payment.method != Payment.PaymentMethod.MPESA
+            or payment.status != Payment.Status.PENDING or not payment.mpesa_checkout_request_id):
+        return False
+    now = now or timezone.now()
+    return payment.updated_at <= now - timedelta(seconds=settings.MPESA_STATUS_QUERY_AFTER)
+
+
+def claim_status_query(checkout_request_id):
+    """
+    Claim the right to query Safaricom about a checkout request; False when
+    it was already queried within MPESA_STATUS_QUERY_INTERVAL
+    """
+    # cache.add is atomic, so concurrent pollers and reconcilers claim it once
+    return cache.add(f"mpesa:status-query:{checkout_request_id}", 1, settings.MPESA_STATUS_QUERY_INTERVAL)
+
+
+def refresh_payment_status(payment):
+    """
+    Queue an STK status query for a payment the callback has not settled yet.
+    Returns True when a query was queued.
+    """
+    if not needs_upstream_query(payment) or not claim_status_query(payment.mpesa_checkout_request_id):
+        return False
+    from .tasks import query_stk_status
+    enqueue(query_stk_status, payment_id=payment.pk)
+    return True
+
+
+def payment_status_data(order):
+    """The order's latest payment, and its state as a JSON-serializable dict"""
+    payment = order.payments.order_by('-id').first()
+    return payment, {
+        'order_payment_status': order.payment_status,
+        'payment_status': payment.status if payment else None,
+        'prompt_sent': bool(payment and payment.mpesa_checkout_request_id),
+    }
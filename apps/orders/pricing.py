@@ -0,0 +1,191 @@
+"""
+Tax and shipping pricing rules
+
+Active TaxRates, the category tree and active ShippingMethods are loaded
+into an in-memory PricingIndex, so quoting a cart runs no queries. Every
+process keeps its own index, tagged with the rules version held in the
+shared cache. Saving or deleting a rule bumps that version. A process
+drops its own index straight away and other processes notice the new
+version within PRICING_RULES_CHECK_INTERVAL seconds.
+
+When no rule applies, DEFAULT_TAX_RATE is used for tax. When no shipping
+method is configured at all, a standard delivery at DEFAULT_SHIPPING_FEE
+is used, free from FREE_SHIPPING_OVER.
+"""
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from apps.products.models import Category
+from .models import ShippingMethod, TaxRate
+
+RULES_VERSION_KEY = 'pricing:rules:version'
+
+CENT = Decimal('0.01')
+
+Method = namedtuple('Method', 'id name price free_over estimated_days')
+ShippingOption = namedtuple('ShippingOption', 'method cost')
+
+
+class Quote(namedtuple('Quote', 'subtotal tax method shipping options')):
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return self.subtotal + self.tax + self.shipping
+
+
+_index = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+class PricingError(Exception):
+    """Raised when an order cannot be quoted, e.g. nothing ships to its country"""
+
+
+def normalize_country(country):
+    return (country or '').strip().casefold()
+
+
+def get_rules_version():
+    version = cache.get(RULES_VERSION_KEY)
+    if version is None:
+        cache.add(RULES_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(RULES_VERSION_KEY)
+    return version
+
+
+def bump_rules_version():
+    # Time based, so a version evicted from the cache never comes back
+    cache.set(RULES_VERSION_KEY, time.time_ns(), None)
+
+
+def default_method():
+    return Method(None, 'Standard delivery', Decimal(str(settings.DEFAULT_SHIPPING_FEE)),
+                  Decimal(str(settings.FREE_SHIPPING_OVER)), None)
+
+
+class PricingIndex:
+    """Immutable snapshot of the pricing rules at one version"""
+
+    def __init__(self, version, rates, parents, methods):
+        self.version = version
+        # (category_id or None, country or '') -> rate
+        self.rates = rates
+        # category_id -> parent_id
+        self.parents = parents
+        # country -> methods; '' holds the methods that ship everywhere
+        self.methods = methods
+        self.default_rate = Decimal(str(settings.DEFAULT_TAX_RATE))
+        self._resolved = {}
+        self._shipping = {}
+
+    @classmethod
+    def load(cls, version):
+        rates = {
+            (category_id, normalize_country(country)): rate
+            for category_id, country, rate in TaxRate.objects.filter(is_active=True)
+            .values_list('category_id', 'country', 'rate')
+        }
+        parents = dict(Category.objects.values_list('pk', 'parent_id'))
+        methods = {}
+        configured = ShippingMethod.objects.filter(is_active=True).order_by('price', 'pk')
+        for shipping_method in configured:
+            method = Method(shipping_method.pk, shipping_method.name, shipping_method.price,
+                            shipping_method.free_over, shipping_method.estimated_days)
+            for country in shipping_method.country_list() or ['']:
+                methods.setdefault(country, []).append(method)
+        if not methods:
+            methods[''] = [default_method()]
+        return cls(version, rates, parents, {country: tuple(found) for country, found in methods.items()})
+
+    def tax_rate(self, category_id, country):
+        """Percentage rate for a category shipped to a (normalized) country"""
+        key = (category_id, country)
+        rate = self._resolved.get(key)
+        if rate is None:
+            rate = self._resolve(category_id, country)
+            self._resolved[key] = rate
+        return rate
+
+    def _resolve(self, category_id, country):
+        seen = set()
+        while category_id is not None and category_id not in seen:
+            seen.add(category_id)
+            for key in ((category_id, country), (category_id, '')):
+                if key in self.rates:
+                    return self.rates[key]
+            category_id = self.parents.get(category_id)
+        for key in ((None, country), (None, '')):
+            if key in self.rates:
+                return self.rates[key]
+        return self.default_rate
+
+    def shipping_methods(self, country):
+        """Methods shipping to a (normalized) country, cheapest first"""
+        methods = self._shipping.get(country)
+        if methods is None:
+            methods = self.methods.get('', ())
+            if country:
+                methods += self.methods.get(country, ())
+            methods = tuple(sorted(methods, key=lambda method: method.price))
+            self._shipping[country] = methods
+        return methods
+
+
+def get_index():
+    """The pricing index for the current rules version"""
+    global _index, _checked
+    index = _index
+    now = time.monotonic()
+    if index is not None and now - _checked < settings.PRICING_RULES_CHECK_INTERVAL:
+        return index
+    version = get_rules_version()
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = PricingIndex.load(version)
+            index = _index
+    _checked = now
+    return index
+
+
+def reset_index():
+    """Drop this process's index; the next quote loads the current rules"""
+    global _index
+    _index = None
+
+
+def rules_changed():
+    """Make every process reload the pricing rules"""
+    bump_rules_version()
+    reset_index()
+
+
+def quote(lines, country, method_id=None):
+    """
+    Price a cart. lines are (category_id, amount) pairs. The shipping method
+    is method_id when given, otherwise the cheapest one for the order.
+    """
+    index = get_index()
+    country = normalize_country(country)
+    subtotal = sum((amount for _, amount in lines), Decimal('0'))
+    tax = sum((amount * index.tax_rate(category_id, country) for category_id, amount in lines), Decimal('0'))
+
+    options = [
+        ShippingOption(method, Decimal('0') if method.free_over is not None and subtotal >= method.free_over
+                       else method.price)
+        for method in index.shipping_methods(country)
+    ]
+    if not options:
+        raise PricingError("We do not ship to this country")
+    if method_id is None:
+        chosen = min(options, key=lambda option: option.cost)
+    else:
+        chosen = next((option for option in options if option.method.id == method_id), None)
+        if chosen is None:
+            raise PricingError("This shipping method is not available for your country")
+    return Quote(subtotal, (tax / 100).quantize(CENT), chosen.method, chosen.cost, options)
@@ -0,0 +1,138 @@
+"""
+Batch reconciliation of pending M-Pesa payments
+
+Pending payments whose callbacks never arrived are scanned in primary key
+order, a batch at a time. Their status is queried from Safaricom with the
+processor's confirm_many(), a bounded thread pool over the pooled Daraja
+client, and the results of a batch are applied with one bulk_update of
+payments and one UPDATE of orders.
+"""
+import logging
+import statistics
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Order, Payment
+from .mpesa import is_query_pending
+from .payment_processors import get_payment_processor
+from .payments import claim_status_query
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileReport:
+    """Outcome and metrics of a reconciliation run"""
+
+    def __init__(self):
+        self.scanned = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.pending = 0
+        self.skipped = 0
+        self.errors = 0
+        self.latencies = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def latency_ms(self, quantile):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * quantile), len(ordered) - 1)] * 1000
+
+    def as_dict(self):
+        return {
+            'scanned': self.scanned,
+            'reconciled': self.succeeded + self.failed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'still_pending': self.pending,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'query_latency_ms': {
+                'mean': round(statistics.fmean(self.latencies) * 1000, 1) if self.latencies else 0.0,
+                'p50': round(self.latency_ms(0.5), 1),
+                'p95': round(self.latency_ms(0.95), 1),
+                'max': round(self.latency_ms(1.0), 1),
+            },
+            'elapsed_seconds': round(self.elapsed, 3),
+        }
+
+
+def _apply(results, report):
+    """Write the final results of a batch; payments settled meanwhile are left alone"""
+    if not results:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        pending = Payment.objects.select_for_update().filter(
+            pk__in=results, status=Payment.Status.PENDING
+        ).order_by('pk').only('pk', 'order_id', 'status', 'mpesa_response_code', 'gateway_response')
+        changed, paid_orders = [], []
+        for payment in pending:
+            response = results[payment.pk]
+            payment.mpesa_response_code = str(response['ResultCode'])
+            payment.gateway_response = response
+            payment.updated_at = now
+            if payment.mpesa_response_code == '0':
+                payment.status = Payment.Status.SUCCESS
+                paid_orders.append(payment.order_id)
+                report.succeeded += 1
+            else:
+                payment.status = Payment.Status.FAILED
+                report.failed += 1
+            changed.append(payment)
+        Payment.objects.bulk_update(changed, ['status', 'mpesa_response_code', 'gateway_response', 'updated_at'])
+        if paid_orders:
+            Order.objects.filter(pk__in=paid_orders).update(payment_status=Order.PaymentStatus.PAID,
+                                                            updated_at=now)
+
+
+def reconcile_payments(older_than=None, batch_size=200, workers=8):
+    """
+    Query and settle every M-Pesa payment still pending older_than seconds
+    (MPESA_STATUS_QUERY_AFTER by default) after its prompt was sent
+    """
+    older_than = settings.MPESA_STATUS_QUERY_AFTER if older_than is None else older_than
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    queryset = Payment.objects.filter(
+        method=Payment.PaymentMethod.MPESA, status=Payment.Status.PENDING, updated_at__lte=cutoff
+    ).exclude(mpesa_checkout_request_id='').order_by('pk')
+
+    report = ReconcileReport()
+    processor = None
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).only('pk', 'method', 'mpesa_checkout_request_id')[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        report.scanned += len(batch)
+        processor = processor or get_payment_processor(Payment.PaymentMethod.MPESA)
+
+        # Requests polled or reconciled moments ago are left for the next run
+        due = [payment for payment in batch if claim_status_query(payment.mpesa_checkout_request_id)]
+        report.skipped += len(batch) - len(due)
+
+        results = {}
+        for result in processor.confirm_many(due, max_concurrency=workers):
+            report.latencies.append(result.seconds)
+            if is_query_pending(result.error):
+                report.pending += 1
+            elif result.error is not None:
+                report.errors += 1
+                logger.warning("STK status query for %s failed: %s",
+                               result.payment.mpesa_checkout_request_id, result.error)
+            elif 'ResultCode' in result.response:
+                results[result.payment.pk] = result.response
+            else:
+                report.pending += 1
+        _apply(results, report)
+        if len(batch) < batch_size:
+            break
+
+    report.elapsed = time.perf_counter() - report.started
+    logger.info("Payment reconciliation finished", extra={'metrics': report.as_dict()})
+    return report
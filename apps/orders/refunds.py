@@ -0,0 +1,234 @@
+"""
+Refund workflow
+
+Refunds are requested against a settled Payment, in full or in part, and
+optionally cover order lines that go back to stock. Requested refunds are
+processed in batches: a batch is claimed with SKIP LOCKED, submitted to each
+gateway with bounded concurrency, and its outcomes are written with one
+bulk_update. Completed refunds update their orders' payment status in bulk
+and restock their lines with one statement per model.
+
+A refund whose request may have reached the gateway without an answer is
+recorded as UNKNOWN rather than FAILED, so it is never paid out twice by a
+retry; the gateway's result or staff settle it. Refunds a crashed worker
+left in PROCESSING end up UNKNOWN the same way.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from apps.core.tasks import enqueue
+from apps.products import inventory
+from .models import Order, Payment, Refund, RefundItem
+from .payment_processors import get_payment_processor, may_have_reached_gateway
+
+logger = logging.getLogger(__name__)
+
+# Refunds that count against a payment's refundable amount
+OPEN_STATUSES = [Refund.Status.REQUESTED, Refund.Status.PROCESSING, Refund.Status.SUBMITTED,
+                 Refund.Status.UNKNOWN, Refund.Status.SUCCEEDED]
+
+# Gateway response 'status' -> refund status
+RESPONSE_STATUSES = {
+    'succeeded': Refund.Status.SUCCEEDED,
+    'submitted': Refund.Status.SUBMITTED,
+    'unknown': Refund.Status.UNKNOWN,
+    'failed': Refund.Status.FAILED,
+}
+
+
+class RefundError(Exception):
+    """Raised when a refund cannot be requested; nothing is saved"""
+
+
+def refundable_amount(payment):
+    """What is left of a payment after its open and completed refunds"""
+    refunded = payment.refunds.filter(status__in=OPEN_STATUSES).aggregate(total=Sum('amount'))['total']
+    return payment.amount - (refunded or 0)
+
+
+def request_refund(payment, amount=None, items=(), reason='', restock=False, requested_by=None):
+    """
+    Request a refund of amount from a successful payment. items are
+    (order_item, quantity) pairs the refund covers; without an amount the
+    refund is their value, or everything still refundable.
+    """
+    items = list(items)
+    with transaction.atomic():
+        # Serialize refunds of the same payment so they cannot overshoot it
+        payment = Payment.objects.select_for_update().select_related('order').get(pk=payment.pk)
+        if payment.status != Payment.Status.SUCCESS:
+            raise RefundError("Only successful payments can be refunded")
+
+        if items:
+            refunded = dict(RefundItem.objects.filter(
+                order_item__in=[order_item for order_item, _ in items], refund__status__in=OPEN_STATUSES
+            ).values('order_item').annotate(total=Sum('quantity')).values_list('order_item', 'total'))
+            for order_item, quantity in items:
+                if order_item.order_id != payment.order_id:
+                    raise RefundError(f"{order_item.product_name} is not part of order {payment.order.order_number}")
+                if quantity < 1 or quantity + refunded.get(order_item.pk, 0) > order_item.quantity:
+                    raise RefundError(f"Cannot refund {quantity} x {order_item.product_name}")
+            if amount is None:
+                amount = sum(order_item.unit_price * quantity for order_item, quantity in items)
+
+        remaining = refundable_amount(payment)
+        amount = remaining if amount is None else Decimal(amount)
+        if amount <= 0 or amount > remaining:
+            raise RefundError(f"Refund must be between 0.01 and {remaining}")
+        if (payment.method == Payment.PaymentMethod.MPESA and amount < payment.amount
+                and amount != amount.to_integral_value()):
+            # Partial M-Pesa refunds are B2C payments, which are whole shillings
+            raise RefundError("Partial M-Pesa refunds must be a whole number of shillings")
+
+        refund = Refund.objects.create(payment=payment, amount=amount, reason=reason,
+                                       restock=restock and bool(items), requested_by=requested_by)
+        RefundItem.objects.bulk_create([
+            RefundItem(refund=refund, order_item=order_item, quantity=quantity) for order_item, quantity in items
+        ])
+        from .tasks import process_requested_refunds
+        enqueue(process_requested_refunds)
+    return refund
+
+
+def _claim(queryset, batch_size):
+    with transaction.atomic():
+        ids = list(queryset.filter(status=Refund.Status.REQUESTED).order_by('pk')
+                   .select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+        Refund.objects.filter(pk__in=ids).update(status=Refund.Status.PROCESSING, updated_at=timezone.now())
+    return ids
+
+
+def expire_processing():
+    """Mark refunds stuck in PROCESSING past REFUND_PROCESSING_TIMEOUT as UNKNOWN; returns how many"""
+    now = timezone.now()
+    return Refund.objects.filter(
+        status=Refund.Status.PROCESSING,
+        updated_at__lt=now - timedelta(seconds=settings.REFUND_PROCESSING_TIMEOUT),
+    ).update(status=Refund.Status.UNKNOWN, updated_at=now)
+
+
+def process_refunds(queryset=None, batch_size=100, max_concurrency=None):
+    """Submit requested refunds to their gateways; returns a count per resulting status"""
+    queryset = Refund.objects.all() if queryset is None else queryset
+    counts = {}
+    expired = expire_processing()
+    if expired:
+        logger.warning("%s refund(s) left processing by a crashed worker are now of unknown outcome", expired)
+    while True:
+        ids = _claim(queryset, batch_size)
+        if not ids:
+            return counts
+        refunds = list(Refund.objects.filter(pk__in=ids).select_related('payment__order'))
+        by_method = {}
+        for refund in refunds:
+            by_method.setdefault(refund.payment.method, []).append(refund)
+
+        now = timezone.now()
+        for method, group in by_method.items():
+            try:
+                results = get_payment_processor(method).refund_many(group, max_concurrency)
+            except ValueError as exc:
+                # No processor is configured for this method
+                results = [(refund, None, exc, 0) for refund in group]
+            for refund, response, error, _ in results:
+                if error is not None:
+                    status = 'unknown' if may_have_reached_gateway(error) else 'failed'
+                    logger.warning("Refund %s %s: %s", refund.pk, status, error)
+                    response = {'status': status, 'error': str(error)}
+                refund.transition(RESPONSE_STATUSES.get(response.get('status'), Refund.Status.FAILED))
+                refund.gateway_reference = response.get('reference') or ''
+                refund.gateway_response = response
+                refund.processed_at = now
+                refund.updated_at = now
+
+        Refund.objects.bulk_update(refunds, ['status', 'gateway_reference', 'gateway_response',
+                                             'processed_at', 'updated_at'])
+        complete_refunds([refund.pk for refund in refunds if refund.status == Refund.Status.SUCCEEDED])
+        for refund in refunds:
+            counts[refund.status] = counts.get(refund.status, 0) + 1
+
+
+def complete_refunds(refund_ids):
+    """Restock and update the orders of refunds that just succeeded"""
+    if not refund_ids:
+        return
+    with transaction.atomic():
+        inventory.restock(
+            inventory.StockLine(*line) for line in RefundItem.objects.filter(
+                refund__in=refund_ids, refund__restock=True
+            ).values_list('order_item__product_id', 'order_item__product_variant_id', 'quantity')
+        )
+
+        order_ids = set(Payment.objects.filter(refunds__in=refund_ids).values_list('order_id', flat=True))
+        paid = dict(Payment.objects.filter(order__in=order_ids, status=Payment.Status.SUCCESS)
+                    .values('order').annotate(total=Sum('amount')).values_list('order', 'total'))
+        refunded = dict(Refund.objects.filter(payment__order__in=order_ids, status=Refund.Status.SUCCEEDED)
+                        .values('payment__order').annotate(total=Sum('amount'))
+                        .values_list('payment__order', 'total'))
+        full = [order_id for order_id in order_ids if refunded.get(order_id, 0) >= paid.get(order_id, 0)]
+        partial = order_ids.difference(full)
+        now = timezone.now()
+        if full:
+            Order.objects.filter(pk__in=full).update(status=Order.Status.REFUNDED,
+                                                     payment_status=Order.PaymentStatus.REFUNDED,
+                                                     updated_at=now)
+        if partial:
+            Order.objects.filter(pk__in=partial).update(payment_status=Order.PaymentStatus.PARTIALLY_REFUNDED,
+                                                        updated_at=now)
+
+
+def apply_refund_result(reference, succeeded, data, unknown=None):
+    """
+    Record a gateway's final result for a submitted refund; returns False
+    for unknown or settled ones. unknown are lookups matching the result to
+    a refund of unknown outcome, which never learnt its reference.
+    """
+    with transaction.atomic():
+        refunds = Refund.objects.select_for_update().order_by('pk')
+        refund = refunds.filter(gateway_reference=reference, status=Refund.Status.SUBMITTED).first()
+        if refund is None and unknown:
+            refund = refunds.filter(status=Refund.Status.UNKNOWN, **unknown).first()
+        if refund is None:
+            return False
+        refund.transition(Refund.Status.SUCCEEDED if succeeded else Refund.Status.FAILED)
+        refund.gateway_reference = refund.gateway_reference or reference or ''
+        refund.gateway_response = data
+        refund.save(update_fields=['status', 'gateway_reference', 'gateway_response', 'updated_at'])
+        if refund.status == Refund.Status.SUCCEEDED:
+            complete_refunds([refund.pk])
+    return True
+
+
+def resolve_refunds(queryset, succeeded):
+    """Settle refunds of unknown outcome once staff have checked the gateway; returns how many"""
+    status = Refund.Status.SUCCEEDED if succeeded else Refund.Status.FAILED
+    with transaction.atomic():
+        ids = list(queryset.filter(status=Refund.Status.UNKNOWN).select_for_update().values_list('pk', flat=True))
+        Refund.objects.filter(pk__in=ids).update(status=status, processed_at=timezone.now(),
+                                                 updated_at=timezone.now())
+        if succeeded:
+            complete_refunds(ids)
+    return len(ids)
+
+
+def retry_refunds(queryset):
+    """Send failed refunds back to the queue; returns how many were requeued"""
+    count = queryset.filter(status=Refund.Status.FAILED).update(status=Refund.Status.REQUESTED,
+                                                                updated_at=timezone.now())
+    if count:
+        from .tasks import process_requested_refunds
+        enqueue(process_requested_refunds)
+    return count
+
+
+def cancel_refund(refund):
+    """Cancel a refund that has not been submitted yet"""
+    with transaction.atomic():
+        refund = Refund.objects.select_for_update().get(pk=refund.pk)
+        refund.transition(Refund.Status.CANCELLED)
+        refund.save(update_fields=['status', 'updated_at'])
+    return refund
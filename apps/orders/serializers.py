@@ -2,7 +2,8 @@
 Serializers for the orders app
 """
 from rest_framework import serializers
-from .models import Order, OrderItem
+from apps.products.models import Product, ProductVariant
+from .models import CartItem, Order, OrderItem, ShippingMethod
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -24,4 +25,84 @@ class OrderSerializer(serializers.ModelSerializer):
             'subtotal', 'tax_amount', 'shipping_amount', 'discount_amount',
             'total_amount', 'created_at', 'items'
         ]
-        read_only_fields = fields
\ No newline at end of file
+        read_only_fields = fields
+
+
+class CartItemSerializer(serializers.ModelSerializer):
+    """Serializer for refreshed cart lines"""
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    product_slug = serializers.CharField(source='product.slug', read_only=True)
+    variant_name = serializers.CharField(source='variant.name', read_only=True, default=None)
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    available_quantity = serializers.IntegerField(read_only=True, allow_null=True)
+    is_available = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = CartItem
+        fields = ['id', 'product', 'product_name', 'product_slug', 'variant', 'variant_name',
+                  'quantity', 'unit_price', 'line_total', 'available_quantity', 'is_available']
+        read_only_fields = fields
+
+
+class CartSerializer(serializers.Serializer):
+    """Serializer for a cart summary"""
+    items = CartItemSerializer(many=True)
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    is_available = serializers.BooleanField()
+
+
+class CartItemAddSerializer(serializers.Serializer):
+    """Input for adding a product or variant to the cart"""
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.active())
+    variant = serializers.PrimaryKeyRelatedField(queryset=ProductVariant.objects.filter(is_active=True),
+                                                 required=False, allow_null=True)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+    def validate(self, attrs):
+        variant = attrs.get('variant')
+        if variant is not None and variant.product_id != attrs['product'].pk:
+            raise serializers.ValidationError({'variant': 'Variant does not belong to this product.'})
+        return attrs
+
+
+class CartItemUpdateSerializer(serializers.Serializer):
+    """Input for changing a cart line's quantity (0 removes it)"""
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    """Input for placing an order from the cart"""
+    coupon_code = serializers.CharField(max_length=50, required=False, allow_blank=True)
+    shipping_method = serializers.PrimaryKeyRelatedField(queryset=ShippingMethod.objects.filter(is_active=True),
+                                                         required=False, allow_null=True)
+
+    class Meta:
+        model = Order
+        fields = ['shipping_name', 'shipping_email', 'shipping_phone', 'shipping_address_line1',
+                  'shipping_address_line2', 'shipping_city', 'shipping_state', 'shipping_postal_code',
+                  'shipping_country', 'shipping_method', 'notes', 'coupon_code']
+
+
+class ShippingQuoteRequestSerializer(serializers.Serializer):
+    """Input for quoting tax and shipping on the cart"""
+    country = serializers.CharField(max_length=100)
+    shipping_method = serializers.IntegerField(required=False, allow_null=True)
+
+
+class ShippingOptionSerializer(serializers.Serializer):
+    """A shipping method available for a quote, with its cost for the cart"""
+    id = serializers.IntegerField(source='method.id', allow_null=True)
+    name = serializers.CharField(source='method.name')
+    estimated_days = serializers.IntegerField(source='method.estimated_days', allow_null=True)
+    cost = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class ShippingQuoteSerializer(serializers.Serializer):
+    """Tax and shipping for the cart's contents"""
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    tax_amount = serializers.DecimalField(max_digits=12, decimal_places=2, source='tax')
+    shipping_method = serializers.IntegerField(source='method.id', allow_null=True)
+    shipping_amount = serializers.DecimalField(max_digits=10, decimal_places=2, source='shipping')
+    total_amount = serializers.DecimalField(max_digits=12, decimal_places=2, source='total')
+    options = ShippingOptionSerializer(many=True)
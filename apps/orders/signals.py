@@ -0,0 +1,46 @@
+"""
+Signal handlers for orders app
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from apps.products.models import Category
+from .cart import CART_SESSION_KEY, merge_carts
+from .coupons import invalidate_coupon
+from .models import Cart, Coupon, ShippingMethod, TaxRate
+from .pricing import reset_index, rules_changed
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Move the lines of the visitor's anonymous cart into their own cart"""
+    if request is None or not hasattr(request, 'session'):
+        return
+    cart_id = request.session.pop(CART_SESSION_KEY, None)
+    if cart_id is None:
+        return
+    anonymous = Cart.objects.filter(pk=cart_id, user__isnull=True).first()
+    if anonymous is None:
+        return
+    cart = Cart.objects.filter(user=user).first()
+    if cart is None:
+        anonymous.user = user
+        anonymous.save(update_fields=['user', 'updated_at'])
+    else:
+        merge_carts(anonymous, cart)
+
+
+@receiver([post_save, post_delete], sender=Coupon)
+def invalidate_cached_coupon(sender, instance, **kwargs):
+    code = instance.code
+    transaction.on_commit(lambda: invalidate_coupon(code))
+
+
+@receiver([post_save, post_delete], sender=TaxRate)
+@receiver([post_save, post_delete], sender=ShippingMethod)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_pricing_rules(sender, instance, **kwargs):
+    """Tax rates follow the category tree, so categories count as pricing rules"""
+    reset_index()
+    transaction.on_commit(rules_changed)
@@ -0,0 +1,64 @@
+"""
+Background tasks for the orders app
+"""
+import requests
+from apps.core.tasks import task
+from .models import Payment
+from .mpesa import is_query_pending
+from .payment_processors import get_payment_processor, may_have_reached_gateway
+from .payments import record_mpesa_result, settle_waiting_callback
+
+
+@task(name='orders.send_stk_push', max_attempts=1)
+def send_stk_push(payment_id):
+    """Send the M-Pesa STK push for a pending payment and store Safaricom's reply"""
+    payment = Payment.objects.select_related('order').get(pk=payment_id)
+    if payment.status != Payment.Status.PENDING or payment.mpesa_checkout_request_id:
+        return
+    try:
+        response = get_payment_processor(payment.method).initiate(payment)
+    except Exception as exc:
+        # Only connections that never reached Daraja were retried; a second
+        # prompt on the customer's phone would be worse than asking them to try again
+        payment.gateway_response = {'error': str(exc)}
+        if not may_have_reached_gateway(exc):
+            payment.status = Payment.Status.FAILED
+        # Otherwise the customer may have been prompted and may still pay, so the
+        # payment stays pending until staff settle it with resolve_payments()
+        payment.save(update_fields=['status', 'gateway_response', 'updated_at'])
+        raise
+
+    payment.gateway_response = response
+    payment.mpesa_response_code = str(response.get('ResponseCode', ''))
+    if payment.mpesa_response_code == '0':
+        payment.mpesa_checkout_request_id = response.get('CheckoutRequestID', '')
+    else:
+        payment.status = Payment.Status.FAILED
+    payment.save(update_fields=['status', 'gateway_response', 'mpesa_response_code',
+                                'mpesa_checkout_request_id', 'updated_at'])
+    if payment.mpesa_checkout_request_id:
+        # The customer may have answered before we stored the request id
+        settle_waiting_callback(payment.mpesa_checkout_request_id)
+
+
+@task(name='orders.query_stk_status', max_attempts=1)
+def query_stk_status(payment_id):
+    """Ask Safaricom for the result of a pending STK push the callback has not reported"""
+    payment = Payment.objects.get(pk=payment_id)
+    if payment.status != Payment.Status.PENDING or not payment.mpesa_checkout_request_id:
+        return
+    try:
+        response = get_payment_processor(payment.method).confirm(payment)
+    except requests.HTTPError as error:
+        if is_query_pending(error):
+            return
+        raise
+    if 'ResultCode' in response:
+        record_mpesa_result(payment.mpesa_checkout_request_id, response['ResultCode'], response)
+
+
+@task(name='orders.process_refunds', max_attempts=3)
+def process_requested_refunds():
+    """Submit every requested refund to its gateway"""
+    from .refunds import process_refunds
+    process_refunds()
@@ -1,3 +1,746 @@
-from django.test import TestCase
+import io
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.core.models import PlatformStatistic
+from apps.core.stats import reconcile_platform_stats
+from apps.core.tasks import run_pending
+from apps.products.models import Category, Product
+from . import mpesa, pricing
+from .cart import merge_carts
+from .checkout import CheckoutError, checkout
+from .coupons import CouponError, generate_codes, get_coupon, redeem
+from .models import (Cart, CartItem, Coupon, CouponRedemption, MpesaCallback, Order, OrderItem, Payment, Refund,
+                     ShippingMethod, TaxRate)
+from .payment_processors import get_payment_processor
+from .payments import resolve_payments, settle_waiting_callback
+from .reconciliation import reconcile_payments
+from .refunds import RefundError, process_refunds, request_refund, resolve_refunds, retry_refunds
+from .tasks import query_stk_status, send_stk_push
+from .totals import recalculate_totals
 
-# Create your tests here.
+SHIPPING = {
+    'shipping_name': 'Jane Doe',
+    'shipping_email': 'jane@example.com',
+    'shipping_address_line1': '1 Moi Avenue',
+    'shipping_city': 'Nairobi',
+    'shipping_state': 'Nairobi',
+    'shipping_postal_code': '00100',
+}
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create(username='jane', email='jane@example.com')
+        self.products = [
+            Product.objects.create(name=f'Item {i}', description='Item', base_price=100,
+                                   stock_quantity=10, status=Product.Status.ACTIVE)
+            for i in range(10)
+        ]
+
+    def make_cart(self, products, quantity=2):
+        cart = Cart.objects.get_or_create(user=self.customer)[0]
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity, unit_price=product.base_price)
+            for product in products
+        ])
+        return cart
+
+    def place(self, cart, **kwargs):
+        with CaptureQueriesContext(connection) as captured:
+            order = checkout(cart, self.customer, SHIPPING, **kwargs)
+        return order, len(captured)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        _, small = self.place(self.make_cart(self.products[:1]))
+        order, large = self.place(self.make_cart(self.products))
+
+        self.assertEqual(small, large)
+        self.assertEqual(order.items.count(), 10)
+        self.assertEqual(order.subtotal, Decimal('2000'))
+        self.assertEqual(order.total_amount, Decimal('2320'))
+        self.assertFalse(CartItem.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 6)
+
+    def test_short_stock_saves_nothing(self):
+        cart = self.make_cart(self.products[:3], quantity=11)
+        with self.assertRaises(CheckoutError):
+            checkout(cart, self.customer, SHIPPING)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 3)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 10)
+
+    def test_coupon_discount_and_usage(self):
+        now = timezone.now()
+        coupon = Coupon.objects.create(code='SAVE10', name='Save 10%', discount_type=Coupon.DiscountType.PERCENTAGE,
+                                       discount_value=10, usage_limit=1, valid_from=now - timedelta(days=1),
+                                       valid_until=now + timedelta(days=1))
+        order, _ = self.place(self.make_cart(self.products[:5]), coupon_code='SAVE10')
+        self.assertEqual(order.discount_amount, Decimal('100.00'))
+        self.assertEqual(order.total_amount, Decimal('1060.00'))
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.usage_count, 1)
+
+        with self.assertRaises(CheckoutError):
+            checkout(self.make_cart(self.products[5:]), self.customer, SHIPPING, coupon_code='SAVE10')
+
+
+class CartApiTests(TestCase):
+    url = '/api/v1/cart/'
+
+    def setUp(self):
+        self.mug = Product.objects.create(name='Mug', description='Mug', base_price=20, stock_quantity=10,
+                                          status=Product.Status.ACTIVE)
+        self.plate = Product.objects.create(name='Plate', description='Plate', base_price=15, stock_quantity=10,
+                                            status=Product.Status.ACTIVE)
+        self.client = Client(enforce_csrf_checks=True)
+        # A catalog page hands the visitor a CSRF cookie
+        self.client.get(reverse('products:detail', kwargs={'slug': self.mug.slug}))
+        self.csrf = {'HTTP_X_CSRFTOKEN': self.client.cookies['csrftoken'].value}
+
+    def add(self, product, quantity=1, **headers):
+        return self.client.post(f'{self.url}items/', {'product': product.pk, 'quantity': quantity},
+                                content_type='application/json', **{**self.csrf, **headers})
+
+    def lines(self):
+        return {item['product_name']: item['quantity'] for item in self.client.get(self.url).json()['items']}
+
+    def test_anonymous_changes_need_a_csrf_token(self):
+        self.assertEqual(self.add(self.mug, HTTP_X_CSRFTOKEN='').status_code, 403)
+        self.assertEqual(self.client.get(self.url).json()['items'], [])
+
+    def test_add_update_and_remove(self):
+        self.assertEqual(self.add(self.mug).status_code, 201)
+        response = self.add(self.mug, 2)
+        self.assertEqual((response.json()['item_count'], response.json()['subtotal']), (3, '60.00'))
+        item = response.json()['items'][0]['id']
+
+        response = self.client.patch(f'{self.url}items/{item}/', {'quantity': 5}, content_type='application/json',
+                                     **self.csrf)
+        self.assertEqual(response.json()['items'][0]['quantity'], 5)
+        self.assertEqual(self.client.delete(f'{self.url}items/{item}/', **self.csrf).status_code, 200)
+        self.assertEqual(self.client.delete(f'{self.url}items/{item}/', **self.csrf).status_code, 404)
+
+    def test_login_merges_the_anonymous_cart(self):
+        customer = User.objects.create_user('shopper', 'shopper@example.com', 'secret')
+        own = Cart.objects.create(user=customer)
+        CartItem.objects.create(cart=own, product=self.mug, quantity=1, unit_price=20)
+        self.add(self.mug, 2)
+        self.add(self.plate)
+        anonymous = Cart.objects.get(user__isnull=True)
+
+        self.client.login(username='shopper', password='secret')
+        self.assertEqual(self.lines(), {'Mug': 3, 'Plate': 1})
+        self.assertFalse(Cart.objects.filter(pk=anonymous.pk).exists())
+
+    def test_merge_carts(self):
+        source, target = Cart.objects.create(), Cart.objects.create()
+        CartItem.objects.create(cart=source, product=self.mug, quantity=2, unit_price=20)
+        CartItem.objects.create(cart=source, product=self.plate, quantity=1, unit_price=15)
+        CartItem.objects.create(cart=target, product=self.mug, quantity=1, unit_price=20)
+        merge_carts(source, target)
+        self.assertEqual(dict(target.items.values_list('product__name', 'quantity')), {'Mug': 3, 'Plate': 1})
+        self.assertFalse(Cart.objects.filter(pk=source.pk).exists())
+
+    def test_abandoned_anonymous_carts_are_deleted(self):
+        old = timezone.now() - timedelta(days=40)
+        abandoned, revisited, fresh = Cart.objects.create(), Cart.objects.create(), Cart.objects.create()
+        owned = Cart.objects.create(user=User.objects.create_user('owner', 'owner@example.com', 'secret'))
+        for cart in (abandoned, revisited, owned):
+            CartItem.objects.create(cart=cart, product=self.mug, quantity=1, unit_price=20)
+        Cart.objects.exclude(pk=fresh.pk).update(updated_at=old)
+        CartItem.objects.exclude(cart=revisited).update(updated_at=old)
+
+        out = io.StringIO()
+        call_command('delete_abandoned_carts', stdout=out)
+        self.assertIn('Deleted 1 abandoned carts', out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {revisited.pk, fresh.pk, owned.pk})
+
+
+class CouponTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.customer = User.objects.create(username='shopper', email='shopper@example.com')
+        self.coupon = Coupon.objects.create(code='WELCOME', name='Welcome', discount_type=Coupon.DiscountType.FIXED,
+                                            discount_value=50, per_user_limit=1, valid_from=now - timedelta(days=1),
+                                            valid_until=now + timedelta(days=1))
+
+    def place_order(self, coupon):
+        order = Order.objects.create(customer=self.customer, discount_amount=50, **SHIPPING)
+        return CouponRedemption.objects.create(coupon=coupon, customer=self.customer, order=order,
+                                               discount_amount=50)
+
+    def test_redeem_is_one_query_with_cached_definition(self):
+        get_coupon('WELCOME')
+        with self.assertNumQueries(1):
+            coupon, discount = redeem('WELCOME', Decimal('200'), self.customer)
+        self.assertEqual(discount, Decimal('50.00'))
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 1)
+
+    def test_per_customer_limit_and_first_order(self):
+        self.place_order(self.coupon)
+        with self.assertRaisesMessage(CouponError, "You have already used this coupon"):
+            redeem('WELCOME', Decimal('200'), self.customer)
+
+        self.coupon.per_user_limit = None
+        self.coupon.first_order_only = True
+        self.coupon.save()
+        with self.assertRaisesMessage(CouponError, "only valid for first orders"):
+            redeem('WELCOME', Decimal('200'), self.customer)
+
+    def test_saving_invalidates_cached_definition(self):
+        self.assertEqual(get_coupon('WELCOME').discount_value, Decimal('50'))
+        self.assertIsNone(get_coupon('LATER'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coupon.is_active = False
+            self.coupon.save()
+            Coupon.objects.create(code='LATER', name='Later', discount_type=Coupon.DiscountType.FIXED,
+                                  discount_value=5, valid_from=self.coupon.valid_from,
+                                  valid_until=self.coupon.valid_until)
+        self.assertFalse(get_coupon('WELCOME').is_active)
+        self.assertIsNotNone(get_coupon('LATER'))
+
+    def test_generate_single_use_codes(self):
+        with self.assertNumQueries(6):
+            created = generate_codes(self.coupon, 250, prefix='GEN-', batch_size=100)
+        self.assertEqual(created, 250)
+        generated = Coupon.objects.filter(code__startswith='GEN-')
+        self.assertEqual(generated.count(), 250)
+        self.assertEqual(set(generated.values_list('usage_limit', 'discount_value').distinct()), {(1, 50)})
+
+        redeem(generated[0].code, Decimal('100'), self.customer)
+        with self.assertRaisesMessage(CouponError, "usage limit reached"):
+            redeem(generated[0].code, Decimal('100'), self.customer)
+
+
+class TotalsRecalculationTests(TestCase):
+
+    def setUp(self):
+        customer = User.objects.create(username='jane', email='jane@example.com')
+        product = Product.objects.create(name='Item', description='Item', base_price=100)
+        self.orders = [Order.objects.create(customer=customer, **SHIPPING) for _ in range(5)]
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, product_name='Item', product_sku='ITEM',
+                      unit_price=300, quantity=i + 1, total_price=300 * (i + 1))
+            for i, order in enumerate(self.orders)
+        ])
+
+    def test_bulk_matches_per_order_calculation(self):
+        pricing.get_index()
+        # The count, then a read of orders, one of their lines and one bulk_update per batch of three
+        with self.assertNumQueries(7):
+            changed = recalculate_totals(batch_size=3, progress=lambda *args: None)
+        self.assertEqual(changed, 5)
+
+        for order in self.orders:
+            expected = Order.objects.get(pk=order.pk)
+            expected.calculate_totals()
+            order.refresh_from_db()
+            self.assertEqual([order.subtotal, order.shipping_amount, order.tax_amount, order.total_amount],
+                             [expected.subtotal, expected.shipping_amount, expected.tax_amount,
+                              expected.total_amount])
+        self.assertEqual(self.orders[0].total_amount, Decimal('548.00'))
+        self.assertEqual(recalculate_totals(), 0)
+
+    def test_paid_orders_keep_their_totals(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(payment_status=Order.PaymentStatus.PAID)
+        Order.objects.filter(pk=self.orders[1].pk).update(status=Order.Status.CANCELLED)
+        Order.objects.filter(pk=self.orders[2].pk).update(payment_status=Order.PaymentStatus.FAILED)
+        self.assertEqual(recalculate_totals(), 3)
+
+        paid = Order.objects.get(pk=self.orders[0].pk)
+        self.assertEqual(paid.total_amount, self.orders[0].total_amount)
+        self.assertNotEqual(Order.objects.get(pk=self.orders[2].pk).total_amount, self.orders[2].total_amount)
+        with self.assertRaisesMessage(pricing.PricingError, "its totals are final"):
+            paid.calculate_totals()
+
+
+class PricingRulesTests(TestCase):
+
+    def setUp(self):
+        pricing.reset_index()
+        self.addCleanup(pricing.reset_index)
+        self.books = Category.objects.create(name='Books')
+        self.novels = Category.objects.create(name='Novels', parent=self.books)
+        TaxRate.objects.create(name='Kenya VAT', rate=16, country='KE')
+        TaxRate.objects.create(name='Books', rate=8, category=self.books)
+        self.standard = ShippingMethod.objects.create(name='Standard', price=200, free_over=1000, estimated_days=5)
+        self.express = ShippingMethod.objects.create(name='Express', price=500, estimated_days=1,
+                                                     available_countries='KE, UG')
+
+    def test_quote_uses_most_specific_rules_without_queries(self):
+        pricing.quote([], 'KE')
+        with self.assertNumQueries(0):
+            result = pricing.quote([(self.novels.pk, Decimal('500')), (None, Decimal('100'))], ' ke ')
+        self.assertEqual(result.tax, Decimal('56.00'))
+        self.assertEqual([option.method.id for option in result.options], [self.standard.pk, self.express.pk])
+        self.assertEqual((result.method.id, result.shipping), (self.standard.pk, Decimal('200')))
+
+        result = pricing.quote([(None, Decimal('1000'))], 'TZ', self.standard.pk)
+        self.assertEqual((result.tax, result.shipping, result.total), (Decimal('160.00'), 0, Decimal('1160.00')))
+        with self.assertRaises(pricing.PricingError):
+            pricing.quote([(None, Decimal('1000'))], 'TZ', self.express.pk)
+
+    def test_rule_changes_refresh_the_index(self):
+        self.assertEqual(pricing.quote([(None, Decimal('100'))], 'KE').tax, Decimal('16.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            TaxRate.objects.filter(country='KE').get().delete()
+        self.assertEqual(pricing.quote([(None, Decimal('100'))], 'KE').tax, Decimal('16.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            TaxRate.objects.create(name='Zero rated', rate=0, country='KE')
+        self.assertEqual(pricing.quote([(None, Decimal('100'))], 'KE').tax, Decimal('0.00'))
+
+    def test_quote_endpoint_prices_the_cart(self):
+        customer = User.objects.create(username='quoter', email='quoter@example.com')
+        product = Product.objects.create(name='Novel', description='Novel', base_price=600, category=self.novels,
+                                         status=Product.Status.ACTIVE)
+        cart = Cart.objects.create(user=customer)
+        CartItem.objects.create(cart=cart, product=product, quantity=2, unit_price=600)
+        self.client.force_login(customer)
+
+        response = self.client.get('/api/v1/shipping/quote/', {'country': 'UG', 'shipping_method': self.express.pk})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['subtotal'], data['tax_amount'], data['shipping_amount'], data['total_amount']),
+                         ('1200.00', '96.00', '500.00', '1796.00'))
+        self.assertEqual([option['cost'] for option in data['options']], ['0.00', '500.00'])
+        self.assertEqual(self.client.get('/api/v1/shipping/quote/', {'country': 'TZ', 'shipping_method': self.express.pk})
+                         .status_code, 400)
+
+
+class OrderAdminChangelistTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.product = Product.objects.create(name='Item', description='Item', base_price=100)
+        self.client.force_login(self.admin)
+
+    def add_orders(self, count):
+        for i in range(count):
+            number = Order.objects.count()
+            customer = User.objects.create(username=f'customer-{number}', email=f'customer-{number}@example.com')
+            order = Order.objects.create(customer=customer, **SHIPPING)
+            OrderItem.objects.create(order=order, product=self.product, quantity=i + 1)
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('admin:orders_order_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_orders(2)
+        few = self.changelist_queries()
+        self.add_orders(20)
+        self.assertEqual(self.changelist_queries(), few)
+
+
+class PaymentProcessorRegistryTests(TestCase):
+
+    def test_processors_are_shared_and_configurable(self):
+        self.assertIs(get_payment_processor('cash'), get_payment_processor('cash'))
+        with self.assertRaises(ValueError):
+            get_payment_processor('card')
+
+        card = {'card': {'BACKEND': 'apps.orders.payment_processors.ManualPaymentProcessor',
+                         'OPTIONS': {'MAX_CONCURRENCY': 2, 'INSTRUCTIONS': 'Pay at the counter'}}}
+        with override_settings(PAYMENT_PROCESSORS=card):
+            processor = get_payment_processor('card')
+            self.assertEqual(processor.max_concurrency, 2)
+            payments = [Payment(status=Payment.Status.SUCCESS, amount=i) for i in range(5)]
+            results = processor.confirm_many(payments)
+        self.assertEqual([result.payment for result in results], payments)
+        self.assertEqual({result.response['status'] for result in results}, {'success'})
+
+
+class StubDaraja(BaseHTTPRequestHandler):
+    """Minimal Daraja API: hands out tokens and answers STK pushes"""
+    calls = []
+    failures = 0
+    failure = (500, {'errorMessage': 'Internal server error'})
+
+    def do_GET(self):
+        self.calls.append(self.path.split('?')[0])
+        self.reply(200, {'access_token': f'token-{len(self.calls)}', 'expires_in': '3599'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.calls.append(self.path)
+        if StubDaraja.failures:
+            StubDaraja.failures -= 1
+            return self.reply(*StubDaraja.failure)
+        body = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1',
+                'Authorization': self.headers['Authorization']}
+        if self.path == '/mpesa/stkpushquery/v1/query':
+            body['ResultCode'] = '0'
+        self.reply(200, body)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class MpesaClientTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubDaraja)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.settings = override_settings(
+            MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret', MPESA_SHORTCODE='174379',
+            MPESA_PASSKEY='passkey', MPESA_BASE_URL=f'http://127.0.0.1:{cls.server.server_port}',
+            MPESA_RETRY_BACKOFF=0,
+        )
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        mpesa.reset_session()
+        super().tearDownClass()
+
+    def setUp(self):
+        mpesa.reset_session()
+        cache.clear()
+        StubDaraja.calls = []
+        StubDaraja.failures = 0
+        StubDaraja.failure = (500, {'errorMessage': 'Internal server error'})
+        self.order = Order(order_number='IKR-TEST', total_amount=Decimal('150'))
+
+    def test_access_token_is_reused(self):
+        for _ in range(3):
+            get_payment_processor('mpesa').initiate_payment(self.order, '254700000000')
+        self.assertEqual(StubDaraja.calls.count('/oauth/v1/generate'), 1)
+
+        # A new process finds the token in the shared cache
+        mpesa.reset_session()
+        response = get_payment_processor('mpesa').confirm_payment('ws_CO_1')
+        self.assertEqual(response['Authorization'], 'Bearer token-1')
+        self.assertEqual(StubDaraja.calls.count('/oauth/v1/generate'), 1)
+
+    def test_stk_push_is_not_resent_after_server_error(self):
+        # Daraja may have prompted the customer before failing
+        StubDaraja.failures = 1
+        with self.assertRaises(requests.HTTPError):
+            get_payment_processor('mpesa').initiate_payment(self.order, '254700000000')
+        self.assertEqual(StubDaraja.calls.count('/mpesa/stkpush/v1/processrequest'), 1)
+
+    def test_idempotent_requests_are_retried(self):
+        client = get_payment_processor('mpesa').client
+        StubDaraja.failures = 2
+        response = mpesa.get_session().post(f'{client.base_url}/mpesa/stkpushquery/v1/query', json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StubDaraja.calls.count('/mpesa/stkpushquery/v1/query'), 3)
+
+    def test_payment_is_initiated_by_the_worker(self):
+        customer = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        order = Order.objects.create(customer=customer, total_amount=Decimal('150'), **SHIPPING)
+        self.client.force_login(customer)
+
+        response = self.client.post(reverse('orders:payment', args=[order.pk]),
+                                    {'phone_number': '254700000000'})
+        self.assertRedirects(response, reverse('orders:payment_status', args=[order.pk]),
+                             fetch_redirect_response=False)
+        self.assertEqual(StubDaraja.calls, [])
+        status = self.client.get(reverse('orders:payment_status_json', args=[order.pk])).json()
+        self.assertEqual((status['payment_status'], status['prompt_sent']), ('pending', False))
+
+        self.assertEqual(run_pending(), 1)
+        payment = order.payments.get()
+        self.assertEqual(payment.mpesa_checkout_request_id, 'ws_CO_1')
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+
+    def test_stk_push_that_may_have_been_sent_stays_pending(self):
+        customer = User.objects.create(username='buyer', email='buyer@example.com')
+        payments = []
+        for _ in range(2):
+            order = Order.objects.create(customer=customer, total_amount=Decimal('150'), **SHIPPING)
+            payment = Payment.objects.create(order=order, amount=order.total_amount,
+                                             method=Payment.PaymentMethod.MPESA, mpesa_phone='254700000000')
+            payments.append(payment)
+
+        StubDaraja.failures = 1
+        with self.assertRaises(requests.HTTPError):
+            send_stk_push(payments[0].pk)
+        with override_settings(MPESA_BASE_URL='http://127.0.0.1:9', MPESA_MAX_RETRIES=0):
+            mpesa.reset_session()
+            with self.assertRaises(requests.ConnectionError):
+                send_stk_push(payments[1].pk)
+        for payment in payments:
+            payment.refresh_from_db()
+        self.assertEqual([payment.status for payment in payments], [Payment.Status.PENDING, Payment.Status.FAILED])
+        self.assertIn('error', payments[0].gateway_response)
+
+        # Staff confirmed with Safaricom that the customer paid
+        self.assertEqual(resolve_payments(Payment.objects.all(), succeeded=True), 1)
+        payments[0].refresh_from_db()
+        self.assertEqual(payments[0].status, Payment.Status.SUCCESS)
+        self.assertEqual(Order.objects.get(pk=payments[0].order_id).payment_status, Order.PaymentStatus.PAID)
+
+    def test_payment_status_requires_login(self):
+        response = self.client.get(reverse('orders:payment_status_json', args=[1]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_status_is_queried_upstream_only_when_overdue(self):
+        customer = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        order = Order.objects.create(customer=customer, total_amount=Decimal('150'), **SHIPPING)
+        payment = Payment.objects.create(order=order, amount=order.total_amount, method=Payment.PaymentMethod.MPESA,
+                                         mpesa_phone='254700000000', mpesa_checkout_request_id='ws_CO_1')
+        self.client.force_login(customer)
+        url = reverse('orders:payment_status_json', args=[order.pk])
+
+        response = self.client.get(url)
+        self.assertEqual(response.json()['payment_status'], 'pending')
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((not_modified.status_code, not_modified['ETag']), (304, response['ETag']))
+        self.assertEqual(run_pending(), 0)
+
+        # Once the callback is overdue, repeated polls queue a single query
+        Payment.objects.filter(pk=payment.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.client.get(url)
+        self.client.get(reverse('orders:payment_status', args=[order.pk]))
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(StubDaraja.calls.count('/mpesa/stkpushquery/v1/query'), 1)
+
+        data = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).json()
+        self.assertEqual(data, {'order_payment_status': 'paid', 'payment_status': 'success', 'prompt_sent': True})
+
+    def test_pending_status_query_is_not_retried(self):
+        StubDaraja.failures = 1
+        with self.assertRaises(requests.HTTPError):
+            get_payment_processor('mpesa').confirm_payment('ws_CO_1')
+        self.assertEqual(StubDaraja.calls.count('/mpesa/stkpushquery/v1/query'), 1)
+
+    def test_reconcile_settles_overdue_payments_in_bulk(self):
+        customer = User.objects.create(username='buyer', email='buyer@example.com')
+        payments = []
+        for i in range(3):
+            order = Order.objects.create(customer=customer, total_amount=Decimal('150'), **SHIPPING)
+            payments.append(Payment.objects.create(order=order, amount=order.total_amount,
+                                                   method=Payment.PaymentMethod.MPESA,
+                                                   mpesa_checkout_request_id=f'ws_CO_{i}'))
+        Payment.objects.filter(pk__in=[p.pk for p in payments[:2]]).update(
+            updated_at=timezone.now() - timedelta(minutes=5))
+
+        report = reconcile_payments(batch_size=1, workers=2)
+        self.assertEqual((report.scanned, report.succeeded, report.errors), (2, 2, 0))
+        self.assertEqual(StubDaraja.calls.count('/mpesa/stkpushquery/v1/query'), 2)
+        self.assertEqual(Order.objects.filter(payment_status=Order.PaymentStatus.PAID).count(), 2)
+        payments[2].refresh_from_db()
+        self.assertEqual(payments[2].status, Payment.Status.PENDING)
+
+    def test_only_daraja_pending_answers_count_as_pending(self):
+        customer = User.objects.create(username='buyer', email='buyer@example.com')
+        order = Order.objects.create(customer=customer, total_amount=Decimal('150'), **SHIPPING)
+        payment = Payment.objects.create(order=order, amount=order.total_amount, method=Payment.PaymentMethod.MPESA,
+                                         mpesa_checkout_request_id='ws_CO_1')
+        answers = [
+            ((500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}), (1, 0)),
+            ((400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}), (0, 1)),
+            ((500, {'errorMessage': 'Internal server error'}), (0, 1)),
+        ]
+        for answer, expected in answers:
+            StubDaraja.failure, StubDaraja.failures = answer, 1
+            cache.clear()
+            Payment.objects.filter(pk=payment.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+            report = reconcile_payments()
+            self.assertEqual((report.pending, report.errors), expected, answer)
+
+        # The worker's query gives up quietly only while the prompt is pending
+        StubDaraja.failure, StubDaraja.failures = answers[0][0], 1
+        query_stk_status(payment.pk)
+        StubDaraja.failure, StubDaraja.failures = answers[1][0], 1
+        with self.assertRaises(requests.HTTPError):
+            query_stk_status(payment.pk)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+
+    def paid_order(self):
+        customer = User.objects.create(username='buyer', email='buyer@example.com')
+        order = Order.objects.create(customer=customer, total_amount=Decimal('150'),
+                                     payment_status=Order.PaymentStatus.PAID, **SHIPPING)
+        return Payment.objects.create(order=order, amount=order.total_amount, method=Payment.PaymentMethod.MPESA,
+                                      status=Payment.Status.SUCCESS, mpesa_phone='254700000000',
+                                      mpesa_receipt='QKJ1ABC2DE')
+
+    @override_settings(MPESA_INITIATOR_NAME='api', MPESA_SECURITY_CREDENTIAL='credential')
+    def test_unanswered_refund_is_not_resent(self):
+        payment = self.paid_order()
+        refund = request_refund(payment)
+        StubDaraja.failures = 1
+        self.assertEqual(process_refunds(), {Refund.Status.UNKNOWN: 1})
+        self.assertEqual(StubDaraja.calls.count('/mpesa/reversal/v1/request'), 1)
+        self.assertEqual(retry_refunds(Refund.objects.all()), 0)
+        with self.assertRaises(RefundError):
+            request_refund(payment, amount=1)
+
+        # The reversal went through after all; its result settles the refund
+        body = {'Result': {'ResultCode': 0, 'ConversationID': 'AG_2', 'ResultParameters': {'ResultParameter': [
+            {'Key': 'OriginalTransactionID', 'Value': 'QKJ1ABC2DE'},
+        ]}}}
+        response = self.client.post(reverse('orders:mpesa_refund_result'), body, content_type='application/json')
+        self.assertTrue(response.json()['applied'])
+        refund.refresh_from_db()
+        self.assertEqual((refund.status, refund.gateway_reference), (Refund.Status.SUCCEEDED, 'AG_2'))
+
+    @override_settings(MPESA_INITIATOR_NAME='api', MPESA_SECURITY_CREDENTIAL='credential',
+                       MPESA_BASE_URL='http://127.0.0.1:9', MPESA_MAX_RETRIES=0)
+    def test_refund_that_never_connected_fails(self):
+        request_refund(self.paid_order(), amount=50)
+        self.assertEqual(process_refunds(), {Refund.Status.FAILED: 1})
+
+    def test_partial_refunds_are_whole_shillings(self):
+        payment = self.paid_order()
+        with self.assertRaises(RefundError):
+            request_refund(payment, amount=Decimal('10.50'))
+        self.assertEqual(request_refund(payment, amount=10).amount, Decimal('10'))
+
+
+class MpesaCallbackTests(TestCase):
+
+    def setUp(self):
+        customer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.order = Order.objects.create(customer=customer, total_amount=Decimal('150'), **SHIPPING)
+        self.payment = Payment.objects.create(order=self.order, amount=self.order.total_amount,
+                                              method=Payment.PaymentMethod.MPESA,
+                                              mpesa_checkout_request_id='ws_CO_1')
+
+    def deliver(self, checkout_request_id='ws_CO_1', result_code=0):
+        body = {'Body': {'stkCallback': {
+            'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code,
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'QKJ1ABC2DE'}]},
+        }}}
+        response = self.client.post(reverse('orders:mpesa_callback'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['applied']
+
+    def test_repeated_deliveries_are_applied_once(self):
+        self.assertTrue(self.deliver())
+        self.assertFalse(self.deliver())
+        self.assertFalse(self.deliver(result_code=1032))
+
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.mpesa_receipt), ('success', 'QKJ1ABC2DE'))
+        self.assertEqual(self.order.payment_status, Order.PaymentStatus.PAID)
+        self.assertEqual(MpesaCallback.objects.get().payment, self.payment)
+
+    def test_callback_before_request_id_is_stored(self):
+        Payment.objects.filter(pk=self.payment.pk).update(mpesa_checkout_request_id='')
+        self.assertFalse(self.deliver())
+        self.assertIsNone(MpesaCallback.objects.get().processed_at)
+
+        Payment.objects.filter(pk=self.payment.pk).update(mpesa_checkout_request_id='ws_CO_1')
+        self.assertTrue(settle_waiting_callback('ws_CO_1'))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.SUCCESS)
+
+
+class RefundTests(TestCase):
+
+    def setUp(self):
+        customer = User.objects.create(username='refunds', email='refunds@example.com')
+        self.product = Product.objects.create(name='Lamp', description='Lamp', base_price=50,
+                                              stock_quantity=7, status=Product.Status.ACTIVE)
+        self.order = Order.objects.create(customer=customer, total_amount=Decimal('150'),
+                                          payment_status=Order.PaymentStatus.PAID, **SHIPPING)
+        self.item = OrderItem.objects.create(order=self.order, product=self.product, product_name='Lamp',
+                                             product_sku=self.product.sku, unit_price=50, quantity=3)
+        self.payment = Payment.objects.create(order=self.order, amount=Decimal('150'),
+                                              method=Payment.PaymentMethod.CASH, status=Payment.Status.SUCCESS)
+
+    def test_partial_then_full_refund(self):
+        refund = request_refund(self.payment, items=[(self.item, 1)], restock=True)
+        self.assertEqual(refund.amount, Decimal('50'))
+        with self.assertRaises(RefundError):
+            request_refund(self.payment, items=[(self.item, 3)])
+
+        self.assertEqual(process_refunds(), {Refund.Status.SUCCEEDED: 1})
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.order.payment_status, Order.PaymentStatus.PARTIALLY_REFUNDED)
+        self.assertEqual(self.product.stock_quantity, 8)
+
+        with self.assertRaises(RefundError):
+            request_refund(self.payment, amount=101)
+        self.assertEqual(request_refund(self.payment).amount, Decimal('100'))
+        process_refunds()
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), (Order.Status.REFUNDED,
+                                                                         Order.PaymentStatus.REFUNDED))
+
+    def test_batch_query_count_does_not_grow_with_refunds(self):
+        def run(count):
+            for _ in range(count):
+                request_refund(self.payment, amount=1)
+            with CaptureQueriesContext(connection) as captured:
+                process_refunds()
+            return len(captured)
+
+        self.assertEqual(run(2), run(20))
+
+    def test_gateway_result_completes_submitted_refund(self):
+        refund = request_refund(self.payment)
+        Refund.objects.filter(pk=refund.pk).update(status=Refund.Status.SUBMITTED, gateway_reference='AG_1')
+        url = reverse('orders:mpesa_refund_result')
+        body = {'Result': {'ResultCode': 0, 'ConversationID': 'AG_1'}}
+
+        self.assertTrue(self.client.post(url, body, content_type='application/json').json()['applied'])
+        self.assertFalse(self.client.post(url, body, content_type='application/json').json()['applied'])
+        refund.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(refund.status, Refund.Status.SUCCEEDED)
+        self.assertEqual(self.order.payment_status, Order.PaymentStatus.REFUNDED)
+
+    def test_refund_left_processing_by_a_crashed_worker(self):
+        refund = request_refund(self.payment)
+        Refund.objects.filter(pk=refund.pk).update(status=Refund.Status.PROCESSING,
+                                                   updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(process_refunds(), {})
+        refund.refresh_from_db()
+        self.assertEqual(refund.status, Refund.Status.UNKNOWN)
+
+        # Staff confirm the money went out
+        self.assertEqual(resolve_refunds(Refund.objects.all(), succeeded=True), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, Order.PaymentStatus.REFUNDED)
+
+
+class CallbackBenchmarkTests(TransactionTestCase):
+
+    def test_run_leaves_platform_stats_unchanged(self):
+        reconcile_platform_stats()
+        before = dict(PlatformStatistic.objects.values_list('key', 'value'))
+
+        out = io.StringIO()
+        call_command('benchmark_mpesa_callbacks', payments=5, duplicates=2, concurrency=2, stdout=out)
+        self.assertIn('Each of 5 payments was settled exactly once', out.getvalue())
+        self.assertEqual(dict(PlatformStatistic.objects.values_list('key', 'value')), before)
+        self.assertFalse(Order.objects.exists())
@@ -0,0 +1,65 @@
+"""
+Bulk recalculation of order totals
+
+Orders are walked in primary key order, a batch at a time. Each batch is read
+with one query and its line totals per product category with one aggregate
+query over OrderItem; totals are derived in memory with Order.set_totals()
+and only the orders whose figures changed are written back with one
+bulk_update. Orders that can no longer be quoted (e.g. their shipping method
+no longer serves their country) are left as they are, and so are orders
+past payment: their totals are what the customer was charged, so later
+shipping, tax or rate changes must not rewrite them.
+"""
+from django.db.models import Sum
+from django.utils import timezone
+from .models import Order, OrderItem
+from .pricing import PricingError
+
+TOTAL_FIELDS = ['subtotal', 'tax_amount', 'shipping_amount', 'total_amount']
+
+
+def recalculate_totals(queryset=None, batch_size=500, progress=None):
+    """
+    Recalculate totals for every unpaid pending order in queryset (all orders by default).
+    progress, when given, is called with (processed, total) after each batch.
+    Returns the number of orders whose totals changed.
+    """
+    queryset = (Order.objects.all() if queryset is None else queryset).filter(Order.REPRICEABLE).order_by('pk')
+    total = queryset.count() if progress else None
+    processed = changed = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)
+                     .only('pk', 'discount_amount', 'shipping_country', 'shipping_method', *TOTAL_FIELDS)[:batch_size])
+        if not batch:
+            return changed
+
+        lines = {}
+        for order_id, category_id, total in (OrderItem.objects.filter(order__in=batch).order_by()
+                                             .values('order', 'product__category')
+                                             .annotate(total=Sum('total_price'))
+                                             .values_list('order', 'product__category', 'total')):
+            lines.setdefault(order_id, []).append((category_id, total))
+
+        stale = []
+        now = timezone.now()
+        for order in batch:
+            before = [getattr(order, field) for field in TOTAL_FIELDS + ['shipping_method_id']]
+            order_lines = lines.get(order.pk, [])
+            try:
+                order.set_totals(sum(total for _, total in order_lines), order_lines)
+            except PricingError:
+                continue
+            if [getattr(order, field) for field in TOTAL_FIELDS + ['shipping_method_id']] != before:
+                order.updated_at = now
+                stale.append(order)
+        if stale:
+            Order.objects.bulk_update(stale, TOTAL_FIELDS + ['shipping_method', 'updated_at'])
+
+        changed += len(stale)
+        processed += len(batch)
+        last_pk = batch[-1].pk
+        if progress:
+            progress(processed, total)
+        if len(batch) < batch_size:
+            return changed
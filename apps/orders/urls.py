@@ -10,6 +10,9 @@ urlpatterns = [
     path('', views.OrderListView.as_view(), name='order_list'),
     path('payment/<int:order_id>/', views.initiate_mpesa_payment, name='payment'),
     path('payment/status/<int:order_id>/', views.payment_status, name='payment_status'),
+    path('payment/status/<int:order_id>/json/', views.payment_status_json, name='payment_status_json'),
     path('mpesa/callback/', views.mpesa_callback, name='mpesa_callback'),
+    path('mpesa/refund/result/', views.mpesa_refund_result, name='mpesa_refund_result'),
+    path('mpesa/refund/timeout/', views.mpesa_refund_result, {'timed_out': True}, name='mpesa_refund_timeout'),
     path('add-to-cart/', views.add_to_cart, name='add_to_cart'),
 ]
@@ -1,4 +1,4 @@
-from apps.products.models import Product
+from apps.products.models import Product, ProductVariant
 
 """
 Order views for payment processing
@@ -8,14 +8,25 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from apps.core.tasks import enqueue
+from apps.orders import cart
 from apps.orders.models import Order, Payment
-from apps.orders.payment_processors import get_payment_processor
+from apps.orders.payments import ingest_mpesa_callback, payment_status_data, refresh_payment_status
+from apps.orders.refunds import apply_refund_result
+from apps.orders.tasks import send_stk_push
+import hashlib
 import json
+from decimal import Decimal
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView
 
 
+@login_required
 def initiate_mpesa_payment(request, order_id):
     """Initiate M-Pesa payment for an order"""
     order = get_object_or_404(Order, id=order_id, customer=request.user)
@@ -26,108 +37,105 @@ def initiate_mpesa_payment(request, order_id):
             messages.error(request, 'Phone number is required')
             return redirect('orders:payment', order_id=order_id)
 
-        try:
-            processor = get_payment_processor('mpesa')
-            response = processor.initiate_payment(order, phone_number)
-
-            # Save payment record
+        # The STK push is sent by a background worker so this request does
+        # not wait on Safaricom
+        with transaction.atomic():
             payment = Payment.objects.create(
                 order=order,
                 amount=order.total_amount,
-                method='mpesa',
-                status='pending',
+                method=Payment.PaymentMethod.MPESA,
+                status=Payment.Status.PENDING,
                 mpesa_phone=phone_number,
-                mpesa_checkout_request_id=response.get('CheckoutRequestID'),
-                gateway_response=response
             )
+            enqueue(send_stk_push, payment_id=payment.pk)
 
-            messages.success(request, 'Payment initiated. Please check your phone for the M-Pesa prompt.')
-            return redirect('orders:payment_status', order_id=order_id)
-
-        except Exception as e:
-            messages.error(request, f'Payment initiation failed: {str(e)}')
-            return redirect('orders:payment', order_id=order_id)
+        messages.success(request, 'Payment initiated. Please check your phone for the M-Pesa prompt.')
+        return redirect('orders:payment_status', order_id=order_id)
 
     return render(request, 'orders/payment.html', {'order': order})
 
 
+@login_required
 def payment_status(request, order_id):
-    """Check payment status"""
+    """Show the stored payment status; the page then polls payment_status_json"""
     order = get_object_or_404(Order, id=order_id, customer=request.user)
-    payment = order.payments.last()
-
-    if payment and payment.method == 'mpesa':
-        try:
-            processor = get_payment_processor('mpesa')
-            response = processor.confirm_payment(payment.mpesa_checkout_request_id)
-
-            # Update payment status based on response
-            if response.get('ResponseCode') == '0':
-                payment.status = 'success'
-                order.payment_status = 'paid'
-                order.save()
-                payment.save()
-                messages.success(request, 'Payment successful!')
-            else:
-                payment.status = 'failed'
-                payment.save()
-                messages.error(request, 'Payment failed. Please try again.')
-
-        except Exception as e:
-            messages.error(request, f'Error checking payment status: {str(e)}')
-
+    payment, _ = payment_status_data(order)
+    refresh_payment_status(payment)
     return render(request, 'orders/payment_status.html', {'order': order, 'payment': payment})
 
 
+@login_required
+def payment_status_json(request, order_id):
+    """Locally stored payment state for client-side polling, with ETag support"""
+    order = get_object_or_404(Order.objects.only('id', 'payment_status'), id=order_id, customer=request.user)
+    payment, data = payment_status_data(order)
+    refresh_payment_status(payment)
+
+    etag = quote_etag(hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @csrf_exempt
 @require_POST
 def mpesa_callback(request):
     """Handle M-Pesa callback"""
     try:
         data = json.loads(request.body)
-        # Process callback data
-        checkout_request_id = data.get('CheckoutRequestID')
-        result_code = data.get('ResultCode')
+        applied = ingest_mpesa_callback(data)
+        return JsonResponse({'status': 'success', 'applied': applied})
 
-        payment = Payment.objects.get(mpesa_checkout_request_id=checkout_request_id)
-        order = payment.order
-
-        if result_code == 0:
-            payment.status = 'success'
-            order.payment_status = 'paid'
-            payment.mpesa_response_code = str(result_code)
-            payment.gateway_response = data
-        else:
-            payment.status = 'failed'
-            payment.mpesa_response_code = str(result_code)
-            payment.gateway_response = data
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
-        payment.save()
-        order.save()
 
-        return JsonResponse({'status': 'success'})
+@csrf_exempt
+@require_POST
+def mpesa_refund_result(request, timed_out=False):
+    """Handle the result (or queue timeout) of an M-Pesa reversal or B2C refund"""
+    try:
+        data = json.loads(request.body)
+        result = data.get('Result', data)
+        succeeded = not timed_out and str(result.get('ResultCode')) == '0'
+        applied = apply_refund_result(result.get('ConversationID'), succeeded, data,
+                                      unknown=_unknown_refund_lookups(result) if succeeded else None)
+        return JsonResponse({'status': 'success', 'applied': applied})
 
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
 
+def _unknown_refund_lookups(result):
+    """Match a completed reversal or B2C payment to a refund whose submission went unanswered"""
+    params = {item.get('Key'): item.get('Value')
+              for item in (result.get('ResultParameters') or {}).get('ResultParameter', [])}
+    if params.get('OriginalTransactionID'):
+        return {'payment__mpesa_receipt': params['OriginalTransactionID']}
+    if params.get('TransactionAmount') and params.get('ReceiverPartyPublicName'):
+        phone = str(params['ReceiverPartyPublicName']).split(' - ')[0].strip()
+        return {'payment__mpesa_phone': phone, 'amount': Decimal(str(params['TransactionAmount']))}
+    return None
+
+
 @require_POST
 def add_to_cart(request):
     product_id = request.POST.get('product_id')
-    quantity = int(request.POST.get('quantity', 1))
-
-    product = get_object_or_404(Product, id=product_id)
+    try:
+        quantity = max(1, int(request.POST.get('quantity', 1)))
+    except ValueError:
+        quantity = 1
 
-    cart = request.session.get('cart', {})
-    cart_item = cart.get(str(product_id), {'quantity': 0})
-    cart_item['quantity'] += quantity
-    cart_item['price'] = str(product.price) # Store price as string to avoid serialization issues
-    cart_item['name'] = product.name
-    cart_item['image'] = product.featured_image.url if product.featured_image else (product.images.first().image.url if product.images.first() else None)
+    product = get_object_or_404(Product, id=product_id, status=Product.Status.ACTIVE)
+    variant = None
+    if request.POST.get('variant_id'):
+        variant = get_object_or_404(ProductVariant, id=request.POST['variant_id'],
+                                    product=product, is_active=True)
 
-    cart[str(product_id)] = cart_item
-    request.session['cart'] = cart
-    request.session.modified = True
+    cart.add_item(cart.get_cart(request, create=True), product, variant, quantity)
 
     messages.success(request, f'{quantity} x {product.name} added to cart.')
     return redirect(request.META.get('HTTP_REFERER', reverse('products:detail', kwargs={'slug': product.slug})))
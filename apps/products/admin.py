@@ -3,7 +3,9 @@ Admin configuration for products
 """
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Category, Product, ProductImage, ProductVariant, PricingTier, ServicePackage
+from .models import (Category, Product, ProductImage, ProductVariant, PricingTier,
+                     ServicePackage, StockReservation)
+from .prices import variant_price_expression
 
 
 class ProductImageInline(admin.TabularInline):
@@ -30,9 +32,10 @@ class CategoryAdmin(admin.ModelAdmin):
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'sku', 'category', 'product_type', 'price', 
                    'stock_status', 'status', 'featured')
-    list_filter = ('status', 'product_type', 'featured', 'category', 'created_at')
+    list_filter = ('status', 'product_type', 'featured', 'in_stock', 'low_stock', 'on_sale', 'category', 'created_at')
     search_fields = ('name', 'sku', 'description')
     prepopulated_fields = {'slug': ('name',)}
+    list_select_related = ('category',)
     inlines = [ProductImageInline, ProductVariantInline]
     
     fieldsets = (
@@ -43,7 +46,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('category', 'product_type', 'status', 'tags')
         }),
         ('Pricing Model', {
-            'fields': ('pricing_model', 'base_price', 'hourly_rate', 'compare_price', 'cost_price')
+            'fields': ('pricing_model', 'base_price', 'hourly_rate', 'pricing_tier', 'compare_price', 'cost_price')
         }),
         ('Service Pricing', {
             'fields': ('minimum_hours', 'estimated_duration'),
@@ -80,6 +83,13 @@ class ProductAdmin(admin.ModelAdmin):
         else:
             return format_html('<span style="color: green;">In Stock ({})</span>', obj.stock_quantity)
     stock_status.short_description = 'Stock Status'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_prices()
+    
+    def price(self, obj):
+        return obj.list_price
+    price.admin_order_field = 'effective_price'
 
 
 @admin.register(ProductImage)
@@ -94,6 +104,27 @@ class ProductVariantAdmin(admin.ModelAdmin):
     list_display = ('product', 'name', 'sku', 'effective_price', 'stock_quantity', 'is_active')
     list_filter = ('is_active', 'size', 'color')
     search_fields = ('product__name', 'name', 'sku')
+    list_select_related = ('product',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(list_price=variant_price_expression())
+    
+    def effective_price(self, obj):
+        return obj.effective_price
+    effective_price.admin_order_field = 'list_price'
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'variant', 'quantity', 'status', 'reference', 'expires_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('reference', 'product__sku', 'variant__sku')
+    raw_id_fields = ('product', 'variant')
+    readonly_fields = ('product', 'variant', 'quantity', 'status', 'reference', 'expires_at',
+                       'created_at', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
 
 
 @admin.register(PricingTier)
@@ -1,18 +1,112 @@
 """
 API Views for the products app
 """
+from django.db.models import Prefetch
 from rest_framework import viewsets, permissions
-from .models import Product, Category
-from .serializers import ProductSerializer, CategorySerializer
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from apps.core.pagination import KeysetPagination
+from .facets import get_facets
+from .filters import ProductFilterSerializer, filter_products, keyset_ordering
+from .models import Product, Category, ProductImage
+from .importer import import_catalog, open_upload
+from .search import search_products
+from .serializers import ProductFacetsSerializer, ProductListSerializer, ProductSerializer, CategorySerializer
+
+# Columns read by ProductListSerializer (plus created_at and effective_price for the cursor)
+PRODUCT_LIST_FIELDS = (
+    'id', 'sku', 'slug', 'name', 'created_at', 'featured_image',
+    'effective_price', 'on_sale', 'in_stock', 'category__slug',
+)
 
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows products to be viewed.
+
+    Lists and searches accept the ProductFilterSerializer filters (category,
+    product_type, pricing_model, in_stock, on_sale, low_stock, min_price,
+    max_price, size, color, material, tags), and lists
+    ?ordering=newest|price|-price. ?facets=true adds facet counts to a list.
     """
-    queryset = Product.objects.filter(status=Product.Status.ACTIVE)
+    queryset = Product.objects.active().select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = super().get_queryset().with_prices(user.membership_tier if user.is_authenticated else None)
+        if self.action in ('list', 'search'):
+            queryset = queryset.only(*PRODUCT_LIST_FIELDS).prefetch_related(
+                Prefetch('images',
+                         queryset=ProductImage.objects.filter(is_primary=True).only('id', 'product_id', 'image'),
+                         to_attr='primary_images')
+            )
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ('list', 'search'):
+            serializer = ProductFilterSerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self.filters = serializer.validated_data
+            queryset = filter_products(queryset, self.filters)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if str(request.query_params.get('facets', '')).lower() in ('1', 'true', 'yes'):
+            response.data['facets'] = ProductFacetsSerializer(get_facets(self.filters)).data
+        return response
+
+    @action(detail=False)
+    def facets(self, request):
+        """Facet counts for the filters in the query string"""
+        serializer = ProductFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(ProductFacetsSerializer(get_facets(serializer.validated_data)).data)
+
+    def get_keyset_ordering(self):
+        return keyset_ordering(getattr(self, 'filters', {}))
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'search'):
+            return ProductListSerializer
+        return ProductSerializer
+
+    @action(detail=False)
+    def search(self, request):
+        """Full-text product search: ?q=<terms>&limit=<n> (max 100)"""
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        except ValueError:
+            limit = 20
+        results = search_products(request.query_params.get('q'),
+                                  queryset=self.filter_queryset(self.get_queryset()), limit=limit)
+        serializer = self.get_serializer(results, many=True)
+        return Response({'results': serializer.data})
+
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[permissions.IsAdminUser], parser_classes=[MultiPartParser])
+    def import_catalog(self, request):
+        """Bulk import a CSV or JSON Lines catalog file uploaded as 'file'"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'A CSV or JSON Lines file is required.'})
+        fmt = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise ValidationError({'format': 'Format must be csv or jsonl.'})
+        try:
+            batch_size = max(1, int(request.data.get('batch_size', 500)))
+        except ValueError:
+            raise ValidationError({'batch_size': 'Must be an integer.'})
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+
+        report = import_catalog(open_upload(upload), fmt, batch_size=batch_size, dry_run=dry_run)
+        return Response(report.as_dict())
 
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
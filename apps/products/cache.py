@@ -0,0 +1,116 @@
+"""
+Render cache for the public catalog pages
+
+Rendered pages are stored under keys derived from the request path and the
+catalog versions they depend on. Changing the catalog bumps a version, which
+orphans every page rendered against the old one instead of deleting keys.
+"""
+import hashlib
+import re
+import time
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+CATALOG_VERSION_KEY = 'catalog:version'
+PRODUCT_VERSION_KEY = 'catalog:product:{}:version'
+PAGE_KEY_PREFIX = 'catalog:page:'
+
+# Rendered CSRF tokens are swapped for a placeholder before caching and
+# replaced with the visitor's own token when the page is served.
+CSRF_PLACEHOLDER = '__CATALOG_CSRF_TOKEN__'
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def _new_version():
+    # Time based so a version evicted from the cache never restarts at a
+    # number that older pages were rendered against
+    return time.time_ns()
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _new_version()
+        cache.set(key, version, None)
+        return version
+
+
+def get_catalog_version():
+    """Version of the catalog as a whole (listings, categories, home page)"""
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_product_version(slug):
+    """Version of a single product's detail page"""
+    return _get_version(PRODUCT_VERSION_KEY.format(slug))
+
+
+def bump_product_version(slug):
+    return _bump_version(PRODUCT_VERSION_KEY.format(slug))
+
+
+class CatalogCacheMixin:
+    """Serve anonymous GET requests from the catalog render cache"""
+    catalog_cache_timeout = None
+
+    def get_catalog_cache_timeout(self):
+        if self.catalog_cache_timeout is not None:
+            return self.catalog_cache_timeout
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
+
+    def get_catalog_versions(self):
+        """Versions the rendered page depends on"""
+        return [get_catalog_version()]
+
+    def get_catalog_cache_key(self):
+        parts = [self.request.get_full_path()] + [str(v) for v in self.get_catalog_versions()]
+        digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+        return f"{PAGE_KEY_PREFIX}{digest}"
+
+    def is_catalog_cacheable(self, request):
+        return (
+            request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated
+            and not len(get_messages(request))
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.is_catalog_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_catalog_cache_key()
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            if CSRF_PLACEHOLDER in content:
+                content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+            return HttpResponse(content, content_type=content_type)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            timeout = self.get_catalog_cache_timeout()
+
+            def store(rendered):
+                content = CSRF_INPUT_RE.sub(
+                    rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', rendered.content.decode(rendered.charset)
+                )
+                cache.set(key, (content, rendered['Content-Type']), timeout)
+
+            response.add_post_render_callback(store)
+        return response
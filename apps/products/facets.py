@@ -0,0 +1,105 @@
+"""
+Facet counts for catalog browsing
+
+For a filter set, every facet counts the active products matching all the
+other filters, so a filter UI can offer each facet's alternatives alongside
+the values already chosen. Each facet is one grouped aggregate query, and
+the whole result is cached per filter set and catalog version.
+"""
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, Count, F, Func, Max, Min
+from .cache import get_catalog_version
+from .filters import VARIANT_FIELDS, category_tree, filter_products, variant_conditions
+from .models import Product, ProductVariant
+
+FACETS_KEY = 'catalog:facets:{}:{}'
+
+# Most common values listed for the open-ended facets (variant attributes, tags)
+FACET_LIMIT = 50
+
+
+def facets_cache_key(filters):
+    canonical = {
+        name: sorted(value) if isinstance(value, (list, set)) else value
+        for name, value in filters.items()
+        if name != 'ordering' and value not in (None, '', [], set())
+    }
+    digest = hashlib.md5(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+    return FACETS_KEY.format(get_catalog_version(), digest)
+
+
+def get_facets(filters):
+    """Facet counts for validated ProductFilterSerializer data"""
+    key = facets_cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, settings.FACET_CACHE_TIMEOUT)
+    return facets
+
+
+def compute_facets(filters):
+    products = Product.objects.active().order_by()
+
+    def matching(*facet):
+        return filter_products(products, filters, exclude=facet)
+
+    price = matching('min_price', 'max_price').aggregate(min=Min('effective_price'), max=Max('effective_price'))
+    facets = {
+        'total': matching().count(),
+        'category': category_counts(matching('category')),
+        'product_type': choice_counts(matching('product_type'), 'product_type', Product.ProductType),
+        'pricing_model': choice_counts(matching('pricing_model'), 'pricing_model', Product.PricingModel),
+        'in_stock': matching('in_stock').filter(in_stock=True).count(),
+        'on_sale': matching('on_sale').filter(on_sale=True).count(),
+        'price': {'min': price['min'], 'max': price['max']},
+        'tags': tag_counts(matching('tags')),
+    }
+    for name in VARIANT_FIELDS:
+        facets[name] = variant_counts(filters, name, matching(*VARIANT_FIELDS))
+    return facets
+
+
+def category_counts(queryset):
+    """Products per category, each category counting its subcategories' products too"""
+    direct = dict(queryset.filter(category__isnull=False).values('category').annotate(count=Count('pk'))
+                  .values_list('category', 'count'))
+    tree = category_tree()
+    parents = {pk: parent_id for pk, _, _, parent_id in tree}
+    totals = {}
+    for category_id, count in direct.items():
+        seen = set()
+        while category_id is not None and category_id not in seen:
+            seen.add(category_id)
+            totals[category_id] = totals.get(category_id, 0) + count
+            category_id = parents.get(category_id)
+    slugs = {pk: slug for pk, slug, _, _ in tree}
+    return [
+        {'value': slug, 'label': name, 'parent': slugs.get(parent_id), 'count': totals[pk]}
+        for pk, slug, name, parent_id in tree if pk in totals
+    ]
+
+
+def choice_counts(queryset, field, choices):
+    counts = dict(queryset.values(field).annotate(count=Count('pk')).values_list(field, 'count'))
+    return [{'value': value, 'label': label, 'count': counts[value]}
+            for value, label in choices.choices if value in counts]
+
+
+def variant_counts(filters, field, products):
+    """Products per value of a variant attribute, among variants matching the other variant filters"""
+    variants = ProductVariant.objects.filter(
+        product__in=products, is_active=True, **variant_conditions(filters, exclude=(field,))
+    ).exclude(**{field: ''})
+    rows = (variants.values(field).annotate(count=Count('product', distinct=True))
+            .order_by('-count', field)[:FACET_LIMIT])
+    return [{'value': row[field], 'label': row[field], 'count': row['count']} for row in rows]
+
+
+def tag_counts(queryset):
+    rows = (queryset.annotate(tag=Func(F('tag_list'), function='unnest', output_field=CharField()))
+            .values('tag').annotate(count=Count('pk')).order_by('-count', 'tag')[:FACET_LIMIT])
+    return [{'value': row['tag'], 'label': row['tag'], 'count': row['count']} for row in rows]
@@ -0,0 +1,125 @@
+"""
+Catalog filtering and sorting
+
+Product listings filter and sort on the columns products keep up to date
+(effective_price, on_sale, in_stock, low_stock, tag_list), so each filter is
+an indexed WHERE clause and each sort a keyset scan. The API and the HTML
+list pages read the same query parameters.
+
+Several values of one filter match any of them. Variant filters (size,
+color, material) match products with an active variant having all of them.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from rest_framework import serializers
+from .cache import get_catalog_version
+from .models import Category, Product, ProductVariant
+
+CATEGORY_TREE_KEY = 'catalog:category-tree:{}'
+
+# ?ordering= value -> keyset ordering
+ORDERINGS = {
+    'newest': '-created_at',
+    'price': 'effective_price',
+    '-price': '-effective_price',
+}
+
+FLAG_FIELDS = ('in_stock', 'on_sale', 'low_stock')
+VARIANT_FIELDS = ('size', 'color', 'material')
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    """Query parameters filtering and sorting product listings"""
+    category = serializers.SlugField(required=False, help_text="Category slug; includes its subcategories")
+    product_type = serializers.MultipleChoiceField(choices=Product.ProductType.choices, required=False)
+    pricing_model = serializers.MultipleChoiceField(choices=Product.PricingModel.choices, required=False)
+    in_stock = serializers.BooleanField(default=None, allow_null=True)
+    on_sale = serializers.BooleanField(default=None, allow_null=True)
+    low_stock = serializers.BooleanField(default=None, allow_null=True)
+    min_price = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0, required=False)
+    max_price = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0, required=False)
+    size = serializers.ListField(child=serializers.CharField(max_length=50), required=False)
+    color = serializers.ListField(child=serializers.CharField(max_length=50), required=False)
+    material = serializers.ListField(child=serializers.CharField(max_length=50), required=False)
+    tags = serializers.ListField(child=serializers.CharField(max_length=255), required=False)
+    ordering = serializers.ChoiceField(choices=list(ORDERINGS), required=False)
+
+    def validate_tags(self, value):
+        return [tag.strip().lower() for tag in value if tag.strip()]
+
+
+def clean_filters(params):
+    """Valid filters from request parameters, leaving out invalid ones"""
+    serializer = ProductFilterSerializer(data=params)
+    if serializer.is_valid():
+        return serializer.validated_data
+    params = params.copy()
+    for name in serializer.errors:
+        params.pop(name, None)
+    serializer = ProductFilterSerializer(data=params)
+    serializer.is_valid()
+    return serializer.validated_data
+
+
+def category_tree():
+    """Categories in display order as (id, slug, name, parent_id), cached per catalog version"""
+    key = CATEGORY_TREE_KEY.format(get_catalog_version())
+    tree = cache.get(key)
+    if tree is None:
+        tree = list(Category.objects.values_list('pk', 'slug', 'name', 'parent_id'))
+        cache.set(key, tree, settings.CATALOG_CACHE_TIMEOUT)
+    return tree
+
+
+def category_subtree(slug):
+    """Ids of the category with this slug and all its descendants; empty when there is none"""
+    children = {}
+    root = None
+    for pk, category_slug, _, parent_id in category_tree():
+        children.setdefault(parent_id, []).append(pk)
+        if category_slug == slug:
+            root = pk
+    if root is None:
+        return set()
+    ids, pending = set(), [root]
+    while pending:
+        pk = pending.pop()
+        if pk not in ids:
+            ids.add(pk)
+            pending.extend(children.get(pk, ()))
+    return ids
+
+
+def variant_conditions(filters, exclude=()):
+    return {f'{name}__in': filters[name] for name in VARIANT_FIELDS if filters.get(name) and name not in exclude}
+
+
+def filter_products(queryset, filters, exclude=()):
+    """Apply validated ProductFilterSerializer data to a product queryset, skipping the filters in exclude"""
+    def wanted(name):
+        return name not in exclude and filters.get(name) not in (None, '', [], set())
+
+    if wanted('category'):
+        queryset = queryset.filter(category__in=category_subtree(filters['category']))
+    for name in ('product_type', 'pricing_model'):
+        if wanted(name):
+            queryset = queryset.filter(**{f'{name}__in': filters[name]})
+    for name in FLAG_FIELDS:
+        if wanted(name):
+            queryset = queryset.filter(**{name: filters[name]})
+    if wanted('min_price'):
+        queryset = queryset.filter(effective_price__gte=filters['min_price'])
+    if wanted('max_price'):
+        queryset = queryset.filter(effective_price__lte=filters['max_price'])
+    if wanted('tags'):
+        queryset = queryset.filter(tag_list__overlap=filters['tags'])
+    conditions = variant_conditions(filters, exclude)
+    if conditions:
+        queryset = queryset.filter(Exists(ProductVariant.objects.filter(product=OuterRef('pk'), is_active=True,
+                                                                        **conditions)))
+    return queryset
+
+
+def keyset_ordering(filters):
+    return ORDERINGS[filters.get('ordering') or 'newest']
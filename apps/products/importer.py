@@ -0,0 +1,320 @@
+"""
+Bulk catalog import for products, variants and images
+
+Rows are streamed from CSV or JSON Lines input. Slugs and SKUs are allocated
+in memory against values fetched once up front, and rows are written with
+bulk_create in batches, one transaction per batch. A batch that collides
+with rows written meanwhile by someone else is reported and skipped, and the
+taken slugs and SKUs are reloaded before the import carries on.
+
+A row with a parent_sku is a variant of that product; any other row is a
+product. Product rows may list image paths in "images" ('|' separated in
+CSV) and, in JSON Lines, nest their variants under "variants".
+"""
+import csv
+import io
+import json
+import time
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+from apps.core.stats import adjust_stat, PRODUCTS_COUNT
+from apps.core.utils import generate_sku
+from .cache import bump_catalog_version
+from .models import Category, Product, ProductImage, ProductVariant
+from .search import update_search_vectors
+
+PRODUCT_FIELDS = (
+    'name', 'slug', 'sku', 'description', 'short_description', 'product_type', 'status',
+    'pricing_model', 'base_price', 'hourly_rate', 'compare_price', 'cost_price',
+    'minimum_hours', 'estimated_duration', 'subscription_price', 'billing_cycle',
+    'track_inventory', 'stock_quantity', 'low_stock_threshold', 'weight', 'dimensions',
+    'download_url', 'download_limit', 'featured', 'tags',
+    'meta_title', 'meta_description', 'meta_keywords',
+)
+VARIANT_FIELDS = ('name', 'sku', 'price', 'stock_quantity', 'is_active', 'size', 'color', 'material')
+
+
+class CatalogImportError(Exception):
+    """A row that cannot be imported"""
+
+
+class ImportReport:
+    """Outcome of an import run"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.products = 0
+        self.variants = 0
+        self.images = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows,
+            'products': self.products,
+            'variants': self.variants,
+            'images': self.images,
+            'errors': [{'line': line, 'error': error} for line, error in self.errors],
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+class SlugAllocator:
+    """Hand out unique slugs against a set of taken values"""
+
+    def __init__(self, taken):
+        self.taken = set(taken)
+        self.counters = {}
+
+    def allocate(self, value):
+        base = slugify(value) or 'item'
+        slug = base
+        counter = self.counters.get(base, 1)
+        while slug in self.taken:
+            slug = f"{base}-{counter}"
+            counter += 1
+        self.counters[base] = counter
+        self.taken.add(slug)
+        return slug
+
+    def claim(self, slug):
+        if slug in self.taken:
+            raise CatalogImportError(f"Slug '{slug}' already exists")
+        self.taken.add(slug)
+        return slug
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict, parse error) from a text stream"""
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row, None
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                yield line, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line, None, "Expected a JSON object"
+                continue
+            yield line, row, None
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def _convert(model, field_names, row):
+    """Convert raw row values with the model fields' own parsers"""
+    values = {}
+    for name in field_names:
+        raw = row.get(name)
+        if raw is None or raw == '':
+            continue
+        try:
+            values[name] = model._meta.get_field(name).to_python(raw)
+        except ValidationError as e:
+            raise CatalogImportError(f"{name}: {'; '.join(e.messages)}")
+    return values
+
+
+def _format_errors(error):
+    return '; '.join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+
+
+def _split_images(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split('|')
+    return [path.strip() for path in value if path.strip()]
+
+
+class CatalogImporter:
+    """Import products, variants and images in batches"""
+
+    def __init__(self, batch_size=500, dry_run=False):
+        self.batch_size = batch_size
+        self.report = ImportReport(dry_run=dry_run)
+        self._load_taken()
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.product_ids = {}
+        self._reset_batch()
+
+    def _load_taken(self):
+        self.slugs = SlugAllocator([*Product.objects.values_list('slug', flat=True), *Product.RESERVED_SLUGS])
+        self.product_skus = set(Product.objects.values_list('sku', flat=True))
+        self.variant_skus = set(ProductVariant.objects.values_list('sku', flat=True))
+
+    def _reset_batch(self):
+        self.batch_products = []
+        self.batch_images = []
+        self.batch_variants = []
+        self.batch_lines = []
+
+    def _new_sku(self, *taken, parent_sku=None):
+        while True:
+            sku = generate_sku()
+            if parent_sku:
+                sku = f"{parent_sku}-{sku[4:10]}"
+            if not any(sku in skus for skus in taken):
+                return sku
+
+    def run(self, stream, fmt):
+        for line, row, error in read_rows(stream, fmt):
+            self.report.rows += 1
+            try:
+                if error:
+                    raise CatalogImportError(error)
+                self.batch_lines.append(line)
+                self.add_row(row)
+            except CatalogImportError as e:
+                self.report.errors.append((line, str(e)))
+            if len(self.batch_products) + len(self.batch_variants) >= self.batch_size:
+                self.flush()
+        self.flush()
+        self.report.elapsed = time.perf_counter() - self.report.started
+        return self.report
+
+    def add_row(self, row):
+        if row.get('parent_sku'):
+            self.add_variant(row['parent_sku'], row)
+        else:
+            self.add_product(row)
+
+    def add_product(self, row):
+        values = _convert(Product, PRODUCT_FIELDS, row)
+        if not values.get('name'):
+            raise CatalogImportError("name is required")
+        if values.get('base_price') is None:
+            raise CatalogImportError("base_price is required")
+
+        category = row.get('category')
+        if category:
+            if category not in self.categories:
+                raise CatalogImportError(f"Unknown category '{category}'")
+            values['category_id'] = self.categories[category]
+
+        sku = values.get('sku') or self._new_sku(self.product_skus)
+        if sku in self.product_skus:
+            raise CatalogImportError(f"SKU '{sku}' already exists")
+        product = Product(**values)
+        product.slug = self.slugs.claim(values['slug']) if values.get('slug') else self.slugs.allocate(product.name)
+        product.sku = sku
+        product.set_stored_values()
+        # Nested variants are all validated before anything of the row is batched
+        variant_skus = set()
+        try:
+            product.clean_fields(exclude=['category', 'search_vector'])
+            variants = [self._build_variant(sku, variant, variant_skus) for variant in row.get('variants') or []]
+        except ValidationError as e:
+            self.slugs.taken.discard(product.slug)
+            raise CatalogImportError(_format_errors(e))
+        except CatalogImportError:
+            self.slugs.taken.discard(product.slug)
+            raise
+        self.product_skus.add(sku)
+        self.variant_skus.update(variant_skus)
+        self.batch_products.append(product)
+
+        for index, path in enumerate(_split_images(row.get('images'))):
+            self.batch_images.append((sku, ProductImage(image=path, is_primary=index == 0, sort_order=index)))
+        self.batch_variants.extend((sku, variant) for variant in variants)
+
+    def add_variant(self, parent_sku, row):
+        if parent_sku not in self.product_skus:
+            raise CatalogImportError(f"Unknown parent SKU '{parent_sku}'")
+        variant = self._build_variant(parent_sku, row, set())
+        self.variant_skus.add(variant.sku)
+        self.batch_variants.append((parent_sku, variant))
+
+    def _build_variant(self, parent_sku, row, row_skus):
+        """A validated variant; its SKU is added to row_skus, the SKUs claimed by the row so far"""
+        values = _convert(ProductVariant, VARIANT_FIELDS, row)
+        if not values.get('name'):
+            raise CatalogImportError("variant name is required")
+        sku = values.get('sku') or self._new_sku(self.variant_skus, row_skus, parent_sku=parent_sku)
+        if sku in self.variant_skus or sku in row_skus:
+            raise CatalogImportError(f"Variant SKU '{sku}' already exists")
+        variant = ProductVariant(**values)
+        variant.sku = sku
+        try:
+            variant.clean_fields(exclude=['product'])
+        except ValidationError as e:
+            raise CatalogImportError(_format_errors(e))
+        row_skus.add(sku)
+        return variant
+
+    def _resolve_parents(self):
+        missing = {sku for sku, _ in self.batch_images + self.batch_variants
+                   if sku not in self.product_ids}
+        if missing:
+            self.product_ids.update(Product.objects.filter(sku__in=missing).values_list('sku', 'id'))
+
+    def flush(self):
+        if not (self.batch_products or self.batch_variants):
+            return
+        if not self.report.dry_run:
+            try:
+                with transaction.atomic():
+                    self.write_batch()
+            except IntegrityError as e:
+                # Another writer took a slug or SKU since they were loaded
+                for product in self.batch_products:
+                    self.product_ids.pop(product.sku, None)
+                self._load_taken()
+                self.report.errors.append((
+                    self.batch_lines[0],
+                    f"Lines {self.batch_lines[0]}-{self.batch_lines[-1]} not imported: {e}",
+                ))
+                self._reset_batch()
+                return
+        self.report.products += len(self.batch_products)
+        self.report.images += len(self.batch_images)
+        self.report.variants += len(self.batch_variants)
+        self._reset_batch()
+
+    def write_batch(self):
+        created = Product.objects.bulk_create(self.batch_products)
+        self.product_ids.update((product.sku, product.pk) for product in created)
+        self._resolve_parents()
+
+        for sku, image in self.batch_images:
+            image.product_id = self.product_ids[sku]
+        for sku, variant in self.batch_variants:
+            variant.product_id = self.product_ids[sku]
+        ProductImage.objects.bulk_create([image for _, image in self.batch_images])
+        ProductVariant.objects.bulk_create([variant for _, variant in self.batch_variants])
+
+        after_bulk_create(created)
+
+
+def after_bulk_create(products):
+    """Do the work save() signals would have done for bulk-created products"""
+    if not products:
+        return
+    update_search_vectors(Product.objects.filter(pk__in=[product.pk for product in products]))
+    adjust_stat(PRODUCTS_COUNT, sum(1 for product in products if product.status == Product.Status.ACTIVE))
+    transaction.on_commit(bump_catalog_version)
+
+
+def import_catalog(stream, fmt, batch_size=500, dry_run=False):
+    """Import a catalog from a text stream and return the ImportReport"""
+    return CatalogImporter(batch_size=batch_size, dry_run=dry_run).run(stream, fmt)
+
+
+def open_upload(uploaded_file):
+    """Wrap an uploaded file as a text stream"""
+    return io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
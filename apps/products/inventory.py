@@ -0,0 +1,198 @@
+"""
+Inventory reservation engine
+
+Stock rows are locked in a fixed order (products before variants, ascending
+id), then decremented with one conditional UPDATE per model that only matches
+rows holding enough stock for their line; when fewer rows match than there
+are lines, nothing is taken. Concurrent buyers can never drive a counter
+below zero, two carts sharing SKUs cannot deadlock, and the number of queries
+does not grow with the number of lines.
+"""
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from .models import Product, ProductVariant, StockReservation, stock_flag_expressions
+
+StockLine = namedtuple('StockLine', ['product_id', 'variant_id', 'quantity'])
+
+
+class InsufficientStock(Exception):
+    """Raised when a line cannot be reserved; nothing is reserved"""
+
+    def __init__(self, line):
+        self.line = line
+        target = f"variant {line.variant_id}" if line.variant_id else f"product {line.product_id}"
+        super().__init__(f"Insufficient stock for {target} (requested {line.quantity})")
+
+
+def _hold_seconds():
+    return getattr(settings, 'INVENTORY_HOLD_SECONDS', 15 * 60)
+
+
+def normalize_lines(lines):
+    """Merge duplicate lines and sort them into lock order"""
+    merged = {}
+    for line in lines:
+        line = StockLine(*line)
+        if line.quantity <= 0:
+            raise ValueError(f"Quantity must be positive, got {line.quantity}")
+        key = (line.product_id, line.variant_id)
+        merged[key] = merged.get(key, 0) + line.quantity
+    return sorted(
+        (StockLine(product_id, variant_id, quantity) for (product_id, variant_id), quantity in merged.items()),
+        key=lambda line: (line.variant_id is not None, line.variant_id or line.product_id),
+    )
+
+
+def _take(model, lines):
+    """
+    Lock the lines' rows in id order, then decrement their stock with one
+    conditional UPDATE, which only matches rows holding enough stock; any
+    row left out fails the lines
+    """
+    if not lines:
+        return
+    key = 'variant_id' if model is ProductVariant else 'product_id'
+    by_pk = {getattr(line, key): line for line in lines}
+    required = _increments({pk: line.quantity for pk, line in by_pk.items()})
+    if model is ProductVariant:
+        rows = model.objects.filter(pk__in=by_pk, stock_quantity__gte=required,
+                                    product_id=_values({pk: line.product_id for pk, line in by_pk.items()}))
+        stock = F('stock_quantity') - required
+    else:
+        # Products that do not track inventory always succeed and keep their count
+        rows = model.objects.filter(Q(track_inventory=False) | Q(stock_quantity__gte=required), pk__in=by_pk)
+        stock = Case(When(track_inventory=False, then=F('stock_quantity')),
+                     default=F('stock_quantity') - required)
+    with transaction.atomic():
+        # An UPDATE locks rows in scan order; taking the locks in id order first keeps reservations deadlock-free
+        list(model.objects.filter(pk__in=by_pk).order_by('pk').select_for_update().values_list('pk', flat=True))
+        updated = _adjust(rows, stock)
+        if updated != len(by_pk):
+            transaction.set_rollback(True)
+    if updated != len(by_pk):
+        raise InsufficientStock(_short_line(model, by_pk))
+
+
+def _short_line(model, by_pk):
+    """The first line its row cannot cover, for the error message"""
+    fields = ('pk', 'stock_quantity', 'product_id' if model is ProductVariant else 'track_inventory')
+    rows = {pk: (quantity, extra) for pk, quantity, extra in model.objects.filter(pk__in=by_pk).values_list(*fields)}
+    for pk, line in sorted(by_pk.items()):
+        if pk not in rows:
+            return line
+        quantity, extra = rows[pk]
+        if model is ProductVariant and extra != line.product_id:
+            return line
+        if (model is ProductVariant or extra) and quantity < line.quantity:
+            return line
+    return by_pk[min(by_pk)]
+
+
+def reserve(lines, reference='', hold_seconds=None):
+    """
+    Reserve every line or none of them, returning the held StockReservations.
+    Holds expire after hold_seconds (INVENTORY_HOLD_SECONDS by default).
+    """
+    lines = normalize_lines(lines)
+    hold_seconds = _hold_seconds() if hold_seconds is None else hold_seconds
+    expires_at = timezone.now() + timedelta(seconds=hold_seconds)
+
+    with transaction.atomic():
+        _take(Product, [line for line in lines if not line.variant_id])
+        _take(ProductVariant, [line for line in lines if line.variant_id])
+        return StockReservation.objects.bulk_create([
+            StockReservation(product_id=line.product_id, variant_id=line.variant_id,
+                             quantity=line.quantity, reference=reference, expires_at=expires_at)
+            for line in lines
+        ])
+
+
+def restock(lines):
+    """Return stock for many lines with one UPDATE per model"""
+    product_quantities = {}
+    variant_quantities = {}
+    for line in lines:
+        line = StockLine(*line)
+        if line.variant_id:
+            variant_quantities[line.variant_id] = variant_quantities.get(line.variant_id, 0) + line.quantity
+        else:
+            product_quantities[line.product_id] = product_quantities.get(line.product_id, 0) + line.quantity
+
+    with transaction.atomic():
+        for model, quantities in ((Product, product_quantities), (ProductVariant, variant_quantities)):
+            if not quantities:
+                continue
+            rows = model.objects.filter(pk__in=quantities)
+            # Lock in the same order as reserve() so the two never deadlock
+            list(rows.order_by('pk').select_for_update().values_list('pk', flat=True))
+            if model is Product:
+                rows = rows.filter(track_inventory=True)
+            _adjust(rows, F('stock_quantity') + _increments(quantities))
+
+
+def _adjust(rows, stock):
+    """Set the rows' stock to the stock expression, and products' stock flags with it"""
+    flags = stock_flag_expressions(stock) if rows.model is Product else {}
+    return rows.update(stock_quantity=stock, **flags)
+
+
+def _increments(quantities):
+    return Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in sorted(quantities.items())],
+                default=Value(0), output_field=IntegerField())
+
+
+def _values(values):
+    """Per-row value by primary key, as SQL"""
+    return Case(*[When(pk=pk, then=Value(value)) for pk, value in sorted(values.items())],
+                default=None, output_field=IntegerField())
+
+
+def commit(reservations):
+    """Keep the stock of held reservations for good (e.g. once an order is placed)"""
+    return StockReservation.objects.filter(
+        pk__in=[reservation.pk for reservation in reservations], status=StockReservation.Status.HELD
+    ).update(status=StockReservation.Status.COMMITTED, expires_at=None)
+
+
+def _release(queryset, status):
+    with transaction.atomic():
+        held = list(queryset.filter(status=StockReservation.Status.HELD)
+                    .select_for_update(skip_locked=True)
+                    .values_list('pk', 'product_id', 'variant_id', 'quantity'))
+        if not held:
+            return 0
+        StockReservation.objects.filter(pk__in=[row[0] for row in held]).update(status=status)
+        restock(StockLine(*row[1:]) for row in held)
+    return len(held)
+
+
+def release(reservations):
+    """Put held reservations back into stock"""
+    return _release(StockReservation.objects.filter(pk__in=[r.pk for r in reservations]),
+                    StockReservation.Status.RELEASED)
+
+
+def release_reference(reference):
+    """Put every hold taken for a cart or order back into stock"""
+    return _release(StockReservation.objects.filter(reference=reference),
+                    StockReservation.Status.RELEASED)
+
+
+def release_expired(now=None, batch_size=500):
+    """Return expired holds to stock in batches; returns the number released"""
+    now = now or timezone.now()
+    total = 0
+    last_pk = 0
+    while True:
+        pks = list(StockReservation.objects.filter(
+            status=StockReservation.Status.HELD, expires_at__lte=now, pk__gt=last_pk
+        ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        # Holds locked by another worker are skipped, not waited for
+        total += _release(StockReservation.objects.filter(pk__in=pks), StockReservation.Status.EXPIRED)
+        last_pk = pks[-1]
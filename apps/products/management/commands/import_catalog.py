@@ -0,0 +1,41 @@
+"""
+Bulk import products, variants and images from CSV or JSON Lines
+"""
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.importer import import_catalog
+
+
+class Command(BaseCommand):
+    help = "Import a product catalog from a CSV or JSON Lines file ('-' reads stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Input format (defaults to the file extension)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows written per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Validate and allocate slugs/SKUs without writing")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError("Cannot infer the format, pass --format csv or --format jsonl")
+
+        if path == '-':
+            report = import_catalog(sys.stdin, fmt, options['batch_size'], options['dry_run'])
+        else:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                report = import_catalog(stream, fmt, options['batch_size'], options['dry_run'])
+
+        for line, error in report.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        prefix = "[dry run] " if report.dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{report.rows} rows in {report.elapsed:.2f}s ({report.rows_per_second:.0f} rows/sec): "
+            f"{report.products} products, {report.variants} variants, {report.images} images, "
+            f"{len(report.errors)} errors"
+        ))
@@ -0,0 +1,20 @@
+"""
+Recompute product search vectors in batches
+"""
+from django.core.management.base import BaseCommand
+from apps.products.search import rebuild_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search vector of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Products updated per transaction")
+
+    def handle(self, *args, **options):
+        total = 0
+        for updated in rebuild_search_vectors(batch_size=options['batch_size']):
+            total += updated
+            self.stdout.write(f"Updated {total} products")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search vectors for {total} products"))
@@ -0,0 +1,17 @@
+"""
+Return expired stock reservations to inventory
+"""
+from django.core.management.base import BaseCommand
+from apps.products.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = "Release stock holds whose expiry has passed (run periodically)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Holds released per transaction")
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired holds"))
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='pricing_tier',
+            field=models.ForeignKey(blank=True, help_text='Price source for tiered pricing', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='products', to='products.pricingtier'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:44
+
+from django.db import migrations, models
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+
+
+def fill_stored_values(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    PricingTier = apps.get_model('products', 'PricingTier')
+    tier_price = Subquery(PricingTier.objects.filter(pk=OuterRef('pricing_tier')).values('price')[:1])
+    Product.objects.update(
+        effective_price=Case(
+            When(pricing_model='hourly', hourly_rate__isnull=False, then=F('hourly_rate') * F('minimum_hours')),
+            When(pricing_model='subscription', subscription_price__isnull=False, then=F('subscription_price')),
+            When(pricing_model='tiered', pricing_tier__isnull=False, then=Coalesce(tier_price, F('base_price'))),
+            default=F('base_price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        in_stock=Case(When(track_inventory=False, then=Value(True)),
+                      When(GreaterThan(F('stock_quantity'), 0), then=Value(True)), default=Value(False)),
+        low_stock=Case(When(track_inventory=True,
+                            then=LessThanOrEqual(F('stock_quantity'), F('low_stock_threshold'))),
+                       default=Value(False)),
+    )
+    Product.objects.filter(compare_price__gt=F('effective_price')).update(on_sale=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_pricing_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='in_stock',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='low_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='on_sale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_stored_values, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'effective_price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'status', 'effective_price', 'id'], name='product_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'in_stock', 'created_at', 'id'], name='product_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('on_sale', True)), fields=['status', 'created_at', 'id'], name='product_on_sale_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('low_stock', True)), fields=['stock_quantity'], name='product_low_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-17 03:47
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_stored_price_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='tag_list',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), blank=True, default=list, editable=False, size=None),
+        ),
+        # Same normalization as apps.products.models.split_tags
+        migrations.RunSQL(
+            """
+            UPDATE products_product SET tag_list = ARRAY(
+                SELECT DISTINCT lower(trim(tag)) FROM unnest(string_to_array(tags, ',')) AS tag
+                WHERE trim(tag) <> '' ORDER BY 1
+            )
+            WHERE tags <> ''
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tag_list'], name='product_tag_list_idx'),
+        ),
+    ]
@@ -1,10 +1,17 @@
 """
 Product catalog models
 """
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Case, F, Prefetch, Q, Value, When
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
 from django.urls import reverse
 from apps.core.mixins import TimestampMixin, SEOMixin
-from apps.core.utils import generate_unique_slug, generate_sku, upload_to_path
+from apps.core.utils import save_with_unique_slug, generate_sku, upload_to_path
+from .prices import member_price_expression, resolve_list_price, stored_price_expressions
 
 
 class Category(TimestampMixin, SEOMixin):
@@ -27,13 +34,66 @@ class Category(TimestampMixin, SEOMixin):
     
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = generate_unique_slug(Category, self.name)
+            return save_with_unique_slug(self, self.name, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse('products:category', kwargs={'slug': self.slug})
 
 
+def split_tags(tags):
+    """Normalized, de-duplicated tags of a comma-separated tags value"""
+    return sorted({tag.strip().lower() for tag in (tags or '').split(',') if tag.strip()})
+
+
+def stock_flag_expressions(stock=None):
+    """
+    SQL for Product.in_stock and low_stock given the stock quantity; an
+    UPDATE changing the quantity passes the new value, as SET sees the old one
+    """
+    stock = F('stock_quantity') if stock is None else stock
+    return {
+        'in_stock': Case(When(track_inventory=False, then=Value(True)),
+                         When(GreaterThan(stock, 0), then=Value(True)), default=Value(False)),
+        'low_stock': Case(When(track_inventory=True, then=LessThanOrEqual(stock, F('low_stock_threshold'))),
+                          default=Value(False)),
+    }
+
+
+class ProductQuerySet(models.QuerySet):
+    """Query helpers for products"""
+
+    def active(self):
+        return self.filter(status=Product.Status.ACTIVE)
+
+    def with_prices(self, membership_tier=None):
+        """
+        Annotate list_price (the stored effective_price) and member_price
+        (list price less the membership tier's discount)
+        """
+        list_price = F('effective_price')
+        return self.annotate(list_price=list_price,
+                             member_price=member_price_expression(list_price, membership_tier))
+
+    def refresh_stored_values(self):
+        """Recompute the stored price and stock columns with one UPDATE"""
+        return self.update(**stored_price_expressions(), **stock_flag_expressions())
+
+    def with_detail(self):
+        """
+        Load everything the product detail page renders in three queries:
+        the product with its category, its ordered images and its active variants.
+        """
+        return self.select_related('category').prefetch_related(
+            Prefetch('images',
+                     queryset=ProductImage.objects.order_by('sort_order', 'created_at'),
+                     to_attr='ordered_images'),
+            Prefetch('variants',
+                     queryset=ProductVariant.objects.filter(is_active=True).order_by('id'),
+                     to_attr='active_variants'),
+        )
+
+
 class Product(TimestampMixin, SEOMixin):
     """Product model with comprehensive business features"""
 
@@ -73,6 +133,8 @@ class Product(TimestampMixin, SEOMixin):
     # Pricing Model
     pricing_model = models.CharField(max_length=20, choices=PricingModel.choices,
                                     default=PricingModel.FIXED)
+    pricing_tier = models.ForeignKey('PricingTier', on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='products', help_text="Price source for tiered pricing")
 
     # Base Pricing
     base_price = models.DecimalField(max_digits=10, decimal_places=2,
@@ -120,37 +182,86 @@ class Product(TimestampMixin, SEOMixin):
     featured_image = models.ImageField(upload_to=upload_to_path, blank=True)
     tags = models.CharField(max_length=255, blank=True,
                            help_text="Comma-separated tags")
-    
+
+    # Maintained by apps.products.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Derived from the fields above on save and in bulk updates, so listings
+    # can filter and sort on them in SQL
+    effective_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    on_sale = models.BooleanField(default=False, editable=False)
+    in_stock = models.BooleanField(default=True, editable=False)
+    low_stock = models.BooleanField(default=False, editable=False)
+    tag_list = ArrayField(models.CharField(max_length=255), default=list, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['status', 'featured']),
-            models.Index(fields=['category', 'status']),
+            # Back keyset pagination on (created_at, id) for listings
+            models.Index(fields=['status', 'created_at', 'id']),
+            models.Index(fields=['category', 'status', 'created_at', 'id']),
+            GinIndex(fields=['search_vector']),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+            GinIndex(fields=['sku'], opclasses=['gin_trgm_ops'], name='product_sku_trgm_idx'),
+            # Price sorted listings and price range filters
+            models.Index(fields=['status', 'effective_price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', 'status', 'effective_price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['status', 'in_stock', 'created_at', 'id'], name='product_in_stock_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], condition=Q(on_sale=True),
+                         name='product_on_sale_idx'),
+            models.Index(fields=['stock_quantity'], condition=Q(low_stock=True), name='product_low_stock_idx'),
+            GinIndex(fields=['tag_list'], name='product_tag_list_idx'),
         ]
+
+    # Columns set by set_stored_values()
+    STORED_FIELDS = ('effective_price', 'on_sale', 'in_stock', 'low_stock', 'tag_list')
+    
+    # Paths under /products/ that a product with the same slug would shadow
+    RESERVED_SLUGS = frozenset({'search'})
     
     def __str__(self):
         return f"{self.name} ({self.sku})"
     
+    def clean(self):
+        super().clean()
+        if self.slug in self.RESERVED_SLUGS:
+            raise ValidationError({'slug': f"'{self.slug}' is reserved for the catalog's own pages."})
+    
     def save(self, *args, **kwargs):
         if not self.sku:
             self.sku = generate_sku()
+        self.set_stored_values()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], *self.STORED_FIELDS}
         if not self.slug:
-            self.slug = generate_unique_slug(Product, self.name)
+            return save_with_unique_slug(self, self.name, super().save, *args, reserved=self.RESERVED_SLUGS,
+                                         **kwargs)
         super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse('products:detail', kwargs={'slug': self.slug})
+
+    def set_stored_values(self, tiers=None):
+        """Recompute effective_price, on_sale, in_stock, low_stock and tag_list from the product's fields"""
+        if tiers is None and self.pricing_model == self.PricingModel.TIERED and self.pricing_tier_id:
+            # The tier's current price; the cached map may predate a change in this transaction
+            tiers = dict(PricingTier.objects.filter(pk=self.pricing_tier_id).values_list('pk', 'price'))
+        self.effective_price = resolve_list_price(self, tiers)
+        self.on_sale = bool(self.compare_price and self.effective_price is not None
+                            and self.compare_price > self.effective_price)
+        self.in_stock = self.is_in_stock
+        self.low_stock = self.is_low_stock
+        self.tag_list = split_tags(self.tags)
     
     @property
     def price(self):
-        """Get the effective price based on pricing model"""
-        if self.pricing_model == self.PricingModel.FIXED:
-            return self.base_price
-        elif self.pricing_model == self.PricingModel.HOURLY:
-            return self.hourly_rate or self.base_price
-        elif self.pricing_model == self.PricingModel.SUBSCRIPTION:
-            return self.subscription_price or self.base_price
-        return self.base_price
+        """List price for the pricing model, as annotated by with_prices() when it was"""
+        if 'list_price' in self.__dict__:
+            return self.list_price
+        return resolve_list_price(self)
 
     @property
     def is_on_sale(self):
@@ -220,7 +331,39 @@ class ProductVariant(TimestampMixin):
     
     @property
     def effective_price(self):
-        return self.price or self.product.price
+        """Own price or the product's; annotated as list_price by variant listings to spare the product"""
+        if 'list_price' in self.__dict__:
+            return self.list_price
+        return self.price if self.price is not None else self.product.price
+
+
+class StockReservation(TimestampMixin):
+    """Stock taken out of a product or variant and held for a cart or order"""
+
+    class Status(models.TextChoices):
+        HELD = 'held', 'Held'
+        COMMITTED = 'committed', 'Committed'
+        RELEASED = 'released', 'Released'
+        EXPIRED = 'expired', 'Expired'
+
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, related_name='reservations',
+                                on_delete=models.CASCADE, blank=True, null=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.HELD)
+    reference = models.CharField(max_length=100, blank=True,
+                                 help_text="Cart or order holding the stock")
+    expires_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['reference']),
+        ]
+
+    def __str__(self):
+        target = f"variant {self.variant_id}" if self.variant_id else f"product {self.product_id}"
+        return f"{self.quantity} x {target} ({self.get_status_display()})"
 
 
 class PricingTier(TimestampMixin):
@@ -271,7 +414,7 @@ class ServicePackage(TimestampMixin):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = generate_unique_slug(ServicePackage, self.name)
+            return save_with_unique_slug(self, self.name, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     @property
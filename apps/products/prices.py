@@ -0,0 +1,133 @@
+"""
+Effective price resolution
+
+A product's list price follows its pricing model: the hourly rate times the
+minimum hours, the subscription price, its pricing tier's price, or the
+base price when the model's own price is not set. A variant's price
+overrides it, and members get the MEMBERSHIP_DISCOUNTS percentage for
+their tier off either.
+
+The list price is stored on every product as effective_price, set from
+Python on save and by the SQL expressions here in bulk UPDATEs, so listings
+sort and filter by price on an indexed column (ProductQuerySet.with_prices).
+The Python side only needs pricing tier prices from the database, and reads
+them as one map cached per catalog version.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Round
+from .cache import get_catalog_version
+
+TIER_PRICES_KEY = 'catalog:tier-prices:{}'
+
+CENT = Decimal('0.01')
+PRICE_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def list_price_expression():
+    """SQL for a product's list price, free of joins so UPDATEs can use it"""
+    from .models import PricingTier, Product
+
+    tier_price = Subquery(PricingTier.objects.filter(pk=OuterRef('pricing_tier')).values('price')[:1])
+    return Case(
+        When(pricing_model=Product.PricingModel.HOURLY, hourly_rate__isnull=False,
+             then=F('hourly_rate') * F('minimum_hours')),
+        When(pricing_model=Product.PricingModel.SUBSCRIPTION, subscription_price__isnull=False,
+             then=F('subscription_price')),
+        When(pricing_model=Product.PricingModel.TIERED, pricing_tier__isnull=False,
+             then=Coalesce(tier_price, F('base_price'))),
+        default=F('base_price'),
+        output_field=PRICE_FIELD,
+    )
+
+
+def stored_price_expressions():
+    """SQL recomputing Product.effective_price and on_sale, for bulk UPDATEs"""
+    price = list_price_expression()
+    return {
+        'effective_price': price,
+        'on_sale': Case(When(compare_price__gt=price, then=Value(True)), default=Value(False)),
+    }
+
+
+def variant_price_expression():
+    """SQL for a variant's price: its own, or its product's list price"""
+    return Coalesce(F('price'), F('product__effective_price'), output_field=PRICE_FIELD)
+
+
+def membership_discount(membership_tier):
+    """Percentage off for a membership tier"""
+    return Decimal(str(settings.MEMBERSHIP_DISCOUNTS.get(membership_tier, 0)))
+
+
+def member_price_expression(expression, membership_tier):
+    """SQL applying a membership tier's discount to a price expression"""
+    discount = membership_discount(membership_tier)
+    if not discount:
+        return expression
+    return Round(expression * Value((100 - discount) / 100), 2, output_field=PRICE_FIELD)
+
+
+def apply_membership_discount(price, membership_tier):
+    discount = membership_discount(membership_tier)
+    if not discount or price is None:
+        return price
+    # Rounds like PostgreSQL's round(numeric) so SQL and Python agree
+    return (price * (100 - discount) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def tier_prices(refresh=False):
+    """Pricing tier id -> price, cached for the current catalog version"""
+    from .models import PricingTier
+
+    key = TIER_PRICES_KEY.format(get_catalog_version())
+    prices = None if refresh else cache.get(key)
+    if prices is None:
+        prices = dict(PricingTier.objects.values_list('pk', 'price'))
+        cache.set(key, prices, settings.CATALOG_CACHE_TIMEOUT)
+    return prices
+
+
+def resolve_list_price(product, tiers=None):
+    """A loaded product's list price"""
+    from .models import Product
+
+    if product.pricing_model == Product.PricingModel.HOURLY and product.hourly_rate is not None:
+        return product.hourly_rate * product.minimum_hours
+    if product.pricing_model == Product.PricingModel.SUBSCRIPTION and product.subscription_price is not None:
+        return product.subscription_price
+    if product.pricing_model == Product.PricingModel.TIERED and product.pricing_tier_id is not None:
+        tiers = tier_prices() if tiers is None else tiers
+        if product.pricing_tier_id not in tiers:
+            # Created since the map was cached
+            tiers = tier_prices(refresh=True)
+        return tiers.get(product.pricing_tier_id, product.base_price)
+    return product.base_price
+
+
+def resolve_prices(products, membership_tier=None):
+    """
+    Product id -> price for a member of membership_tier, for a batch of
+    loaded products; tier prices are read at most once
+    """
+    tiers = None
+    prices = {}
+    for product in products:
+        price = product.__dict__.get('list_price')
+        if price is None:
+            if tiers is None and product.pricing_model == product.PricingModel.TIERED:
+                tiers = tier_prices()
+            price = resolve_list_price(product, tiers)
+        prices[product.pk] = apply_membership_discount(price, membership_tier)
+    return prices
+
+
+def unit_price(product, variant=None, membership_tier=None):
+    """Price of one unit of a product, or of one of its variants, for a member of membership_tier"""
+    if variant is not None and variant.price is not None:
+        price = variant.price
+    else:
+        price = product.price
+    return apply_membership_discount(price, membership_tier)
@@ -0,0 +1,78 @@
+"""
+Catalog search backed by Postgres full-text search
+
+Each product keeps a weighted search_vector (name, tags, category name,
+short description, description) indexed with GIN. Queries that match no
+document fall back to trigram similarity on name and SKU to absorb typos.
+"""
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
+from .models import Category, Product
+
+SEARCH_CONFIG = getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'english')
+
+
+def product_search_vector():
+    """Expression computing a product's search vector, usable in UPDATE queries"""
+    category_name = Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1])
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('tags', weight='B', config=SEARCH_CONFIG)
+        + SearchVector(category_name, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('short_description', weight='C', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='D', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(queryset):
+    """Recompute search vectors for every product in queryset with one UPDATE"""
+    return queryset.update(search_vector=product_search_vector())
+
+
+def rebuild_search_vectors(batch_size=1000, queryset=None):
+    """Recompute all search vectors in primary key batches, yielding progress"""
+    queryset = queryset if queryset is not None else Product.objects.all()
+    last_pk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        with transaction.atomic():
+            updated = update_search_vectors(Product.objects.filter(pk__in=pks))
+        last_pk = pks[-1]
+        yield updated
+
+
+def normalize_query(query):
+    """A search query with surrounding and repeated whitespace removed"""
+    return ' '.join((query or '').split())
+
+
+def search_products(query, queryset=None, limit=20):
+    """
+    Return up to limit products ranked by relevance to query. Each result
+    carries a rank attribute; fallback results are ranked by trigram similarity.
+    """
+    query = normalize_query(query)
+    if not query:
+        return []
+    queryset = queryset if queryset is not None else Product.objects.active()
+
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    results = list(
+        queryset.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-rank', '-created_at')[:limit]
+    )
+    if results or len(query) < 3:
+        return results
+
+    # Nothing matched the full-text index: look for near misses on name/SKU
+    return list(
+        queryset.filter(Q(name__trigram_similar=query) | Q(sku__trigram_similar=query))
+        .annotate(rank=Greatest(TrigramSimilarity('name', query), TrigramSimilarity('sku', query)))
+        .order_by('-rank', '-created_at')[:limit]
+    )
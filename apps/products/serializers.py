@@ -2,6 +2,7 @@
 Serializers for the products app
 """
 from rest_framework import serializers
+from apps.core.serializers import SparseFieldsetMixin
 from .models import Category, Product, ProductImage, ProductVariant
 
 
@@ -26,9 +27,65 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'sku', 'effective_price', 'stock_quantity', 'size', 'color']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Compact Product representation for list endpoints"""
+    category = serializers.SlugRelatedField(slug_field='slug', read_only=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    # Annotated by ProductQuerySet.with_prices() for the requesting member
+    member_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    primary_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'sku', 'slug', 'name', 'price', 'member_price', 'on_sale', 'primary_image', 'in_stock',
+                  'category']
+
+    def get_primary_image(self, obj):
+        if obj.featured_image:
+            image = obj.featured_image
+        else:
+            # Filled by the list queryset's primary image prefetch
+            primary_images = getattr(obj, 'primary_images', [])
+            if not primary_images:
+                return None
+            image = primary_images[0].image
+        request = self.context.get('request')
+        return request.build_absolute_uri(image.url) if request else image.url
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for the Product model"""
     category = serializers.StringRelatedField()
     class Meta:
         model = Product
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['search_vector']
+
+
+class FacetValueSerializer(serializers.Serializer):
+    value = serializers.CharField()
+    label = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class CategoryFacetSerializer(FacetValueSerializer):
+    parent = serializers.CharField(allow_null=True)
+
+
+class PriceRangeSerializer(serializers.Serializer):
+    min = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    max = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+
+
+class ProductFacetsSerializer(serializers.Serializer):
+    """Facet counts computed by apps.products.facets"""
+    total = serializers.IntegerField()
+    category = CategoryFacetSerializer(many=True)
+    product_type = FacetValueSerializer(many=True)
+    pricing_model = FacetValueSerializer(many=True)
+    in_stock = serializers.IntegerField()
+    on_sale = serializers.IntegerField()
+    price = PriceRangeSerializer()
+    size = FacetValueSerializer(many=True)
+    color = FacetValueSerializer(many=True)
+    material = FacetValueSerializer(many=True)
+    tags = FacetValueSerializer(many=True)
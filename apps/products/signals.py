@@ -0,0 +1,73 @@
+"""
+Signal handlers keeping catalog caches, search vectors and stored prices current
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cache import bump_catalog_version, bump_product_version
+from .models import Category, PricingTier, Product, ProductImage, ProductVariant
+from .search import update_search_vectors
+
+
+def _bump_product(product_id):
+    slug = Product.objects.filter(pk=product_id).values_list('slug', flat=True).first()
+    if slug:
+        transaction.on_commit(lambda: bump_product_version(slug))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    """Products appear in listings, the home page and their detail page"""
+    slug = instance.slug
+    transaction.on_commit(bump_catalog_version)
+    transaction.on_commit(lambda: bump_product_version(slug))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver([post_save, post_delete], sender=PricingTier)
+def invalidate_pricing_tier(sender, instance, **kwargs):
+    """Tier prices are the list price of their tiered products"""
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=PricingTier)
+def refresh_tier_product_prices(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Product.objects.filter(pricing_tier=instance).refresh_stored_values()
+
+
+@receiver(post_delete, sender=PricingTier)
+def refresh_untiered_product_prices(sender, instance, **kwargs):
+    """Products of a deleted tier have had it set to NULL and fall back to their base price"""
+    Product.objects.filter(pricing_model=Product.PricingModel.TIERED,
+                           pricing_tier__isnull=True).refresh_stored_values()
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_detail(sender, instance, **kwargs):
+    """Images are only rendered on the product detail page"""
+    _bump_product(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=ProductVariant)
+def invalidate_product_variants(sender, instance, **kwargs):
+    """Variants are rendered on the detail page and their attributes filter listings"""
+    _bump_product(instance.product_id)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_search_vector(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_search_vectors(sender, instance, created, raw=False, **kwargs):
+    """Category names are part of their products' search vectors"""
+    if not created and not raw:
+        update_search_vectors(Product.objects.filter(category=instance))
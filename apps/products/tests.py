@@ -1,3 +1,580 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from django.db import connection
+from django.http import QueryDict
+from decimal import Decimal
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.core.pagination import KeysetPagination
+from rest_framework.test import APIClient
+from . import facets, inventory, prices
+from .filters import clean_filters
+from .importer import CatalogImporter, import_catalog
+from .models import Category, PricingTier, Product, ProductImage, ProductVariant, StockReservation
+from .search import search_products
+from .serializers import ProductListSerializer
+from .views import ProductDetailView
+
+
+class ProductDetailQueryTests(TestCase):
+    """The detail page must not issue queries per image or variant"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.category = Category.objects.create(name='Apparel')
+
+    def make_product(self, name, images, variants):
+        product = Product.objects.create(name=name, description='Test product', base_price=100,
+                                         category=self.category, status=Product.Status.ACTIVE)
+        for i in range(images):
+            ProductImage.objects.create(product=product, image=f'products/{name}-{i}.jpg',
+                                        is_primary=(i == 0), sort_order=i)
+        for i in range(variants):
+            ProductVariant.objects.create(product=product, name=f'Variant {i}', sku=f'{name}-{i}')
+        return product
+
+    def render_detail(self, product):
+        request = self.factory.get(product.get_absolute_url())
+        # An authenticated user bypasses the catalog render cache
+        request.user = User(username='shopper')
+        response = ProductDetailView.as_view()(request, slug=product.slug)
+        response.render()
+        return response
+
+    def test_query_count_is_constant(self):
+        small = self.make_product('small', images=1, variants=1)
+        large = self.make_product('large', images=8, variants=12)
+
+        with self.assertNumQueries(3):
+            self.render_detail(small)
+        with self.assertNumQueries(3):
+            response = self.render_detail(large)
+
+        self.assertEqual(response.context_data['primary_image'].sort_order, 0)
+        self.assertEqual(len(response.context_data['gallery']), 7)
+        self.assertEqual(len(response.context_data['variants']), 12)
+
+
+class ProductListApiTests(TestCase):
+    url = '/api/v1/products/'
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f'Chair {i}', description='Chair', base_price=30,
+                                             category=Category.objects.create(name=f'Room {i}'),
+                                             status=Product.Status.ACTIVE)
+            ProductImage.objects.create(product=product, image=f'products/chair-{i}.jpg', is_primary=True)
+
+    def test_fields_restricts_the_output(self):
+        self.add_products(2)
+        results = self.client.get(self.url, {'fields': 'id,name'}).json()['results']
+        self.assertEqual([set(result) for result in results], [{'id', 'name'}] * 2)
+        # Unknown names are ignored
+        results = self.client.get(self.url, {'fields': 'name, nope'}).json()['results']
+        self.assertEqual(set(results[0]), {'name'})
+        results = self.client.get(self.url).json()['results']
+        self.assertEqual(set(results[0]), set(ProductListSerializer.Meta.fields))
+
+    def test_query_count_does_not_grow_with_results(self):
+        def queries(count):
+            self.add_products(count)
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            return len(captured)
+
+        self.assertEqual(queries(2), queries(10))
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        lighting = Category.objects.create(name='Lighting')
+        self.lamp = Product.objects.create(name='Brass lamp', description='Warm light for a desk',
+                                           category=lighting, base_price=40, status=Product.Status.ACTIVE)
+        self.shade = Product.objects.create(name='Linen shade', description='Fits any lamp base',
+                                            category=lighting, base_price=15, status=Product.Status.ACTIVE)
+        self.chandelier = Product.objects.create(name='Chandelier', description='Crystal', base_price=900,
+                                                 status=Product.Status.ACTIVE)
+
+    def test_name_matches_rank_above_description_matches(self):
+        results = search_products('lamp')
+        self.assertEqual(results, [self.lamp, self.shade])
+        self.assertGreater(results[0].rank, results[1].rank)
+        # Category names are searchable too
+        self.assertEqual(set(search_products('lighting')), {self.lamp, self.shade})
+
+    def test_typos_fall_back_to_trigram_similarity(self):
+        self.assertEqual(search_products('chandeleir'), [self.chandelier])
+        self.assertEqual(search_products('zz'), [])
+
+    def test_rebuild_search_vectors(self):
+        Product.objects.update(search_vector=None)
+        self.assertEqual(search_products('crystal'), [])
+        out = io.StringIO()
+        call_command('rebuild_search_vectors', batch_size=2, stdout=out)
+        self.assertIn('Rebuilt search vectors for 3 products', out.getvalue())
+        self.assertEqual(search_products('crystal'), [self.chandelier])
+
+    def test_only_short_queries_are_cached_and_whitespace_is_ignored(self):
+        url = reverse('products:search')
+        self.assertContains(self.client.get(url, {'q': 'brass  lamp'}), 'Brass lamp')
+        with self.assertNumQueries(0):
+            self.client.get(url, {'q': ' brass lamp '})
+
+        long_query = 'lamp ' * 20
+        self.client.get(url, {'q': long_query})
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url, {'q': long_query})
+        self.assertTrue(captured)
+
+    def test_search_slug_is_reserved(self):
+        product = Product.objects.create(name='Search', description='Lamp finder', base_price=5,
+                                         status=Product.Status.ACTIVE)
+        self.assertEqual(product.slug, 'search-1')
+        self.assertEqual(self.client.get(product.get_absolute_url()).status_code, 200)
+        product.slug = 'search'
+        with self.assertRaises(ValidationError):
+            product.full_clean()
+
+
+class CatalogCacheTests(TestCase):
+    """Anonymous catalog pages are rendered once per catalog version"""
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Lamp', description='Desk lamp', base_price=40,
+                                              status=Product.Status.ACTIVE)
+        self.url = reverse('products:detail', kwargs={'slug': self.product.slug})
+
+    def form_token(self, response):
+        return re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+
+    def test_cached_page_carries_the_visitors_own_csrf_token(self):
+        first = Client(enforce_csrf_checks=True)
+        first.get(self.url)
+
+        visitor = Client(enforce_csrf_checks=True)
+        with self.assertNumQueries(0):
+            response = visitor.get(self.url)
+        token = self.form_token(response)
+        self.assertNotIn('__CATALOG_CSRF_TOKEN__', response.content.decode())
+
+        # The token is valid for this visitor's own cookie
+        response = visitor.post(reverse('orders:add_to_cart'),
+                                {'product_id': self.product.pk, 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_catalog_change_invalidates_cached_pages(self):
+        self.client.get(self.url)
+        self.client.get(reverse('products:product_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Floor lamp'
+            self.product.save()
+
+        self.assertContains(self.client.get(self.url), 'Floor lamp')
+        self.assertContains(self.client.get(reverse('products:product_list')), 'Floor lamp')
+
+
+@override_settings(MEMBERSHIP_DISCOUNTS={'gold': 10})
+class PriceResolutionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tier = PricingTier.objects.create(name='Premium', price=900)
+        make = Product.objects.create
+        self.products = [
+            make(name='Fixed', description='-', base_price=Decimal('100.05')),
+            make(name='Hourly', description='-', base_price=1, pricing_model=Product.PricingModel.HOURLY,
+                 hourly_rate=150, minimum_hours=3),
+            make(name='Subscription', description='-', base_price=1, subscription_price=300,
+                 pricing_model=Product.PricingModel.SUBSCRIPTION),
+            make(name='Tiered', description='-', base_price=1, pricing_model=Product.PricingModel.TIERED,
+                 pricing_tier=tier),
+            make(name='Unpriced hourly', description='-', base_price=80, pricing_model=Product.PricingModel.HOURLY),
+        ]
+
+    def test_sql_and_python_prices_agree(self):
+        expected = [Decimal('100.05'), Decimal('450'), Decimal('300'), Decimal('900'), Decimal('80')]
+        annotated = Product.objects.filter(pk__in=[product.pk for product in self.products]).with_prices('gold')
+        by_price = list(annotated.order_by('list_price'))
+        self.assertEqual([product.price for product in by_price], sorted(expected))
+
+        loaded = list(Product.objects.filter(pk__in=[product.pk for product in self.products]).order_by('pk'))
+        prices.tier_prices()
+        with self.assertNumQueries(0):
+            resolved = prices.resolve_prices(loaded, 'gold')
+        members = {product.pk: product.member_price for product in annotated}
+        self.assertEqual(resolved, members)
+        self.assertEqual(members[self.products[0].pk], Decimal('90.05'))
+        self.assertEqual([product.price for product in loaded], expected)
+
+    def test_variant_price_overrides_product(self):
+        product = self.products[3]
+        variant = ProductVariant.objects.create(product=product, name='Large', price=Decimal('999.99'))
+        plain = ProductVariant.objects.create(product=product, name='Small')
+        self.assertEqual(prices.unit_price(product, variant, 'gold'), Decimal('899.99'))
+        self.assertEqual(prices.unit_price(product, plain), Decimal('900'))
+        plain = ProductVariant.objects.annotate(list_price=prices.variant_price_expression()).get(pk=plain.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(plain.effective_price, Decimal('900'))
+
+
+class StoredColumnTests(TestCase):
+    """effective_price, on_sale, in_stock and low_stock follow every kind of write"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_stock_flags_follow_reservations(self):
+        product = Product.objects.create(name='Lamp', description='-', base_price=10, stock_quantity=6,
+                                         low_stock_threshold=5, status=Product.Status.ACTIVE)
+        self.assertEqual((product.in_stock, product.low_stock), (True, False))
+
+        reservations = inventory.reserve([(product.pk, None, 6)])
+        product.refresh_from_db()
+        self.assertEqual((product.in_stock, product.low_stock), (False, True))
+
+        inventory.release(reservations)
+        product.refresh_from_db()
+        self.assertEqual((product.in_stock, product.low_stock), (True, False))
+
+        product.track_inventory = False
+        product.stock_quantity = 0
+        product.save(update_fields=['track_inventory', 'stock_quantity'])
+        product.refresh_from_db()
+        self.assertEqual((product.in_stock, product.low_stock), (True, False))
+
+    def test_prices_follow_their_pricing_tier(self):
+        tier = PricingTier.objects.create(name='Premium', price=900)
+        product = Product.objects.create(name='Audit', description='-', base_price=50, compare_price=1000,
+                                         pricing_model=Product.PricingModel.TIERED, pricing_tier=tier)
+        self.assertEqual((product.effective_price, product.on_sale), (Decimal('900'), True))
+
+        tier.price = 1200
+        tier.save()
+        product.refresh_from_db()
+        self.assertEqual((product.effective_price, product.on_sale), (Decimal('1200'), False))
+
+        tier.delete()
+        product.refresh_from_db()
+        self.assertEqual((product.effective_price, product.on_sale), (Decimal('50'), True))
+
+        Product.objects.filter(pk=product.pk).update(effective_price=0, in_stock=False)
+        Product.objects.filter(pk=product.pk).refresh_stored_values()
+        product.refresh_from_db()
+        self.assertEqual((product.effective_price, product.in_stock), (Decimal('50'), False))
+
+    def test_api_filters_and_sorts_in_sql(self):
+        for i, price in enumerate([30, 10, 50, 20, 40]):
+            Product.objects.create(name=f'Item {i}', description='-', base_price=price, stock_quantity=i,
+                                   compare_price=45 if i % 2 else None, status=Product.Status.ACTIVE)
+
+        self.patch_page_size(2)
+        pages = []
+        url = '/api/v1/products/?in_stock=true&ordering=-price'
+        while url:
+            data = self.client.get(url).json()
+            pages.append([item['price'] for item in data['results']])
+            url = data['next']
+        # Item 0 has no stock
+        self.assertEqual(pages, [['50.00', '40.00'], ['20.00', '10.00']])
+        previous = self.client.get(data['previous']).json()
+        self.assertEqual([item['price'] for item in previous['results']], pages[0])
+
+        data = self.client.get('/api/v1/products/', {'on_sale': 'true', 'max_price': 40}).json()
+        self.assertEqual(sorted(item['price'] for item in data['results']), ['10.00', '20.00'])
+        self.assertEqual(self.client.get('/api/v1/products/', {'ordering': 'cheapest'}).status_code, 400)
+
+    def patch_page_size(self, size):
+        original = KeysetPagination.page_size
+        KeysetPagination.page_size = size
+        self.addCleanup(setattr, KeysetPagination, 'page_size', original)
+
+    def test_html_list_ignores_invalid_filters(self):
+        Product.objects.create(name='Cheap', description='-', base_price=5, status=Product.Status.ACTIVE)
+        Product.objects.create(name='Dear', description='-', base_price=500, status=Product.Status.ACTIVE)
+        response = self.client.get(reverse('products:product_list'), {'max_price': '100', 'min_price': 'abc',
+                                                              'ordering': 'price'})
+        self.assertEqual([product.name for product in response.context['products']], ['Cheap'])
+
+
+class FacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.apparel = Category.objects.create(name='Apparel')
+        self.shirts = Category.objects.create(name='Shirts', parent=self.apparel)
+        self.books = Category.objects.create(name='Books')
+        make = Product.objects.create
+        self.tee = make(name='Tee', description='-', base_price=20, category=self.shirts, stock_quantity=3,
+                        tags='Cotton, summer', status=Product.Status.ACTIVE)
+        self.polo = make(name='Polo', description='-', base_price=40, category=self.shirts, stock_quantity=0,
+                         tags='cotton', status=Product.Status.ACTIVE)
+        self.cap = make(name='Cap', description='-', base_price=15, category=self.apparel, stock_quantity=9,
+                        status=Product.Status.ACTIVE)
+        self.novel = make(name='Novel', description='-', base_price=12, category=self.books,
+                          product_type=Product.ProductType.DIGITAL, track_inventory=False,
+                          status=Product.Status.ACTIVE)
+        make(name='Draft', description='-', base_price=5, category=self.books)
+        ProductVariant.objects.create(product=self.tee, name='Large red', size='L', color='red')
+        ProductVariant.objects.create(product=self.tee, name='Small blue', size='S', color='blue')
+        ProductVariant.objects.create(product=self.polo, name='Large blue', size='L', color='blue')
+        ProductVariant.objects.create(product=self.cap, name='Red', color='red', is_active=False)
+
+    def get_facets(self, query=''):
+        return facets.get_facets(clean_filters(QueryDict(query)))
+
+    def counts(self, items):
+        return {item['value']: item['count'] for item in items}
+
+    def test_each_facet_ignores_its_own_filter(self):
+        result = self.get_facets('category=apparel&size=L')
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(self.counts(result['size']), {'L': 2, 'S': 1})
+        self.assertEqual(self.counts(result['color']), {'blue': 1, 'red': 1})
+        # Subcategories count towards their parents; categories ignore the category filter
+        self.assertEqual(self.counts(result['category']), {'apparel': 2, 'shirts': 2})
+        self.assertEqual(self.counts(result['tags']), {'cotton': 2, 'summer': 1})
+        self.assertEqual(result['in_stock'], 1)
+        self.assertEqual(result['price'], {'min': Decimal('20'), 'max': Decimal('40')})
+
+        result = self.get_facets('in_stock=true&product_type=physical')
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(self.counts(result['product_type']), {'physical': 2, 'digital': 1})
+        self.assertEqual(self.counts(result['category']), {'apparel': 2, 'shirts': 1})
+        self.assertEqual(self.counts(self.get_facets('tags=SUMMER')['category']), {'apparel': 1, 'shirts': 1})
+
+    def test_facets_are_cached_per_catalog_version(self):
+        self.get_facets('color=red')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_facets('color=red')['total'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.polo, name='Large red', size='L', color='red')
+        self.assertEqual(self.get_facets('color=red')['total'], 2)
+
+    def test_api_list_returns_facets(self):
+        data = self.client.get('/api/v1/products/', {'category': 'apparel', 'color': 'blue',
+                                                    'facets': 'true'}).json()
+        self.assertEqual({item['name'] for item in data['results']}, {'Tee', 'Polo'})
+        self.assertEqual(data['facets']['total'], 2)
+        self.assertEqual(data['facets']['price'], {'min': '20.00', 'max': '40.00'})
+        self.assertEqual(self.client.get('/api/v1/products/facets/', {'tags': 'cotton'}).json()['total'], 2)
+
+    def test_category_page_lists_subcategories(self):
+        response = self.client.get(reverse('products:category', args=[self.apparel.slug]), {'size': 'S'})
+        self.assertEqual([product.name for product in response.context['products']], ['Tee'])
+        self.assertContains(response, 'value="S" checked')
+
+
+class InventoryReservationTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name='Mug', description='Mug', base_price=10,
+                                              stock_quantity=5)
+        self.variant = ProductVariant.objects.create(product=self.product, name='Blue',
+                                                     sku='MUG-BLUE', stock_quantity=2)
+
+    def test_reservation_is_all_or_nothing(self):
+        with self.assertRaises(inventory.InsufficientStock):
+            inventory.reserve([(self.product.pk, None, 3), (self.product.pk, self.variant.pk, 3)])
+        self.product.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.variant.stock_quantity), (5, 2))
+
+    def test_shortfall_names_the_line_and_takes_nothing(self):
+        untracked = Product.objects.create(name='Gift card', description='Card', base_price=10,
+                                           stock_quantity=0, track_inventory=False)
+        other = Product.objects.create(name='Plate', description='Plate', base_price=10, stock_quantity=5)
+        inventory.reserve([(untracked.pk, None, 3)])
+        with self.assertRaises(inventory.InsufficientStock) as raised:
+            inventory.reserve([(self.product.pk, None, 1), (self.product.pk, self.variant.pk, 3)])
+        self.assertEqual(raised.exception.line.variant_id, self.variant.pk)
+        with self.assertRaises(inventory.InsufficientStock):
+            inventory.reserve([(other.pk, self.variant.pk, 1)])
+
+        self.product.refresh_from_db()
+        untracked.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, untracked.stock_quantity), (5, 0))
+
+    def test_expired_holds_return_to_stock(self):
+        inventory.reserve([(self.product.pk, None, 2), (self.product.pk, self.variant.pk, 1)],
+                          hold_seconds=60)
+        self.assertEqual(inventory.release_expired(now=timezone.now()), 0)
+        self.assertEqual(inventory.release_expired(now=timezone.now() + timedelta(minutes=2)), 2)
+        self.product.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.variant.stock_quantity), (5, 2))
+        self.assertFalse(StockReservation.objects.filter(status=StockReservation.Status.HELD).exists())
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    """Load test: many buyers racing for one SKU must never oversell it"""
+    buyers = 40
+    stock = 15
+
+    def test_no_oversell_on_a_hot_sku(self):
+        product = Product.objects.create(name='Limited', description='Drop', base_price=10,
+                                         stock_quantity=self.stock)
+        results = []
+        start = threading.Barrier(self.buyers)
+
+        def buy():
+            try:
+                start.wait()
+                inventory.reserve([(product.pk, None, 1)])
+                results.append(True)
+            except inventory.InsufficientStock:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(self.buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), self.stock)
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(StockReservation.objects.count(), self.stock)
+
+
+    def test_overlapping_carts_in_opposite_order_do_not_deadlock(self):
+        products = [Product.objects.create(name=f'Item {i}', description='Item', base_price=10, stock_quantity=100)
+                    for i in range(20)]
+        variants = [ProductVariant.objects.create(product=product, name='Blue', sku=f'ITEM-{i}-BLUE',
+                                                  stock_quantity=100) for i, product in enumerate(products)]
+        lines = [(product.pk, None, 1) for product in products] + \
+                [(variant.product_id, variant.pk, 1) for variant in variants]
+        errors = []
+        start = threading.Barrier(8)
+
+        def buy(cart):
+            try:
+                start.wait()
+                for _ in range(5):
+                    inventory.reserve(cart)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(lines if i % 2 else lines[::-1],)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(set(Product.objects.filter(pk__in=[p.pk for p in products])
+                             .values_list('stock_quantity', flat=True)), {60})
+        self.assertEqual(set(ProductVariant.objects.values_list('stock_quantity', flat=True)), {60})
+
+
+class CatalogImportTests(TestCase):
+
+    csv = (
+        "name,sku,description,base_price,category,images,parent_sku,size\n"
+        "Mug,MUG,Stoneware,12.50,kitchen,mugs/front.jpg|mugs/back.jpg,,\n"
+        "Mug large,MUG-L,,,,,MUG,L\n"
+        ",NONAME,Nameless,5,,,,\n"
+        "Plate,PLATE,Plate,abc,,,,\n"
+        "Bowl,BOWL,Bowl,8,nowhere,,,\n"
+    )
+
+    def setUp(self):
+        Category.objects.create(name='Kitchen', slug='kitchen')
+
+    def test_valid_rows_are_written_and_bad_rows_reported(self):
+        report = import_catalog(io.StringIO(self.csv), 'csv', batch_size=1)
+        self.assertEqual((report.rows, report.products, report.variants, report.images), (5, 1, 1, 2))
+        self.assertEqual([line for line, _ in report.errors], [4, 5, 6])
+
+        mug = Product.objects.get(sku='MUG')
+        self.assertEqual((mug.slug, mug.category.slug, mug.effective_price), ('mug', 'kitchen', Decimal('12.50')))
+        self.assertEqual(mug.images.get(is_primary=True).image.name, 'mugs/front.jpg')
+        self.assertEqual(mug.variants.get().size, 'L')
+
+    def test_row_with_an_invalid_nested_variant_is_skipped_whole(self):
+        rows = [
+            {'name': 'Lamp', 'sku': 'LAMP', 'description': 'Lamp', 'base_price': '30', 'images': ['lamps/a.jpg'],
+             'variants': [{'name': 'Red', 'sku': 'LAMP-R'}, {'sku': 'LAMP-B'}]},
+            {'name': 'Lamp', 'sku': 'LAMP-2', 'description': 'Lamp', 'base_price': '30',
+             'variants': [{'name': 'Red', 'sku': 'LAMP-R'}]},
+        ]
+        report = import_catalog(io.StringIO('\n'.join(json.dumps(row) for row in rows)), 'jsonl')
+        self.assertEqual(report.errors, [(1, 'variant name is required')])
+        self.assertEqual((report.products, report.variants, report.images), (1, 1, 0))
+        # The rejected row released its slug and SKUs
+        self.assertEqual(list(Product.objects.values_list('sku', 'slug')), [('LAMP-2', 'lamp')])
+        self.assertEqual(list(ProductVariant.objects.values_list('product__sku', 'sku')), [('LAMP-2', 'LAMP-R')])
+
+    def test_dry_run_writes_nothing(self):
+        report = import_catalog(io.StringIO(self.csv), 'csv', dry_run=True)
+        self.assertEqual((report.products, report.variants), (1, 1))
+        self.assertFalse(Product.objects.exists())
+
+    def test_duplicate_slugs_and_skus_are_rejected(self):
+        Product.objects.create(name='Cup', slug='cup', sku='CUP', description='Cup', base_price=5)
+        rows = ''.join(json.dumps(dict(row, description='Tableware', base_price=5)) + '\n' for row in [
+            {'name': 'Cup', 'sku': 'CUP'},
+            {'name': 'Cup', 'slug': 'cup'},
+            {'name': 'Cup'},
+            {'name': 'Saucer', 'sku': 'SAUCER'},
+            {'name': 'Saucer', 'sku': 'SAUCER'},
+        ])
+        report = import_catalog(io.StringIO(rows), 'jsonl')
+        self.assertEqual([line for line, _ in report.errors], [1, 2, 5])
+        self.assertEqual(Product.objects.exclude(sku='CUP').get(name='Cup').slug, 'cup-1')
+
+    def test_batch_colliding_with_a_concurrent_write_is_reported(self):
+        importer = CatalogImporter(batch_size=1)
+        Product.objects.create(name='Mug', sku='MUG', description='Written meanwhile', base_price=5)
+        report = importer.run(io.StringIO(self.csv), 'csv')
+
+        self.assertIn('Lines 2-2 not imported', dict(report.errors)[2])
+        self.assertEqual((report.products, report.variants), (0, 1))
+        # The rest of the file is imported against what is there now
+        mug = Product.objects.get()
+        self.assertEqual((mug.description, mug.variants.get().sku), ('Written meanwhile', 'MUG-L'))
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as upload:
+            upload.write(self.csv)
+        self.addCleanup(os.remove, upload.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', upload.name, stdout=out, stderr=err)
+        self.assertIn('1 products, 1 variants, 2 images, 3 errors', out.getvalue())
+        self.assertIn('Line 4:', err.getvalue())
+        self.assertTrue(Product.objects.filter(sku='MUG').exists())
+
+    def test_api_import_is_admin_only(self):
+        client = APIClient()
+        url = '/api/v1/products/import/'
+        client.force_authenticate(User.objects.create_user('shopper', 'shopper@example.com', 'secret'))
+        upload = SimpleUploadedFile('catalog.csv', self.csv.encode())
+        self.assertEqual(client.post(url, {'file': upload}).status_code, 403)
+
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        upload = SimpleUploadedFile('catalog.csv', self.csv.encode())
+        response = client.post(url, {'file': upload, 'dry_run': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['dry_run'], response.data['products'], len(response.data['errors'])),
+                         (True, 1, 3))
+        self.assertFalse(Product.objects.exists())
 
-# Create your tests here.
@@ -8,6 +8,7 @@ app_name = 'products'
 
 urlpatterns = [
     path('', views.ProductListView.as_view(), name='product_list'),
+    path('search/', views.ProductSearchView.as_view(), name='search'),
     path('<slug:slug>/', views.ProductDetailView.as_view(), name='detail'),
     path('category/<slug:slug>/', views.CategoryProductListView.as_view(), name='category'),
 ]
\ No newline at end of file
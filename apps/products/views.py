@@ -1,29 +1,90 @@
 """
 Views for the products app
 """
+import hashlib
 from django.shortcuts import get_object_or_404
 from django.views.generic import DetailView, ListView
+from apps.core.mixins import KeysetPaginationMixin
+from .cache import PAGE_KEY_PREFIX, CatalogCacheMixin, get_catalog_version, get_product_version
+from .facets import get_facets
+from .filters import clean_filters, filter_products, keyset_ordering
 from .models import Product, Category
+from .search import normalize_query, search_products
 
 
-class ProductListView(ListView):
+# Checkbox facets of the listing filter form, as (parameter, title)
+FACET_GROUPS = (
+    ('product_type', 'Type'),
+    ('pricing_model', 'Pricing'),
+    ('size', 'Size'),
+    ('color', 'Color'),
+    ('material', 'Material'),
+    ('tags', 'Tags'),
+)
+
+
+class ProductFilterMixin:
+    """Filter and sort a product listing by the request's catalog filter parameters, with facet counts"""
+
+    def get_filters(self):
+        return clean_filters(self.request.GET)
+
+    def filter_products(self, queryset):
+        self.filters = self.get_filters()
+        return filter_products(queryset, self.filters)
+
+    def get_keyset_ordering(self):
+        return keyset_ordering(self.filters)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        facets = get_facets(self.filters)
+        context['filters'] = self.filters
+        context['facets'] = facets
+        context['facet_groups'] = [
+            (name, title, [{**item, 'selected': item['value'] in self.filters.get(name, ())} for item in facets[name]])
+            for name, title in FACET_GROUPS
+        ]
+        return context
+
+
+class ProductListView(CatalogCacheMixin, ProductFilterMixin, KeysetPaginationMixin, ListView):
     """Display a list of all products."""
     model = Product
     template_name = 'products/product_list.html'
     context_object_name = 'products'
 
     def get_queryset(self):
-        return Product.objects.filter(status=Product.Status.ACTIVE)
+        return self.filter_products(Product.objects.filter(status=Product.Status.ACTIVE).with_prices())
 
 
-class ProductDetailView(DetailView):
+class ProductDetailView(CatalogCacheMixin, DetailView):
     """Display a single product."""
     model = Product
     template_name = 'products/product_detail.html'
     context_object_name = 'product'
 
+    def get_catalog_versions(self):
+        return [get_catalog_version(), get_product_version(self.kwargs['slug'])]
+
+    def get_queryset(self):
+        return Product.objects.with_detail().with_prices()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        images = self.object.ordered_images
+        primary_image = next((image for image in images if image.is_primary),
+                             images[0] if images else None)
+        # The featured image takes the main slot when set, otherwise the primary image does
+        main_image = None if self.object.featured_image else primary_image
+        context['primary_image'] = primary_image
+        context['gallery'] = [image for image in images
+                              if image is not main_image and not image.is_primary]
+        context['variants'] = self.object.active_variants
+        return context
+
 
-class CategoryProductListView(ListView):
+class CategoryProductListView(CatalogCacheMixin, ProductFilterMixin, KeysetPaginationMixin, ListView):
     """Display a list of products in a category."""
     model = Product
     template_name = 'products/category_product_list.html'
@@ -31,4 +92,43 @@ class CategoryProductListView(ListView):
 
     def get_queryset(self):
         self.category = get_object_or_404(Category, slug=self.kwargs['slug'])
-        return Product.objects.filter(category=self.category, status=Product.Status.ACTIVE)
\ No newline at end of file
+        return self.filter_products(Product.objects.active().with_prices())
+
+    def get_filters(self):
+        # The category page lists the category's subcategories too
+        return {**super().get_filters(), 'category': self.category.slug}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['category'] = self.category
+        return context
+
+
+class ProductSearchView(CatalogCacheMixin, ListView):
+    """Display products matching a search query."""
+    template_name = 'products/search.html'
+    context_object_name = 'products'
+    results_limit = 48
+    # Longer queries are rare and would only fill the cache with one-off pages
+    max_cached_query_length = 64
+
+    def dispatch(self, request, *args, **kwargs):
+        self.query = normalize_query(request.GET.get('q'))
+        return super().dispatch(request, *args, **kwargs)
+
+    def is_catalog_cacheable(self, request):
+        return (super().is_catalog_cacheable(request) and set(request.GET) <= {'q'}
+                and len(self.query) <= self.max_cached_query_length)
+
+    def get_catalog_cache_key(self):
+        # Queries differing only in whitespace share a page
+        digest = hashlib.md5(f"{self.request.path}|{self.query}|{get_catalog_version()}".encode()).hexdigest()
+        return f"{PAGE_KEY_PREFIX}{digest}"
+
+    def get_queryset(self):
+        return search_products(self.query, Product.objects.active().with_prices(), limit=self.results_limit)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.query
+        return context
@@ -11,7 +11,7 @@ from rest_framework_simplejwt.views import (
 
 from apps.accounts.api import UserViewSet
 from apps.products.api import ProductViewSet, CategoryViewSet
-from apps.orders.api import OrderViewSet
+from apps.orders.api import OrderViewSet, CartViewSet, ShippingViewSet
 
 # Create a router and register our viewsets
 router = DefaultRouter()
@@ -19,6 +19,8 @@ router.register(r'users', UserViewSet, basename='user')
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'cart', CartViewSet, basename='cart')
+router.register(r'shipping', ShippingViewSet, basename='shipping')
 
 urlpatterns = [
     # JWT Authentication
@@ -36,6 +36,7 @@ DJANGO_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sitemaps',
     'django.contrib.sites',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -194,6 +195,41 @@ if not DEBUG:
         }
     }
 
+# Platform statistics may be served this many seconds stale
+PLATFORM_STATS_CACHE_TIMEOUT = env.int('PLATFORM_STATS_CACHE_TIMEOUT', default=60)
+
+# Rendered catalog pages served to anonymous visitors
+CATALOG_CACHE_TIMEOUT = env.int('CATALOG_CACHE_TIMEOUT', default=60 * 15)
+
+# Facet counts are cached per filter set and catalog version; stock changes
+# do not bump the catalog version, so in-stock counts may lag this long
+FACET_CACHE_TIMEOUT = env.int('FACET_CACHE_TIMEOUT', default=60)
+
+# Tax and shipping used when no TaxRate or ShippingMethod applies (KES, percent)
+DEFAULT_TAX_RATE = env('DEFAULT_TAX_RATE', default='16')
+DEFAULT_SHIPPING_FEE = env('DEFAULT_SHIPPING_FEE', default='200')
+FREE_SHIPPING_OVER = env('FREE_SHIPPING_OVER', default='1000')
+
+# Processes pick up tax and shipping rule changes within this many seconds
+PRICING_RULES_CHECK_INTERVAL = env.float('PRICING_RULES_CHECK_INTERVAL', default=5)
+
+# Percentage off catalog prices per membership tier, e.g. {'gold': 5, 'platinum': 10}
+MEMBERSHIP_DISCOUNTS = {}
+
+# Coupon definitions are cached by code for this many seconds
+COUPON_CACHE_TIMEOUT = env.int('COUPON_CACHE_TIMEOUT', default=5 * 60)
+
+# Stock reserved for a cart or checkout is returned after this many seconds
+INVENTORY_HOLD_SECONDS = env.int('INVENTORY_HOLD_SECONDS', default=15 * 60)
+
+# Anonymous carts left untouched for this many days are deleted by the
+# delete_abandoned_carts command
+ANONYMOUS_CART_DAYS = env.int('ANONYMOUS_CART_DAYS', default=30)
+
+# Background task workers must finish a claimed task within this many seconds
+# before another worker may pick it up again
+BACKGROUND_TASK_LEASE_SECONDS = env.int('BACKGROUND_TASK_LEASE_SECONDS', default=5 * 60)
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -235,3 +271,35 @@ MPESA_CONSUMER_SECRET = env('MPESA_CONSUMER_SECRET', default='')
 MPESA_SHORTCODE = env('MPESA_SHORTCODE', default='')
 MPESA_PASSKEY = env('MPESA_PASSKEY', default='')
 MPESA_BASE_URL = env('MPESA_BASE_URL', default='https://sandbox.safaricom.co.ke')
+
+# Initiator credentials for reversals and B2C payments (refunds)
+MPESA_INITIATOR_NAME = env('MPESA_INITIATOR_NAME', default='')
+MPESA_SECURITY_CREDENTIAL = env('MPESA_SECURITY_CREDENTIAL', default='')
+
+# Payment processor per Payment.PaymentMethod; OPTIONS are passed to the
+# processor, e.g. {'MAX_CONCURRENCY': 8}. Register a card gateway with
+# 'card': {'BACKEND': 'path.to.CardProcessor'}
+PAYMENT_PROCESSORS = {
+    'mpesa': {'BACKEND': 'apps.orders.payment_processors.MpesaProcessor'},
+    'bank': {'BACKEND': 'apps.orders.payment_processors.BankTransferProcessor'},
+    'cash': {'BACKEND': 'apps.orders.payment_processors.CashOnDeliveryProcessor'},
+}
+
+# Refunds still processing this many seconds after they were claimed were
+# left behind by a crashed worker; they are marked as of unknown outcome
+REFUND_PROCESSING_TIMEOUT = env.int('REFUND_PROCESSING_TIMEOUT', default=900)
+
+# Daraja HTTP client: connect/read timeouts in seconds, retries with
+# exponential backoff (see apps.orders.mpesa for what each call retries),
+# and pooled connections per process
+MPESA_CONNECT_TIMEOUT = env.float('MPESA_CONNECT_TIMEOUT', default=3.05)
+MPESA_READ_TIMEOUT = env.float('MPESA_READ_TIMEOUT', default=15)
+MPESA_MAX_RETRIES = env.int('MPESA_MAX_RETRIES', default=3)
+MPESA_RETRY_BACKOFF = env.float('MPESA_RETRY_BACKOFF', default=0.5)
+MPESA_POOL_SIZE = env.int('MPESA_POOL_SIZE', default=10)
+
+# Pending payments are checked with Safaricom's STK query API only when the
+# callback has not arrived this many seconds after the prompt, and at most
+# once per interval for each checkout request
+MPESA_STATUS_QUERY_AFTER = env.int('MPESA_STATUS_QUERY_AFTER', default=30)
+MPESA_STATUS_QUERY_INTERVAL = env.int('MPESA_STATUS_QUERY_INTERVAL', default=15)